@@ -0,0 +1,222 @@
+"""
+batch_analysis.py
+-----------------
+多群批量分析：一次运行分析同一数据库中的多个群（指定群号列表或全部群）。
+
+逐个运行 main.py 时，每个群都要重新启动解释器、导入依赖、打开数据库并启动一个进程池。
+批量模式以“群”为调度单位：
+  - 数据库以只读方式（URI mode=ro）打开，每个工作进程只打开一个连接，处理分到的所有群；
+  - 群号列上有索引时，每个群用一次索引查询提取；没有索引时由主进程扫描一遍 group_msg_table，
+    按群拆分后再分发，避免每个群各扫描一遍整张表（已有缓存的群不参与扫描）；
+  - 整个群交给一个工作进程计算，群内用户对在该进程中串行计算，不再嵌套进程池；
+    消息多的群优先下发，使各进程的负载尽量均衡；
+  - 每个群输出 intimacy_<群号>.csv，save_metrics 为 True 时还输出原始指标文件（可用 --rescore 重新评分），
+    另外输出汇总表 batch_summary.csv（每个群的消息数、用户对数、得分最高的一对用户和用时）；
+  - 每个群的图表（radar_chart_multi_<群号> 等）由计算该群的工作进程在无界面后端上绘制，
+    各群的图表随群一起并行生成，图片格式和分辨率可配置；不需要图表时（plots=False）不导入 Matplotlib。
+各群计算过程中的日志不输出，只输出每个群的完成情况。
+"""
+
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+
+import pandas as pd
+
+from data_cache import DEFAULT_CACHE_DIR, cache_key, clean_and_store, is_cached, load_chat_data
+from extract_chat_data import connect_readonly, extract_groups, group_lookup_indexed, list_chat_groups
+from intimacy_analysis import calculate_intimacy_metrics
+from metrics_store import default_metrics_path
+from scoring import WEIGHTS
+
+# 默认输出目录
+DEFAULT_OUTPUT_DIR = "batch_output"
+# 汇总表文件名
+SUMMARY_FILE = "batch_summary.csv"
+
+# 工作进程中复用的数据库路径和只读连接
+_db_path_global = None
+_conn_global = None
+
+def _init_worker(db_path):
+    """工作进程初始化：打开一个只读连接，供该进程处理的所有群复用。"""
+    global _db_path_global, _conn_global
+    _db_path_global = db_path
+    _conn_global = connect_readonly(db_path)
+
+def default_options(**overrides) -> dict:
+    """
+    批量分析的参数，各群共用：
+      start, end: 时间范围；focus_user, prune, prune_min_overlap, top_k, weights, user_map:
+      同 calculate_intimacy_metrics；output_dir: 输出目录；cache_dir, use_cache: 同 load_chat_data；
+      csv_top: 各群 CSV 只输出前 N 对用户（None 为全部，0 为不输出）；save_metrics: 是否保存各群的原始指标文件；
+      plots: 是否生成各群的图表；top_n: 条形图显示的用户对数；font, plot_format, dpi: 图表的字体、格式和分辨率。
+    """
+    options = {
+        'start': None,
+        'end': None,
+        'focus_user': None,
+        'prune': False,
+        'prune_min_overlap': 1,
+        'top_k': None,
+        'weights': WEIGHTS,
+        'user_map': None,
+        'output_dir': DEFAULT_OUTPUT_DIR,
+        'cache_dir': DEFAULT_CACHE_DIR,
+        'use_cache': True,
+        'csv_top': None,
+        'save_metrics': False,
+        'plots': True,
+        'top_n': 30,
+        'font': "Microsoft YaHei",
+        'plot_format': "png",
+        'dpi': 150
+    }
+    options.update(overrides)
+    return options
+
+def _empty_summary(group_id):
+    """没有数据的群的汇总信息。"""
+    return {'group_id': group_id, 'status': 'empty', 'messages': 0, 'users': 0, 'pairs': 0,
+            'top_user1': '', 'top_name1': '', 'top_user2': '', 'top_name2': '', 'top_score': None, 'seconds': 0.0}
+
+def analyze_group(group_id, options, raw_df=None) -> dict:
+    """
+    分析单个群并写出该群的结果文件（在工作进程中执行）。
+
+    参数：
+        group_id: 群号。
+        options: default_options 返回的参数字典。
+        raw_df: 可选，主进程扫描得到的该群原始数据；为 None 时通过本进程的只读连接（或缓存）提取。
+    返回：
+        汇总信息字典，status 为 ok、empty（没有数据或结果为空）或 error: <原因>。
+    """
+    started = time.perf_counter()
+    summary = _empty_summary(group_id)
+    summary['status'] = 'ok'
+    try:
+        # 各群的过程日志不输出，避免多个进程的输出交错
+        with redirect_stdout(io.StringIO()):
+            summary.update(_analyze_group(group_id, options, raw_df))
+    except Exception as e:
+        summary['status'] = f"error: {e}"
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+def _analyze_group(group_id, options, raw_df):
+    if raw_df is None:
+        df, _ = load_chat_data(_db_path_global, group_id, options['start'], options['end'],
+                               cache_dir=options['cache_dir'], use_cache=options['use_cache'], conn=_conn_global)
+    else:
+        key = cache_key(_db_path_global, group_id, options['start'], options['end']) if options['use_cache'] else None
+        df = clean_and_store(raw_df, options['cache_dir'], key)
+    if df.empty:
+        return {'status': 'empty'}
+
+    output_dir = options['output_dir']
+    metrics_path = os.path.join(output_dir, default_metrics_path(group_id)) if options['save_metrics'] else None
+    metrics_df = calculate_intimacy_metrics(
+        df, user_name_map=options['user_map'], focus_user=options['focus_user'],
+        prune=options['prune'], prune_min_overlap=options['prune_min_overlap'], top_k=options['top_k'],
+        weights=options['weights'], raw_metrics_path=metrics_path,
+        max_workers=1
+    )
+    result = {'messages': len(df), 'users': df['sender_id'].nunique(), 'pairs': len(metrics_df)}
+    if metrics_df.empty:
+        result['status'] = 'empty'
+        return result
+    if options['csv_top'] != 0:
+        rows = metrics_df.head(options['csv_top']) if options['csv_top'] else metrics_df
+        rows.to_csv(os.path.join(output_dir, f"intimacy_{group_id}.csv"), index=False, encoding="gbk")
+    if options['plots']:
+        from visualization import chart_jobs, render_charts
+        # 各群已分散到不同的工作进程，群内的图表在本进程中逐个绘制
+        render_charts(chart_jobs(metrics_df, top_n=options['top_n'], group_id=group_id,
+                                 output_dir=output_dir, suffix=f"_{group_id}"),
+                      font=options['font'], fmt=options['plot_format'], dpi=options['dpi'], max_workers=1)
+    top_pair = metrics_df.iloc[0]
+    result.update({'top_user1': top_pair['user1'], 'top_name1': top_pair['name1'],
+                   'top_user2': top_pair['user2'], 'top_name2': top_pair['name2'],
+                   'top_score': top_pair['closeness_score']})
+    return result
+
+def run_batch(db_path, group_ids=None, options=None, max_workers=None) -> pd.DataFrame:
+    """
+    批量分析多个群，写出各群的结果文件和汇总表。
+
+    参数：
+        db_path: 数据库文件路径。
+        group_ids: 群号列表；为 None 时分析数据库中所有有消息的群。
+        options: default_options 返回的参数字典。
+        max_workers: 工作进程数，默认为 CPU 核数；为 1 时在当前进程中逐个分析。
+    返回：
+        汇总表 DataFrame（与 batch_summary.csv 内容相同），按 group_ids 的顺序排列。
+    """
+    options = options or default_options()
+    start, end = options['start'], options['end']
+    os.makedirs(options['output_dir'], exist_ok=True)
+
+    conn = connect_readonly(db_path)
+    try:
+        available = dict(list_chat_groups(conn, start, end))
+        if group_ids is None:
+            group_ids = list(available)
+        # 消息多的群优先下发
+        jobs = sorted((group_id for group_id in group_ids if group_id in available),
+                      key=lambda group_id: -available[group_id])
+        raw = {}
+        if len(jobs) > 1 and not group_lookup_indexed(conn):
+            to_scan = [group_id for group_id in jobs
+                       if not (options['use_cache']
+                               and is_cached(options['cache_dir'], cache_key(db_path, group_id, start, end)))]
+            if to_scan:
+                print(f"[INFO] 群号列上没有索引，扫描一遍 group_msg_table 提取 {len(to_scan)} 个群的数据...")
+                raw = extract_groups(conn, to_scan, start, end)
+    finally:
+        conn.close()
+
+    missing = len(group_ids) - len(jobs)
+    print(f"[INFO] 共 {len(group_ids)} 个群，其中 {missing} 个没有可提取的消息。")
+    summaries = {}
+
+    def report(summary):
+        summaries[summary['group_id']] = summary
+        prefix = f"[{len(summaries)}/{len(jobs)}] 群 {summary['group_id']}"
+        if summary['status'].startswith('error'):
+            print(f"[ERROR] {prefix} 分析失败：{summary['status'][len('error: '):]}")
+        else:
+            print(f"[INFO] {prefix}：{summary['messages']} 条消息，{summary['pairs']} 对用户，"
+                  f"用时 {summary['seconds']} 秒")
+
+    workers = min(max_workers or os.cpu_count() or 1, max(len(jobs), 1))
+    if workers == 1:
+        _init_worker(db_path)
+        try:
+            for group_id in jobs:
+                report(analyze_group(group_id, options, raw.pop(group_id, None)))
+        finally:
+            _conn_global.close()
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_path,)) as executor:
+            futures = [executor.submit(analyze_group, group_id, options, raw.pop(group_id, None))
+                       for group_id in jobs]
+            for future in as_completed(futures):
+                report(future.result())
+
+    summary_df = pd.DataFrame([summaries.get(group_id) or _empty_summary(group_id) for group_id in group_ids])
+    summary_path = os.path.join(options['output_dir'], SUMMARY_FILE)
+    summary_df.to_csv(summary_path, index=False, encoding="gbk")
+    print(f"汇总结果已保存到 {summary_path}")
+    return summary_df
+
+def parse_group_list(text):
+    """解析 --groups 参数：逗号分隔的群号列表，或 all（返回 None，表示所有群）。"""
+    if text.strip().lower() == "all":
+        return None
+    group_ids = [int(part) for part in text.split(",") if part.strip()]
+    if not group_ids:
+        raise ValueError("群号列表为空")
+    # 去重并保持原有顺序
+    return list(dict.fromkeys(group_ids))
@@ -0,0 +1,288 @@
+"""
+benchmark.py
+------------
+分阶段性能基准测试：在不同规模的合成数据库（见 synthetic_chat.py）上分别测量
+extract_chat_data、clean_chat_data、流水线方式的提取清洗和建立索引（pipelined_chat_index，
+可与前两个阶段之和比较）、calculate_intimacy_metrics、calculate_window_metrics 以及各绘图函数的耗时，结果保存为 JSON，便于比较不同提交之间的性能变化。
+
+  - 规模矩阵由 --scales 指定，格式为 消息数x用户数，多个规模以逗号分隔；
+  - 合成数据库按规模和随机种子保存在 --data-dir 中，下次运行（包括在其他提交上运行）直接复用，
+    保证比较的是同一份数据；
+  - 每个阶段重复运行 --repeat 次，记录每次的耗时和最短耗时；某个阶段出错时记录错误信息，
+    依赖它的阶段记为跳过，其余阶段照常运行；
+  - 结果 JSON 中同时记录 git 提交、Python 和依赖库版本以及 CPU 核数；
+  - --compare 与之前保存的结果比较，列出各阶段耗时的变化，变慢超过 --threshold 的阶段会给出提示。
+
+用法：
+    python benchmark.py --scales 10000x50,100000x200 --repeat 3
+    python benchmark.py --compare benchmark_<旧提交>.json
+    python benchmark.py --input benchmark_<新提交>.json --compare benchmark_<旧提交>.json
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import warnings
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import pandas as pd
+
+from clean_chat_data import clean_chat_data
+from extract_chat_data import extract_chat_data
+from intimacy_analysis import calculate_intimacy_metrics, calculate_window_metrics
+from pipeline import pipelined_chat_index
+from synthetic_chat import DEFAULT_GROUP_ID, SYNTHETIC_VERSION, generate_chat_db
+from visualization import plot_bar_chart, plot_comparison, plot_pair_trend, plot_radar_multi
+
+# 结果文件格式版本
+RESULT_VERSION = 1
+# 默认规模矩阵（消息数x用户数）
+DEFAULT_SCALES = "10000x50,100000x200,500000x500"
+DEFAULT_DATA_DIR = ".benchmark_data"
+# 趋势图使用的滑动窗口长度（秒）
+TREND_WINDOW_SECONDS = 30 * 86400
+
+# 各阶段：(名称, 依赖的阶段, 运行函数)；运行函数接收各阶段的输出和本次运行的参数，返回该阶段的输出
+STAGES = [
+    ('extract_chat_data', None,
+     lambda out, ctx: extract_chat_data(ctx['db_path'], DEFAULT_GROUP_ID)),
+    ('clean_chat_data', 'extract_chat_data',
+     lambda out, ctx: clean_chat_data(out['extract_chat_data'])),
+    ('pipelined_chat_index', None,
+     lambda out, ctx: pipelined_chat_index(ctx['db_path'], DEFAULT_GROUP_ID)),
+    ('calculate_intimacy_metrics', 'clean_chat_data',
+     lambda out, ctx: calculate_intimacy_metrics(out['clean_chat_data'], max_workers=ctx['workers'])),
+    ('calculate_window_metrics', 'clean_chat_data',
+     lambda out, ctx: calculate_window_metrics(out['clean_chat_data'], TREND_WINDOW_SECONDS,
+                                               max_workers=ctx['workers'])),
+    ('plot_radar_multi', 'calculate_intimacy_metrics',
+     lambda out, ctx: plot_radar_multi(out['calculate_intimacy_metrics'].head(5),
+                                       output_prefix=os.path.join(ctx['plot_dir'], "radar_chart_multi"))),
+    ('plot_bar_chart', 'calculate_intimacy_metrics',
+     lambda out, ctx: plot_bar_chart(out['calculate_intimacy_metrics'], top_n=30,
+                                     output_prefix=os.path.join(ctx['plot_dir'], "bar_chart"))),
+    ('plot_comparison', 'calculate_intimacy_metrics',
+     lambda out, ctx: plot_comparison(out['calculate_intimacy_metrics'].iloc[0],
+                                      output_prefix=os.path.join(ctx['plot_dir'], "comparison_chart"))),
+    ('plot_pair_trend', 'calculate_window_metrics',
+     lambda out, ctx: plot_pair_trend(out['calculate_window_metrics'],
+                                      output_prefix=os.path.join(ctx['plot_dir'], "trend_chart"))),
+]
+STAGE_NAMES = [name for name, _, _ in STAGES]
+
+def parse_scales(text):
+    """解析规模矩阵，例如 "10000x50,100000x200"，返回 [(消息数, 用户数), ...]。"""
+    scales = []
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        try:
+            messages, users = (int(value) for value in part.lower().split("x"))
+        except ValueError:
+            raise ValueError(f"无效的规模：{part}（格式为 消息数x用户数，例如 100000x200）")
+        if messages < 1 or users < 2:
+            raise ValueError(f"无效的规模：{part}（至少 1 条消息、2 位用户）")
+        scales.append((messages, users))
+    if not scales:
+        raise ValueError("规模矩阵为空")
+    return scales
+
+def _git_commit():
+    """当前的 git 提交（短哈希，工作区有未提交的修改时加 -dirty）；不在 git 仓库中时返回 None。"""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=cwd, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=cwd,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+def _environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'matplotlib': matplotlib.__version__
+    }
+
+def synthetic_db(data_dir, messages, users, seed=0):
+    """返回该规模的合成数据库路径，不存在时生成。"""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"synthetic_v{SYNTHETIC_VERSION}_{messages}x{users}_seed{seed}.db")
+    if not os.path.exists(path):
+        print(f"[INFO] 正在生成合成数据库 {path} ...")
+        tmp_path = path + ".tmp"
+        generate_chat_db(tmp_path, users=users, messages=messages, seed=seed)
+        os.replace(tmp_path, path)
+    return path
+
+def run_scale(db_path, stages, repeat=3, workers=None) -> dict:
+    """
+    在一个数据库上依次运行各阶段。
+
+    参数：
+        db_path: 合成数据库路径。
+        stages: 需要运行的阶段名称（依赖的阶段会自动加入）。
+        repeat: 每个阶段的重复次数。
+        workers: 传给 calculate_intimacy_metrics 的进程数。
+    返回：
+        {阶段名称: {'seconds': 最短耗时, 'runs': [各次耗时]} 或 {'error': 错误信息}}。
+    """
+    results, outputs = {}, {}
+    with tempfile.TemporaryDirectory() as plot_dir:
+        ctx = {'db_path': db_path, 'workers': workers, 'plot_dir': plot_dir}
+        for name, depends, func in STAGES:
+            if name not in stages:
+                continue
+            if depends is not None and depends not in outputs:
+                results[name] = {'error': f"跳过：依赖的阶段 {depends} 没有结果"}
+                print(f"  {name:<28}{'跳过':>10}")
+                continue
+            runs = []
+            try:
+                for _ in range(repeat):
+                    # 各函数的过程日志和缺少字体、字形的警告不输出
+                    with redirect_stdout(io.StringIO()), warnings.catch_warnings():
+                        warnings.simplefilter("ignore")
+                        started = time.perf_counter()
+                        output = func(outputs, ctx)
+                        runs.append(time.perf_counter() - started)
+            except Exception as e:
+                results[name] = {'error': f"{type(e).__name__}: {e}"}
+                print(f"[WARN] {name} 出错：{results[name]['error']}")
+                continue
+            outputs[name] = output
+            results[name] = {'seconds': round(min(runs), 6), 'runs': [round(run, 6) for run in runs]}
+            if isinstance(output, pd.DataFrame):
+                results[name]['rows'] = len(output)
+            print(f"  {name:<28}{min(runs):>10.3f} 秒")
+    return results
+
+def _with_dependencies(selected):
+    """补全所选阶段依赖的阶段。"""
+    depends_on = {name: depends for name, depends, _ in STAGES}
+    stages = set()
+    for name in selected:
+        while name is not None and name not in stages:
+            stages.add(name)
+            name = depends_on[name]
+    return stages
+
+def run_benchmark(scales, stages=None, repeat=3, workers=None, data_dir=DEFAULT_DATA_DIR, seed=0) -> dict:
+    """
+    在规模矩阵上运行基准测试，返回可直接保存为 JSON 的结果字典。
+
+    参数：
+        scales: [(消息数, 用户数), ...]。
+        stages: 可选，只运行这些阶段（及其依赖）；默认运行全部阶段。
+        repeat, workers: 同 run_scale。
+        data_dir: 合成数据库的保存目录。
+        seed: 生成合成数据的随机种子。
+    """
+    stages = _with_dependencies(stages or STAGE_NAMES)
+    logging.getLogger('matplotlib.font_manager').setLevel(logging.ERROR)
+    report = {
+        'version': RESULT_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'environment': _environment(),
+        'settings': {'repeat': repeat, 'workers': workers, 'seed': seed, 'synthetic_version': SYNTHETIC_VERSION},
+        'results': []
+    }
+    for messages, users in scales:
+        db_path = synthetic_db(data_dir, messages, users, seed)
+        print(f"[INFO] 规模 {messages}x{users}：")
+        report['results'].append({
+            'scale': f"{messages}x{users}",
+            'messages': messages,
+            'users': users,
+            'stages': run_scale(db_path, stages, repeat, workers)
+        })
+    return report
+
+def compare_results(baseline, current, threshold=0.1) -> list:
+    """
+    比较两次基准测试结果中相同规模、相同阶段的最短耗时，打印对比表。
+
+    参数：
+        baseline, current: run_benchmark 返回（或从 JSON 读取）的结果字典。
+        threshold: 耗时增加超过该比例时视为变慢。
+    返回：
+        变慢的 [(规模, 阶段, 基准耗时, 当前耗时), ...]。
+    """
+    base = {(entry['scale'], name): stage for entry in baseline['results'] for name, stage in entry['stages'].items()}
+    print(f"基准：{baseline.get('commit')}（{baseline.get('created')}）  当前：{current.get('commit')}（{current.get('created')}）")
+    print(f"{'规模':<16}{'阶段':<30}{'基准(秒)':>10}{'当前(秒)':>10}{'变化':>10}")
+    slower = []
+    for entry in current['results']:
+        for name, stage in entry['stages'].items():
+            old = base.get((entry['scale'], name))
+            if old is None or 'seconds' not in old or 'seconds' not in stage:
+                note = stage.get('error') or (old or {}).get('error') or "无可比较的结果"
+                print(f"{entry['scale']:<16}{name:<30}{'-':>10}{'-':>10}  {note}")
+                continue
+            change = stage['seconds'] / old['seconds'] - 1 if old['seconds'] > 0 else 0.0
+            flag = ""
+            if change > threshold:
+                flag = "  变慢"
+                slower.append((entry['scale'], name, old['seconds'], stage['seconds']))
+            print(f"{entry['scale']:<16}{name:<30}{old['seconds']:>10.3f}{stage['seconds']:>10.3f}{change:>+10.1%}{flag}")
+    if slower:
+        print(f"[WARN] 共 {len(slower)} 个阶段的耗时增加超过 {threshold:.0%}。")
+    return slower
+
+def _load_report(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="分阶段性能基准测试")
+    parser.add_argument("--scales", type=str, default=DEFAULT_SCALES, help=f"规模矩阵，格式为 消息数x用户数，逗号分隔，默认 {DEFAULT_SCALES}")
+    parser.add_argument("--stages", type=str, default=None, help=f"只运行指定的阶段（逗号分隔，依赖的阶段自动加入），可选：{','.join(STAGE_NAMES)}")
+    parser.add_argument("--repeat", type=int, default=3, help="每个阶段的重复次数，默认 3")
+    parser.add_argument("--workers", type=int, default=None, help="计算指标时的进程数，默认为 CPU 核数")
+    parser.add_argument("--seed", type=int, default=0, help="合成数据的随机种子，默认 0")
+    parser.add_argument("--data-dir", type=str, default=DEFAULT_DATA_DIR, help=f"合成数据库的保存目录，默认 {DEFAULT_DATA_DIR}")
+    parser.add_argument("--output", type=str, default=None, help="结果 JSON 的路径，默认为 benchmark_<git 提交>.json")
+    parser.add_argument("--input", type=str, default=None, help="不运行测试，直接读取该结果 JSON（与 --compare 配合）")
+    parser.add_argument("--compare", type=str, default=None, help="与之前保存的结果 JSON 比较")
+    parser.add_argument("--threshold", type=float, default=0.1, help="比较时视为变慢的耗时增加比例，默认 0.1")
+    args = parser.parse_args()
+
+    if args.input:
+        report = _load_report(args.input)
+    else:
+        try:
+            scales = parse_scales(args.scales)
+            stages = [name.strip() for name in args.stages.split(",") if name.strip()] if args.stages else None
+            unknown = [name for name in stages or [] if name not in STAGE_NAMES]
+            if unknown:
+                raise ValueError(f"未知的阶段：{', '.join(unknown)}")
+        except ValueError as e:
+            print(f"[ERROR] 参数无效：{e}")
+            return
+        report = run_benchmark(scales, stages, max(1, args.repeat), args.workers, args.data_dir, args.seed)
+        output = args.output or f"benchmark_{report['commit'] or 'local'}.json"
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基准测试结果已保存到 {output}")
+
+    if args.compare:
+        compare_results(_load_report(args.compare), report, args.threshold)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+benchmark_cleaning.py
+---------------------
+数据清洗吞吐量基准测试：
+  - 生成指定行数（默认一百万行）的合成聊天数据，昵称和消息内容中混入方向控制符、零宽字符、
+    Emoji、韩文填充字符以及括号内的 QQ 号；
+  - 分别测量 clean_chat_data 在普通文本列（保留消息原文时）和分类列（extract_chat_data 默认输出）
+    上的耗时，以及逐行正则清洗的旧实现作为对照；
+  - 输出每种方式的每秒处理消息数。
+
+用法：
+    python benchmark_cleaning.py --rows 1000000
+"""
+
+import argparse
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from clean_chat_data import clean_chat_data
+
+# 合成消息使用的文本片段与特殊字符
+TEXT_PIECES = ['哈哈', '好的', 'ok', '明天见', '在吗', '？', '123', 'hello world', '收到', '……']
+NOISE_CHARS = ['\u200B', '\u202E', '\uFEFF', '\u3164', '\U0001F600', '\U0001F389', '\U0001F914']
+
+def make_frame(rows: int, users: int = 500, seed: int = 0) -> pd.DataFrame:
+    """生成合成聊天数据，字段与 extract_chat_data(keep_content=True) 的输出一致（文本列为普通字符串）。"""
+    rng = np.random.default_rng(seed)
+    ids = [str(100000 + i) for i in range(users)]
+    names = []
+    for i, qq in enumerate(ids):
+        name = f"用户{i}" + NOISE_CHARS[i % len(NOISE_CHARS)]
+        names.append(f"{name}({qq})" if i % 3 == 0 else name)
+    senders = rng.integers(0, users, rows)
+    # 消息内容从有限的模板中抽取，兼顾重复内容和带特殊字符的内容
+    templates = [a + b + c for a in TEXT_PIECES for b in [''] + NOISE_CHARS for c in TEXT_PIECES]
+    contents = rng.integers(0, len(templates), rows)
+    return pd.DataFrame({
+        'sender_id': np.array(ids, dtype=object)[senders],
+        'sender_nickname': np.array(names, dtype=object)[senders],
+        'content': np.array(templates, dtype=object)[contents],
+        'timestamp': np.sort(rng.integers(1_600_000_000, 1_700_000_000, rows)),
+    })
+
+def legacy_clean(df: pd.DataFrame) -> pd.DataFrame:
+    """逐行调用正则表达式的旧清洗实现，仅用于对照。"""
+    def clean_text(text):
+        text = re.sub(r'[\u200E\u200F\u202A-\u202E\u2066-\u2069\u200B\uFEFF]', '', text)
+        text = re.sub(r'[\U0001F300-\U0001F6FF\U0001F900-\U0001F9FF]', '', text)
+        return re.sub(r'[\u3164]', '', text)
+
+    def strip_id_from_name(name):
+        name = name.strip()
+        m = re.match(r'^(.*?)\s*\(([^)]+)\)\s*$', name) if name else None
+        return m.group(1).strip() if m and m.group(2).strip() else name
+
+    df = df.dropna(subset=['sender_id', 'content']).copy()
+    df = df[~df['sender_id'].isin(['2854196310', '10000'])]
+    df['sender_id'] = df['sender_id'].astype(str)
+    df['sender_nickname'] = df['sender_nickname'].astype(str).apply(clean_text).apply(strip_id_from_name)
+    df['content'] = df['content'].astype(str).apply(clean_text)
+    return df[df['sender_nickname'].str.strip() != '']
+
+def measure(label: str, func, df: pd.DataFrame) -> float:
+    """运行一次 func(df)，打印耗时与每秒处理消息数，返回耗时（秒）。"""
+    start = time.perf_counter()
+    func(df)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28}{elapsed:>8.2f} 秒  {len(df) / elapsed:>14,.0f} 条/秒")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="数据清洗吞吐量基准测试")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="合成消息条数，默认为一百万")
+    parser.add_argument("--users", type=int, default=500, help="合成用户数，默认为 500")
+    parser.add_argument("--skip-legacy", action="store_true", help="不运行逐行正则清洗的旧实现")
+    args = parser.parse_args()
+
+    df = make_frame(args.rows, args.users)
+    categorical = df.astype({'sender_id': 'category', 'sender_nickname': 'category'})
+    print(f"[INFO] 合成数据：{len(df):,} 条消息，{args.users} 位用户")
+    measure("clean_chat_data（文本列）", clean_chat_data, df)
+    measure("clean_chat_data（分类列）", clean_chat_data, categorical)
+    lengths_only = categorical.drop(columns=['content'])
+    lengths_only['content_length'] = df['content'].str.len().astype(np.int32)
+    measure("clean_chat_data（仅长度）", clean_chat_data, lengths_only)
+    if not args.skip_legacy:
+        measure("逐行正则（旧实现）", legacy_clean, df)
+
+if __name__ == "__main__":
+    main()
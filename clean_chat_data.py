@@ -11,8 +11,24 @@ clean_chat_data.py
 """
 
 import re
+import numpy as np
 import pandas as pd
 
+# 清洗规则版本：修改清洗规则时递增，使依赖清洗结果的缓存（见 data_cache.py）失效
+CLEAN_VERSION = 1
+
+# 清洗时删除的字符：方向控制符、零宽字符、BOM、常见 Emoji（U+1F300-U+1F6FF、U+1F900-U+1F9FF）、韩文填充字符
+STRIPPED_CHAR_RANGES = [
+    (0x200E, 0x200F), (0x202A, 0x202E), (0x2066, 0x2069), (0x200B, 0x200B), (0xFEFF, 0xFEFF),
+    (0x1F300, 0x1F6FF), (0x1F900, 0x1F9FF),
+    (0x3164, 0x3164),
+]
+# str.translate 使用的删除表，一次遍历即可删除以上全部字符
+_STRIP_TABLE = {code: None for start, end in STRIPPED_CHAR_RANGES for code in range(start, end + 1)}
+
+# 昵称末尾括号内的附加信息（如 QQ 号或邮箱），非贪婪匹配，允许括号前后有空格
+_NAME_SUFFIX_PATTERN = re.compile(r'^(.*?)\s*\(([^)]+)\)\s*$')
+
 def clean_text(text: str) -> str:
     """
     清除文本中的特殊 Unicode 字符。
@@ -23,16 +39,16 @@ def clean_text(text: str) -> str:
     """
     if text is None:
         return ""
-    # 去除方向控制字符、零宽字符、BOM 等
-    pattern1 = r'[\u200E\u200F\u202A-\u202E\u2066-\u2069\u200B\uFEFF]'
-    text = re.sub(pattern1, '', text)
-    # 去除 Emoji 表情（常见 Emoji 范围）
-    pattern2 = r'[\U0001F300-\U0001F6FF\U0001F900-\U0001F9FF]'
-    text = re.sub(pattern2, '', text)
-    # 去除韩文填充字符 (通常 U+3164)
-    pattern3 = r'[\u3164]'
-    text = re.sub(pattern3, '', text)
-    return text
+    return text.translate(_STRIP_TABLE)
+
+def cleaned_length(text) -> int:
+    """
+    返回文本经 clean_text 清洗后的字符数（非字符串按 str() 处理，与 astype(str) 一致）。
+    可注册为 SQLite 自定义函数，使消息长度在查询中直接算出，消息原文不必进入 DataFrame。
+    """
+    if not isinstance(text, str):
+        text = str(text)
+    return len(text.translate(_STRIP_TABLE))
 
 def strip_id_from_name(name: str) -> str:
     """
@@ -47,13 +63,33 @@ def strip_id_from_name(name: str) -> str:
     name = name.strip()
     if not name:
         return name
-    # 使用非贪婪匹配，允许括号前后有空格
-    m = re.match(r'^(.*?)\s*\(([^)]+)\)\s*$', name)
+    m = _NAME_SUFFIX_PATTERN.match(name)
     if m and m.group(2).strip():
         return m.group(1).strip()
     else:
         return name
 
+def clean_nickname(name: str) -> str:
+    """清除昵称中的特殊字符并去除括号内的附加信息。"""
+    return strip_id_from_name(clean_text(name))
+
+def _map_text(series: pd.Series, func) -> pd.Series:
+    """
+    对文本列逐值应用 func，等价于 series.astype(str).apply(func)，但每个不同的取值只处理一次。
+    分类类型的列直接按类别处理，结果仍为分类类型。
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        # 缺失值（编号 -1）按 astype(str) 的行为视为 'nan'，放在末尾以便用 -1 直接索引
+        mapped = [func(str(category)) for category in series.cat.categories] + [func('nan')]
+        new_codes, new_categories = pd.factorize(pd.Series(mapped, dtype=object))
+        categorical = pd.Categorical.from_codes(new_codes[codes], categories=new_categories)
+        return pd.Series(categorical.remove_unused_categories(), index=series.index)
+    text = series.astype(str)
+    codes, uniques = pd.factorize(text, use_na_sentinel=False)
+    mapped = np.array([func(value) for value in uniques], dtype=object)
+    return pd.Series(mapped[codes], index=series.index, dtype=text.dtype)
+
 def clean_chat_data(df: pd.DataFrame) -> pd.DataFrame:
     """
     清洗聊天数据：
@@ -62,27 +98,30 @@ def clean_chat_data(df: pd.DataFrame) -> pd.DataFrame:
       3. 清除 sender_nickname 和 content 中的特殊 Unicode 字符（包括 Emoji 和韩文填充字符）。
       4. 去除 sender_nickname 中括号内的附加信息。
       5. 删除 sender_nickname 为空或仅包含空格的记录。
+
+    昵称只对每个不同的取值清洗一次；sender_id、sender_nickname 为分类类型时（见 extract_chat_data）
+    直接按类别处理并保持分类类型。消息内容通过 str.translate 删除表做一次向量化清洗；
+    若数据中没有 content 而只有提取时已按清洗后文本计算的 content_length，则跳过消息内容的清洗。
     
     参数：
-        df: 原始聊天数据 DataFrame，必须包含 'sender_id', 'sender_nickname', 'content' 字段。
+        df: 原始聊天数据 DataFrame，必须包含 'sender_id', 'sender_nickname' 以及 'content' 或 'content_length' 字段。
     
     返回：
         清洗后的 DataFrame。
     """
     # 删除 sender_id 或 content 为空的记录
-    df = df.dropna(subset=['sender_id', 'content']).copy()
+    subset = [col for col in ('sender_id', 'content', 'content_length') if col in df.columns]
+    df = df.dropna(subset=subset).copy()
     df = df[~df['sender_id'].isin(['2854196310', '10000'])]
 
 
     # 将 sender_id 转换为字符串
-    df['sender_id'] = df['sender_id'].astype(str)
-
-    # 清洗 sender_nickname 和 content 中的特殊字符
-    df['sender_nickname'] = df['sender_nickname'].astype(str).apply(clean_text)
-    df['content'] = df['content'].astype(str).apply(clean_text)
+    df['sender_id'] = _map_text(df['sender_id'], str)
 
-    # 去除 sender_nickname 中括号内的附加信息（如 QQ 号或邮箱）
-    df['sender_nickname'] = df['sender_nickname'].apply(strip_id_from_name)
+    # 清洗 sender_nickname 和 content 中的特殊字符，并去除 sender_nickname 中括号内的附加信息（如 QQ 号或邮箱）
+    df['sender_nickname'] = _map_text(df['sender_nickname'], clean_nickname)
+    if 'content' in df.columns:
+        df['content'] = df['content'].astype(str).str.translate(_STRIP_TABLE)
 
     # 删除 sender_nickname 为空或仅包含空格的记录
     df = df[df['sender_nickname'].str.strip() != '']
@@ -90,11 +129,15 @@ def clean_chat_data(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 if __name__ == "__main__":
-    # 测试代码：假设 test.csv 包含 sender_id, sender_nickname, content 字段
-    try:
-        df_test = pd.read_csv("test.csv")
-        df_clean = clean_chat_data(df_test)
-        print("清洗后的数据预览：")
-        print(df_clean.head())
-    except Exception as e:
-        print(f"测试数据加载或处理出错: {e}")
+    # 测试代码：生成一个小的合成数据库（见 synthetic_chat.py），提取并清洗后预览结果
+    import os
+    import tempfile
+    from extract_chat_data import extract_chat_data
+    from synthetic_chat import DEFAULT_GROUP_ID, generate_chat_db
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "synthetic.db")
+        generate_chat_db(db_path, users=20, messages=500, emoji_rate=0.3)
+        df_test = extract_chat_data(db_path, DEFAULT_GROUP_ID, keep_content=True)
+    df_clean = clean_chat_data(df_test)
+    print(f"清洗前 {len(df_test)} 条记录，清洗后 {len(df_clean)} 条。清洗后的数据预览：")
+    print(df_clean.head())
@@ -0,0 +1,119 @@
+"""
+coactivity.py
+-------------
+基于活跃时段的共同活跃度剪枝。
+
+大群中的绝大多数用户对从未在相近的时间发言，它们的综合得分几乎都处于最低区间。
+本模块把每个用户的消息按固定时长（默认 1 小时）划分为活跃时段，统计两人的共同活跃时段数，
+在正式计算前剔除共同活跃度为 0 或过低的用户对：
+
+  - 共同活跃时段数：用户 i 的活跃时段中，用户 j 在同一时段或相邻时段也有发言的个数
+    （双向统计后取较大值，相邻时段用于覆盖跨越整点的对话）；
+  - 被剪枝的用户对不再计算各项指标，综合得分直接记为下限 PRUNED_PAIR_SCORE。
+"""
+
+import numpy as np
+
+# 被剪枝用户对的综合得分下限
+PRUNED_PAIR_SCORE = 0.0
+# 默认活跃时段长度（秒）
+DEFAULT_BUCKET_SECONDS = 3600
+# 计算共同活跃矩阵时每次处理的时段列数，用于限制内存占用
+BUCKET_BLOCK_SIZE = 4096
+
+def _unique_pairs(codes, buckets):
+    """
+    对 (用户编号, 时段) 组合去重，返回按用户、时段排序的 (codes, buckets, 出现次数)。
+
+    两列合成一个 int64 键后做一维去重，比 np.unique(..., axis=0) 的按行排序快得多。
+    """
+    if len(codes) == 0:
+        return codes, buckets, np.zeros(0, dtype=np.int64)
+    base = buckets.min()
+    width = buckets.max() - base + 1
+    keys, counts = np.unique(codes * width + (buckets - base), return_counts=True)
+    return keys // width, keys % width + base, counts
+
+def _user_buckets(index, bucket_seconds):
+    """
+    返回所有 (用户编号, 活跃时段) 的去重组合及该用户在该时段的消息数，三个等长 int64 数组。
+    """
+    counts = index['counts']
+    codes = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+    buckets = index['times'] // bucket_seconds
+    codes, buckets, messages = _unique_pairs(codes, buckets)
+    return codes, buckets, messages.astype(np.int64)
+
+def _near_activity_product(index, bucket_seconds, count_messages):
+    """
+    计算矩阵 M，M[i, j] 为用户 i 的活跃时段中、用户 j 在同一或相邻时段也有发言的时段数
+    （count_messages 为 True 时改为统计这些时段中用户 i 的消息条数）。
+    """
+    num_users = len(index['counts'])
+    codes, buckets, messages = _user_buckets(index, bucket_seconds)
+    weights = messages.astype(np.float64) if count_messages else np.ones(len(codes))
+    # 扩展到相邻时段后的活跃标记
+    dilated_codes = np.concatenate((codes, codes, codes))
+    dilated_buckets = np.concatenate((buckets - 1, buckets, buckets + 1))
+    dilated_codes, dilated_buckets, _ = _unique_pairs(dilated_codes, dilated_buckets)
+
+    # 只保留至少两位用户（扩展后）活跃的时段，其余时段不会产生跨用户的重叠
+    uniq, users_per_bucket = np.unique(dilated_buckets, return_counts=True)
+    shared = uniq[users_per_bucket >= 2]
+    product = np.zeros((num_users, num_users), dtype=np.float64)
+    if len(shared) == 0:
+        return product.astype(np.int64)
+
+    keep = np.isin(buckets, shared)
+    codes, cols, weights = codes[keep], np.searchsorted(shared, buckets[keep]), weights[keep]
+    keep = np.isin(dilated_buckets, shared)
+    dilated_codes, dilated_cols = dilated_codes[keep], np.searchsorted(shared, dilated_buckets[keep])
+
+    # 按列分块构造矩阵并做矩阵乘法，累加得到重叠计数
+    for start in range(0, len(shared), BUCKET_BLOCK_SIZE):
+        end = min(start + BUCKET_BLOCK_SIZE, len(shared))
+        active = np.zeros((num_users, end - start), dtype=np.float64)
+        near = np.zeros((num_users, end - start), dtype=np.float64)
+        mask = (cols >= start) & (cols < end)
+        active[codes[mask], cols[mask] - start] = weights[mask]
+        mask = (dilated_cols >= start) & (dilated_cols < end)
+        near[dilated_codes[mask], dilated_cols[mask] - start] = 1.0
+        product += active @ near.T
+    return np.rint(product).astype(np.int64)
+
+def co_activity_overlap(index, bucket_seconds=DEFAULT_BUCKET_SECONDS):
+    """
+    计算所有用户两两之间的共同活跃时段数。
+
+    参数：
+        index: build_message_index 返回的消息索引。
+        bucket_seconds: 活跃时段长度（秒）。
+    返回：
+        用户数 × 用户数 的 int64 对称矩阵。
+    """
+    product = _near_activity_product(index, bucket_seconds, count_messages=False)
+    return np.maximum(product, product.T)
+
+def co_activity_messages(index, bucket_seconds=DEFAULT_BUCKET_SECONDS):
+    """
+    计算每位用户在与另一位用户共同活跃的时段中发送的消息数。
+
+    返回：
+        用户数 × 用户数 的 int64 矩阵 M，M[i, j] 为用户 i 在用户 j 同时或相邻时段也有发言的时段内的消息数。
+        只要活跃时段不短于 60 秒，两人间任何间隔不超过 60 秒的交替回复，其两条消息都会被计入。
+    """
+    return _near_activity_product(index, bucket_seconds, count_messages=True)
+
+def prune_pairs(pairs, overlap, min_overlap=1):
+    """
+    按共同活跃时段数拆分用户对。
+
+    参数：
+        pairs: (n, 2) 用户编号数组。
+        overlap: co_activity_overlap 返回的矩阵。
+        min_overlap: 保留用户对所需的最少共同活跃时段数。
+    返回：
+        (kept, pruned) 两个用户编号数组，均保持原始顺序。
+    """
+    keep = overlap[pairs[:, 0], pairs[:, 1]] >= min_overlap
+    return pairs[keep], pairs[~keep]
@@ -0,0 +1,174 @@
+"""
+data_cache.py
+-------------
+清洗后聊天数据的磁盘缓存。
+
+只更换图表、--focus-user 或权重时，数据库内容并没有变化，无需每次重新提取和清洗。
+本模块将 extract_chat_data + clean_chat_data 的结果按列保存为 NumPy 归档（.npz）：
+
+  - 缓存键由数据库路径、文件大小和修改时间（WAL 模式下包括 -wal 文件）、群号、时间范围
+    以及清洗规则版本 CLEAN_VERSION 共同决定，任一项变化都会使缓存失效；
+  - 分类列保存为编号数组和类别数组，读取时还原为分类类型，不需要 pickle；
+  - 淘汰策略：写入新缓存后删除超过 CACHE_MAX_AGE_DAYS 天未使用的文件，
+    若总大小仍超过 CACHE_MAX_BYTES，则按最近使用时间从旧到新删除。
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from clean_chat_data import CLEAN_VERSION, clean_chat_data
+from extract_chat_data import _to_epoch_seconds, extract_chat_data
+import profiling
+
+# 默认缓存目录
+DEFAULT_CACHE_DIR = ".intimacy_cache"
+# 缓存目录的总大小上限（字节）
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+# 超过该天数未使用的缓存文件会被删除
+CACHE_MAX_AGE_DAYS = 30
+# 缓存文件格式版本
+CACHE_FORMAT = 1
+
+# 以分类类型保存的列
+_CATEGORICAL_COLUMNS = ('sender_id', 'sender_nickname')
+
+def _file_signature(path):
+    """返回文件的 [大小, 修改时间（纳秒）]，文件不存在时返回 None。"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def cache_key(db_path, group_id, start=None, end=None) -> str:
+    """根据数据库指纹、群号、时间范围和清洗规则版本计算缓存键。"""
+    fingerprint = {
+        'db': os.path.realpath(db_path),
+        'file': _file_signature(db_path),
+        'wal': _file_signature(db_path + '-wal'),
+        'group': int(group_id),
+        'start': _to_epoch_seconds(start),
+        'end': _to_epoch_seconds(end),
+        'clean_version': CLEAN_VERSION,
+        'format': CACHE_FORMAT
+    }
+    return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _cache_path(cache_dir, key):
+    return os.path.join(cache_dir, f"cleaned_{key}.npz")
+
+def is_cached(cache_dir, key) -> bool:
+    """缓存文件是否存在（不读取内容）。"""
+    return os.path.exists(_cache_path(cache_dir, key))
+
+def load_cleaned(cache_dir, key):
+    """读取缓存的清洗后数据，不存在或损坏时返回 None。读取成功会刷新文件的使用时间。"""
+    path = _cache_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as archive:
+            columns = json.loads(str(archive['columns']))
+            data = {}
+            for col in columns:
+                if col in _CATEGORICAL_COLUMNS:
+                    data[col] = pd.Categorical.from_codes(archive[col + '.codes'],
+                                                          categories=archive[col + '.categories'].tolist())
+                else:
+                    data[col] = archive[col]
+    except Exception as e:
+        print(f"[WARN] 缓存文件 {path} 无法读取，将重新提取：{e}")
+        return None
+    os.utime(path)
+    return pd.DataFrame(data, columns=columns)
+
+def store_cleaned(cache_dir, key, df):
+    """将清洗后的数据写入缓存（先写临时文件再替换）。"""
+    os.makedirs(cache_dir, exist_ok=True)
+    arrays = {'columns': np.array(json.dumps(list(df.columns)))}
+    for col in df.columns:
+        if col in _CATEGORICAL_COLUMNS:
+            series = df[col].astype('category')
+            arrays[col + '.codes'] = series.cat.codes.to_numpy()
+            arrays[col + '.categories'] = np.array([str(c) for c in series.cat.categories], dtype=str)
+        else:
+            arrays[col] = df[col].to_numpy()
+    path = _cache_path(cache_dir, key)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+def evict(cache_dir, max_bytes=CACHE_MAX_BYTES, max_age_days=CACHE_MAX_AGE_DAYS):
+    """按使用时间和总大小淘汰缓存文件，返回删除的文件数。"""
+    if not os.path.isdir(cache_dir):
+        return 0
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.startswith('cleaned_') and name.endswith('.npz'):
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    removed = 0
+    total = sum(size for _, size, _ in entries)
+    deadline = time.time() - max_age_days * 86400
+    for used_at, size, path in entries:
+        if used_at >= deadline and total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        removed += 1
+    return removed
+
+def clean_and_store(df, cache_dir=DEFAULT_CACHE_DIR, key=None):
+    """
+    清洗提取得到的原始数据，key 不为 None 时把结果写入缓存并执行淘汰。
+
+    返回：
+        清洗后的 DataFrame（索引已重置）。
+    """
+    if df.empty:
+        return df
+    print(f"提取到 {len(df)} 条消息记录。")
+    print("正在清洗数据...")
+    with profiling.stage('clean', rows_in=len(df)) as record:
+        df = clean_chat_data(df).reset_index(drop=True)
+        record['rows_out'] = len(df)
+    if key is not None and not df.empty:
+        try:
+            store_cleaned(cache_dir, key, df)
+            evict(cache_dir)
+        except OSError as e:
+            print(f"[WARN] 写入缓存失败：{e}")
+    return df
+
+def load_chat_data(db_path, group_id, start=None, end=None, cache_dir=DEFAULT_CACHE_DIR, use_cache=True,
+                   conn=None):
+    """
+    返回提取并清洗后的聊天数据，优先读取缓存；未命中时提取、清洗并写入缓存。
+
+    参数：
+        db_path, group_id, start, end: 同 extract_chat_data。
+        cache_dir: 缓存目录。
+        use_cache: 为 False 时不读也不写缓存。
+        conn: 可选，提取时复用的已打开连接（批量模式下每个工作进程一个只读连接）。
+    返回：
+        (df, from_cache)：清洗后的 DataFrame，以及是否来自缓存。
+    """
+    key = cache_key(db_path, group_id, start, end) if use_cache else None
+    if use_cache:
+        with profiling.stage('load_cache') as record:
+            df = load_cleaned(cache_dir, key)
+            record['rows_out'] = None if df is None else len(df)
+        if df is not None:
+            return df, True
+    with profiling.stage('extract') as record:
+        df = extract_chat_data(db_path, group_id, start=start, end=end, conn=conn)
+        record['rows_out'] = len(df)
+    return clean_and_store(df, cache_dir, key), False
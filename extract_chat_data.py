@@ -13,74 +13,322 @@ extract_chat_data.py
     - 消息发送时间存储在 "40050" 列（Unix 时间戳，单位秒）；
     - 消息内容存储在 "40080" 列。
 - 只提取文本消息，即要求 "40011" 的值为 2（文本消息）且 "40012" 的值为 1（普通文本消息）。
+- 可选的时间范围（起止时间）直接在 SQL 的 WHERE 子句中对 "40050" 列过滤。
+- 以游标分块读取，结果使用紧凑类型：QQ号和昵称为分类类型，时间戳为 int64 Unix 秒，
+  默认只保留清洗后的消息长度而不保留消息原文；长度在 SQLite 查询中计算。
+- 批量分析多个群时（见 batch_analysis.py），可传入已打开的只读连接复用，
+  也可用 extract_groups 扫描一遍 group_msg_table 同时提取多个群。
+- 持续监视模式（见 watch_mode.py）按 rowid 范围只提取新写入的行。
 """
 
 import sqlite3
+from pathlib import Path
+import numpy as np
 import pandas as pd
 
-def extract_chat_data(db_path: str, group_id: int) -> pd.DataFrame:
-    """
-    从数据库中提取指定群聊的数据。
+from clean_chat_data import cleaned_length
 
-    参数：
-        db_path: 数据库文件路径，例如 "nt_msg.clean.db"。
-        group_id: 指定的群聊号码。
+# 默认每次从游标读取的行数
+DEFAULT_CHUNK_SIZE = 100_000
 
-    返回：
-        DataFrame，包含以下字段：
-          - sender_id: 发送者QQ号（字符串类型）
-          - sender_nickname: 用户显示名称，优先使用群昵称（字段 "40090"），若为空则使用QQ名称（字段 "40093"）
-          - content: 消息内容（文本）
-          - timestamp: 消息发送时间（已转换为 datetime 格式）
+def _to_epoch_seconds(value):
     """
-    try:
-        conn = sqlite3.connect(db_path)
-    except Exception as e:
-        print(f"[ERROR] 无法连接数据库: {e}")
-        return pd.DataFrame()
+    将时间边界转换为 Unix 时间戳（秒）。支持整数时间戳或可被 pd.Timestamp 解析的日期，
+    不带时区的日期按 UTC 处理（与 pd.to_datetime(unit='s') 的结果一致）。
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(pd.Timestamp(value).timestamp())
 
+def _filter_clause(start=None, end=None, by_group=True, rowid_range=None):
+    """
+    构造提取条件的 WHERE 子句及其额外参数（群号参数除外），提取查询和行统计共用同一组条件。
+    by_group 为 False 时不按群号过滤（扫描所有群）。
+    rowid_range 为 (after, upto) 时只保留 after < rowid <= upto 的行。
+    """
+    # 只提取普通文本消息，并跳过空消息和缺少时间戳的行
+    clause = """"40011" = 2 
+      AND "40012" = 1 
+      AND "40080" IS NOT NULL 
+      AND TRIM("40080") <> ''
+      AND "40050" IS NOT NULL
+"""
+    if by_group:
+        # 按 rowid 范围提取时用一元 + 禁止使用群号索引，让 SQLite 只按 rowid 扫描这一小段
+        group_column = '+"40027"' if rowid_range is not None else '"40027"'
+        clause = f'{group_column} = ? \n      AND ' + clause
+    params = []
+    # 时间范围过滤下推到 SQL，只读取所需时间段内的行
+    start_ts, end_ts = _to_epoch_seconds(start), _to_epoch_seconds(end)
+    if start_ts is not None:
+        clause += '      AND "40050" >= ?\n'
+        params.append(start_ts)
+    if end_ts is not None:
+        clause += '      AND "40050" <= ?\n'
+        params.append(end_ts)
+    if rowid_range is not None:
+        clause += '      AND rowid > ?\n      AND rowid <= ?\n'
+        params.extend(int(bound) for bound in rowid_range)
+    return clause, params
+
+def _build_query(start=None, end=None, keep_content=False, by_group=True, rowid_range=None):
+    """
+    构造提取查询语句及其额外参数（群号参数除外）。
+    keep_content 为 False 时不查询消息原文，而是由 SQLite 自定义函数 clean_len 直接返回清洗后的长度。
+    by_group 为 False 时扫描所有群，并在第一列返回群号。
+    指定 rowid_range 时只查询该 rowid 范围，并在最后一列返回 rowid。
+    """
+    text_column = '"40080" AS content' if keep_content else 'clean_len("40080") AS content_length'
+    group_column = '' if by_group else '"40027" AS group_id,\n        '
+    rowid_column = ',\n        rowid' if rowid_range is not None else ''
+    clause, params = _filter_clause(start, end, by_group, rowid_range)
     # 同时提取群昵称（40090）和QQ名称（40093）
     query = f"""
     SELECT 
-        "40033" AS sender_id,
+        {group_column}"40033" AS sender_id,
         "40090" AS group_nickname,
         "40093" AS qq_name,
-        "40080" AS content,
-        "40050" AS timestamp
+        {text_column},
+        "40050" AS timestamp{rowid_column}
     FROM group_msg_table
-    WHERE "40027" = ? 
-      AND "40011" = 2 
-      AND "40012" = 1 
-      AND content IS NOT NULL 
-      AND TRIM(content) <> ''
+    WHERE {clause}"""
+    return query, params
+
+def connect_readonly(db_path: str) -> sqlite3.Connection:
+    """以只读方式（URI mode=ro）打开数据库，不会创建文件，也不会修改数据库。"""
+    return sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+
+def list_chat_groups(conn, start=None, end=None) -> list:
+    """
+    列出数据库中有可提取消息（条件同 extract_chat_data）的所有群。
+
+    返回：
+        [(群号, 消息数), ...]，按消息数从多到少排列。
     """
+    clause, params = _filter_clause(start, end, by_group=False)
+    query = f'SELECT "40027", COUNT(*) FROM group_msg_table WHERE {clause} GROUP BY "40027" ORDER BY COUNT(*) DESC, "40027"'
+    return [(int(group_id), rows) for group_id, rows in conn.execute(query, params) if group_id is not None]
+
+def group_lookup_indexed(conn) -> bool:
+    """按群号提取时 SQLite 能否使用索引（否则每提取一个群都要扫描整张表）。"""
+    query, params = _build_query(keep_content=True)
+    plan = conn.execute("EXPLAIN QUERY PLAN " + query, [0] + params).fetchall()
+    return any(row[-1].startswith('SEARCH') for row in plan)
+
+def latest_rowid(conn) -> int:
+    """group_msg_table 当前的最大 rowid（表为空时为 0），只需读取 rowid B 树的最右端。"""
+    return conn.execute("SELECT MAX(rowid) FROM group_msg_table").fetchone()[0] or 0
+
+# 发送者校验和的取模基数：每行的项不超过 65521²，求和在 int64 范围内不会溢出
+CHECKSUM_MODULUS = 65521
+
+def summarize_chat_rows(db_path: str, group_id: int, start=None, end=None, fingerprint: bool = False) -> dict:
+    """
+    统计满足提取条件（与 extract_chat_data 相同）的原始行。
+
+    参数：
+        fingerprint: 是否同时计算内容指纹。指纹需要读取每条消息的内容并计算清洗后长度，
+            比只统计行数慢得多。
+    返回：
+        字典 {'rows': 行数, 'min_rowid', 'max_rowid', 'max_timestamp'}，没有匹配行时后三项为 None。
+        fingerprint 为 True 时另含 'length_sum'（清洗后消息长度之和）和 'sender_checksum'
+        （发送者QQ号与时间戳的乘积校验和），没有匹配行时均为 0。
+        增量分析（见 incremental.py）用它记录并校验高水位。
+    """
+    clause, params = _filter_clause(start, end)
+    columns = 'COUNT(*), MIN(rowid), MAX(rowid), MAX("40050")'
+    if fingerprint:
+        columns += (f', COALESCE(SUM(clean_len("40080")), 0)'
+                    f', COALESCE(SUM((CAST("40033" AS INTEGER) % {CHECKSUM_MODULUS})'
+                    f' * ("40050" % {CHECKSUM_MODULUS} + 1)), 0)')
+    conn = sqlite3.connect(db_path)
     try:
-        df = pd.read_sql_query(query, conn, params=(group_id,))
-    except Exception as e:
-        print(f"[ERROR] 执行 SQL 查询失败: {e}")
-        conn.close()
-        return pd.DataFrame()
+        conn.create_function("clean_len", 1, cleaned_length, deterministic=True)
+        values = conn.execute(f'SELECT {columns} FROM group_msg_table WHERE {clause}', [group_id] + params).fetchone()
     finally:
         conn.close()
+    summary = dict(zip(('rows', 'min_rowid', 'max_rowid', 'max_timestamp'), values))
+    if fingerprint:
+        summary['length_sum'], summary['sender_checksum'] = values[4:]
+    return summary
 
-    if df.empty:
-        print(f"[INFO] 群聊 {group_id} 未提取到有效数据。")
-        return df
+def fingerprint_rows(raw_df: pd.DataFrame):
+    """
+    由已提取的原始行（extract_chat_data 的输出，未清洗）计算与 summarize_chat_rows 相同的内容指纹，
+    返回 (length_sum, sender_checksum)。持续监视模式用它更新增量状态，不必再次读取消息内容。
+    """
+    if raw_df.empty:
+        return 0, 0
+    senders = pd.to_numeric(raw_df['sender_id'].astype(str), errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+    times = raw_df['timestamp'].to_numpy(dtype=np.int64)
+    # np.fmod 与 SQLite 的 % 一样保留被除数的符号
+    checksum = np.fmod(senders, CHECKSUM_MODULUS) * (np.fmod(times, CHECKSUM_MODULUS) + 1)
+    return int(raw_df['content_length'].sum()), int(checksum.sum())
+
+def iter_chat_chunks(conn, group_id: int, start=None, end=None, keep_content: bool = False,
+                     chunksize: int = DEFAULT_CHUNK_SIZE, rowid_range=None):
+    """
+    以游标方式分块读取指定群聊的消息，每块最多 chunksize 行。
+
+    参数：
+        conn: 已打开的 sqlite3 连接。
+        group_id, start, end: 同 extract_chat_data；group_id 为 None 时扫描所有群，
+            每块额外包含 group_id 列（int64）。
+        keep_content: 是否保留消息原文；默认只保留清洗后的消息长度（content_length 列），
+            长度由注册到连接上的 SQLite 自定义函数在查询中计算，消息原文不会被读入 DataFrame。
+        chunksize: 每块读取的行数。
+        rowid_range: 可选，(after, upto)，只读取 after < rowid <= upto 的行，每块额外包含 rowid 列（int64）。
+    返回：
+        生成器，每次产出一个 DataFrame，包含 sender_id（原始值）、sender_nickname、
+        timestamp（int64 Unix 秒）以及 content 或 content_length。
+    """
+    by_group = group_id is not None
+    query, params = _build_query(start, end, keep_content, by_group, rowid_range)
+    if not keep_content:
+        # 消息长度在 SQLite 中计算（清洗后长度，与 clean_chat_data 一致），消息原文不会被读入 DataFrame
+        conn.create_function("clean_len", 1, cleaned_length, deterministic=True)
+    cursor = conn.execute(query, ([group_id] if by_group else []) + params)
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        group_column = None if by_group else columns.pop(0)
+        rowid_column = columns.pop() if rowid_range is not None else None
+        sender_id, group_nickname, qq_name, text, timestamp = columns
+        # 设置 sender_nickname 为群昵称，如果群昵称为空或仅为空格，则使用 QQ 名称
+        nickname = [
+            g.strip() if isinstance(g, str) and g.strip() else q
+            for g, q in zip(group_nickname, qq_name)
+        ]
+        chunk = pd.DataFrame({
+            'sender_id': pd.Series(sender_id, dtype=object),
+            'sender_nickname': pd.Series(nickname, dtype=object),
+            'timestamp': np.asarray(timestamp, dtype=np.int64)
+        })
+        if keep_content:
+            chunk['content'] = pd.Series(text, dtype=object)
+        else:
+            chunk['content_length'] = np.asarray(text, dtype=np.int32)
+        if not by_group:
+            chunk['group_id'] = np.asarray(group_column, dtype=np.int64)
+        if rowid_range is not None:
+            chunk['rowid'] = np.asarray(rowid_column, dtype=np.int64)
+        yield chunk
+
+def _encode(values, table):
+    """
+    将一列取值编码为全局类别编号。table 为 {取值字符串: 编号} 字典，会被原地扩充；缺失值编码为 -1。
+    """
+    codes, uniques = pd.factorize(values)
+    mapping = np.array([table.setdefault(str(value), len(table)) for value in uniques], dtype=np.int64)
+    return np.where(codes >= 0, mapping[codes] if len(mapping) else codes, -1)
+
+def _new_accumulator():
+    """分块编码的累积器：全局类别表，以及各列按块保存的数组。"""
+    return {'sender_table': {}, 'nickname_table': {}, 'sender': [], 'nickname': [], 'timestamp': [], 'text': [],
+            'rowid': []}
+
+def _accumulate(acc, chunk, text_column):
+    """将一块数据编码后追加到累积器。"""
+    acc['sender'].append(_encode(chunk['sender_id'], acc['sender_table']))
+    acc['nickname'].append(_encode(chunk['sender_nickname'], acc['nickname_table']))
+    acc['timestamp'].append(chunk['timestamp'].to_numpy())
+    acc['text'].append(chunk[text_column].to_numpy())
+    if 'rowid' in chunk.columns:
+        acc['rowid'].append(chunk['rowid'].to_numpy())
+
+def _assemble(acc, text_column) -> pd.DataFrame:
+    """将累积器中的分块数组拼接为紧凑类型的 DataFrame。"""
+    def categorical(codes, table):
+        codes = np.concatenate(codes)
+        dtype = np.int32 if len(table) > np.iinfo(np.int16).max else np.int16
+        return pd.Categorical.from_codes(codes.astype(dtype), categories=list(table))
 
-    # 将 sender_id 转换为字符串
-    df['sender_id'] = df['sender_id'].astype(str)
+    df = pd.DataFrame({
+        'sender_id': categorical(acc['sender'], acc['sender_table']),
+        'sender_nickname': categorical(acc['nickname'], acc['nickname_table']),
+        'timestamp': np.concatenate(acc['timestamp']),
+        text_column: np.concatenate(acc['text'])
+    })
+    if acc['rowid']:
+        df['rowid'] = np.concatenate(acc['rowid'])
+    return df
+
+def extract_chat_data(db_path: str, group_id: int, start=None, end=None, keep_content: bool = False,
+                      chunksize: int = DEFAULT_CHUNK_SIZE, conn=None, rowid_range=None) -> pd.DataFrame:
+    """
+    从数据库中提取指定群聊的数据。
 
-    # 将 timestamp 转换为 datetime 类型（假设存储的是 Unix 时间戳，单位秒）
+    采用游标分块读取，并以紧凑类型保存：发送者QQ号和昵称为分类类型，时间戳保持 int64 Unix 秒，
+    默认不保留消息原文而只保留清洗后的消息长度，峰值内存只与所需列成正比。
+
+    参数：
+        db_path: 数据库文件路径，例如 "nt_msg.clean.db"。
+        group_id: 指定的群聊号码。
+        start: 可选，起始时间（含），日期或 Unix 时间戳；在 SQL 中对 "40050" 列过滤。
+        end: 可选，截止时间（含），日期或 Unix 时间戳；在 SQL 中对 "40050" 列过滤。
+        keep_content: 可选，为 True 时保留消息原文（content 列），否则只保留 content_length 列。
+        chunksize: 每次从游标读取的行数。
+        conn: 可选，已打开的连接（如 connect_readonly 的返回值）；指定时直接使用且不关闭。
+        rowid_range: 可选，(after, upto)，只提取 after < rowid <= upto 的行，结果额外包含 rowid 列。
+
+    返回：
+        DataFrame，包含以下字段：
+          - sender_id: 发送者QQ号（字符串类别的分类类型）
+          - sender_nickname: 用户显示名称（分类类型），优先使用群昵称（字段 "40090"），若为空则使用QQ名称（字段 "40093"）
+          - timestamp: 消息发送时间（int64 Unix 时间戳，单位秒）
+          - content_length: 清洗后的消息字符数（int32）；keep_content 为 True 时改为 content 消息原文
+    """
+    text_column = 'content' if keep_content else 'content_length'
+    columns = ['sender_id', 'sender_nickname', 'timestamp', text_column]
+    own_conn = conn is None
+    if own_conn:
+        try:
+            conn = sqlite3.connect(db_path)
+        except Exception as e:
+            print(f"[ERROR] 无法连接数据库: {e}")
+            return pd.DataFrame(columns=columns)
+
+    acc = _new_accumulator()
     try:
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
+        for chunk in iter_chat_chunks(conn, group_id, start, end, keep_content, chunksize, rowid_range):
+            _accumulate(acc, chunk, text_column)
     except Exception as e:
-        print(f"[WARN] 时间戳转换失败: {e}")
+        print(f"[ERROR] 执行 SQL 查询失败: {e}")
+        return pd.DataFrame(columns=columns)
+    finally:
+        if own_conn:
+            conn.close()
 
-    # 设置 sender_nickname 为群昵称，如果群昵称为空或仅为空格，则使用 QQ 名称
-    df['sender_nickname'] = df['group_nickname'].fillna('').str.strip()
-    df.loc[df['sender_nickname'] == '', 'sender_nickname'] = df.loc[df['sender_nickname'] == '', 'qq_name']
+    if not acc['timestamp']:
+        # 按 rowid 范围轮询新消息时没有数据是常态，不提示
+        if rowid_range is None:
+            print(f"[INFO] 群聊 {group_id} 未提取到有效数据。")
+        return pd.DataFrame(columns=columns)
 
-    # 删除多余的临时字段
-    df.drop(columns=['group_nickname', 'qq_name'], inplace=True)
+    return _assemble(acc, text_column)
 
-    return df
+def extract_groups(conn, group_ids, start=None, end=None, keep_content: bool = False,
+                   chunksize: int = DEFAULT_CHUNK_SIZE) -> dict:
+    """
+    扫描一遍 group_msg_table，同时提取多个群的数据（群号列上没有索引时，比逐个群查询少扫描很多遍）。
+
+    参数：
+        conn: 已打开的 sqlite3 连接。
+        group_ids: 需要提取的群号列表，其他群的行会被跳过。
+        start, end, keep_content, chunksize: 同 extract_chat_data。
+    返回：
+        {群号: DataFrame}，每个 DataFrame 的格式与 extract_chat_data 的结果相同；没有数据的群不在其中。
+    """
+    text_column = 'content' if keep_content else 'content_length'
+    wanted = {int(group_id) for group_id in group_ids}
+    accumulators = {}
+    for chunk in iter_chat_chunks(conn, None, start, end, keep_content, chunksize):
+        for group_id, part in chunk.groupby('group_id', sort=False):
+            if group_id in wanted:
+                _accumulate(accumulators.setdefault(int(group_id), _new_accumulator()), part, text_column)
+    return {group_id: _assemble(accumulators[group_id], text_column)
+            for group_id in group_ids if group_id in accumulators}
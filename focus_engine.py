@@ -0,0 +1,98 @@
+"""
+focus_engine.py
+---------------
+--focus-user 模式的单次扫描计算引擎。
+
+只关心一位用户与其他所有人的互动时，无需为每位对象单独合并时间线、也无需启动进程池：
+把所有对象的消息（消息索引中已按用户、时间排好序）与关注用户的消息一次性合并排序，
+即可定位到关注用户的时间线上，向量化地得到每位对象的全部指标。
+
+对某位对象的第 k 条消息（时间 t），记 p 为合并后排在它之前的关注用户消息数
+（按时间排序，同一秒内按原始行号，与逐对计算的规则一致）：
+  - 若 p 比对象上一条消息的 p 大（或这是对象的第一条消息且 p > 0），则它前面紧挨着
+    关注用户的第 p 条消息，构成一次“关注用户 -> 对象”的交替回复，间隔为 t - F[p-1]；
+  - 若对象下一条消息的 p 更大（或这是对象的最后一条消息）且 p 小于关注用户的消息数，
+    则它后面紧挨着关注用户的第 p+1 条消息，构成一次“对象 -> 关注用户”的交替回复，间隔为 F[p] - t。
+其余相邻消息都是同一人连续发言。所有对象共用一次排序和若干次 bincount，
+整体复杂度为 O((N + F) log(N + F))（N 为其他人的消息总数，F 为关注用户的消息数）。
+"""
+
+import numpy as np
+
+from incremental import QUICK_REPLY_SECONDS, metrics_from_statistics
+
+def focus_pair_metrics(index, focus_code, partners) -> dict:
+    """
+    计算关注用户与各对象之间的全部指标，结果与逐对调用 _compute_pair_metrics((focus_code, code)) 一致。
+
+    参数：
+        index: build_message_index 返回的消息索引。
+        focus_code: 关注用户在索引中的编号（作为 user1）。
+        partners: 对象用户编号列表（作为 user2），结果按该顺序排列。
+    返回：
+        字典（列名 -> 数组或列表），可直接构造 DataFrame。
+    """
+    offsets, times, lengths, counts = index['offsets'], index['times'], index['lengths'], index['counts']
+    focus_times = times[offsets[focus_code]:offsets[focus_code + 1]]
+    focus_rows = index['rows'][offsets[focus_code]:offsets[focus_code + 1]]
+    focus_count = len(focus_times)
+    partners = np.asarray(partners, dtype=np.int64)
+    num_partners = len(partners)
+
+    # 取出所有对象的消息，保持各自按时间排序的分段
+    seg_counts = counts[partners]
+    seg_starts = np.zeros(num_partners, dtype=np.int64)
+    np.cumsum(seg_counts[:-1], out=seg_starts[1:])
+    take = np.repeat(offsets[partners] - seg_starts, seg_counts) + np.arange(int(seg_counts.sum()))
+    owner = np.repeat(np.arange(num_partners), seg_counts)
+    partner_times = times[take]
+    first_in_seg = np.zeros(len(take), dtype=bool)
+    first_in_seg[seg_starts] = True
+    last_in_seg = np.zeros(len(take), dtype=bool)
+    last_in_seg[seg_starts + seg_counts - 1] = True
+
+    # 排在该消息之前的关注用户消息数：按 (时间, 原始行号) 合并关注用户和全部对象的消息
+    merged = np.lexsort((np.concatenate((focus_rows, index['rows'][take])),
+                         np.concatenate((focus_times, partner_times))))
+    from_focus = merged < focus_count
+    position = np.empty(len(take), dtype=np.int64)
+    position[merged[~from_focus] - focus_count] = np.cumsum(from_focus)[~from_focus]
+    prev_position = np.concatenate(([0], position[:-1]))
+    next_position = np.concatenate((position[1:], [focus_count]))
+
+    # 关注用户 -> 对象的交替回复
+    replied = np.where(first_in_seg, position > 0, position > prev_position)
+    gap_12 = partner_times - focus_times[np.maximum(position - 1, 0)]
+    # 对象 -> 关注用户的交替回复
+    answered = (position < focus_count) & (last_in_seg | (next_position > position))
+    gap_21 = focus_times[np.minimum(position, focus_count - 1)] - partner_times
+
+    def per_partner(mask, weights=None):
+        values = np.bincount(owner[mask], weights=None if weights is None else weights[mask],
+                             minlength=num_partners)
+        # 整数之和在 float64 中是精确的
+        return values.astype(np.int64)
+
+    resp_sum_12 = per_partner(replied, gap_12.astype(np.float64))
+    resp_sum_21 = per_partner(answered, gap_21.astype(np.float64))
+    quick_12 = per_partner(replied & (gap_12 <= QUICK_REPLY_SECONDS))
+    quick_21 = per_partner(answered & (gap_21 <= QUICK_REPLY_SECONDS))
+
+    partner_first = times[offsets[partners]]
+    partner_last = times[offsets[partners + 1] - 1]
+    span = np.maximum(partner_last, focus_times[-1]) - np.minimum(partner_first, focus_times[0])
+    focus_avg_len = float(np.mean(lengths[offsets[focus_code]:offsets[focus_code + 1]]))
+    partner_avg_len = np.bincount(owner, weights=lengths[take], minlength=num_partners) / seg_counts
+
+    user_ids, names = index['user_ids'], index['names']
+    return {
+        'user1': [user_ids[focus_code]] * num_partners,
+        'user2': [user_ids[c] for c in partners],
+        'name1': [names[focus_code]] * num_partners,
+        'name2': [names[c] for c in partners],
+        **metrics_from_statistics(
+            np.full(num_partners, focus_count, dtype=np.int64), seg_counts,
+            np.full(num_partners, focus_avg_len), partner_avg_len, span,
+            resp_sum_12, per_partner(replied), resp_sum_21, per_partner(answered), quick_12, quick_21
+        )
+    }
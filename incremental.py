@@ -0,0 +1,357 @@
+"""
+incremental.py
+--------------
+增量分析：保存每对用户的充分统计量和高水位，重复分析同一个不断增长的数据库时，
+只提取并合并新增的消息，结果与全量重新计算完全一致。
+
+  - 每位用户保存：消息数、消息长度总和、最早和最晚时间戳，以及最后一条消息在已合并消息中的序号；
+  - 每对用户（按 combinations 顺序排列）保存：双向交替回复的间隔总和与次数、
+    双向快速回复（间隔不超过 60 秒）次数。七项指标都可以由这些量精确还原；
+  - 合并新消息时，每对用户只需要旧时间线的最后一条消息（由双方最晚时间戳推出，同一秒时按序号）
+    作为衔接点，再与新消息一起计算增量；
+  - 同一秒内的消息按提取时的原始顺序（行号）排列，与全量计算一致（见 merge_timelines）；
+  - 高水位：状态覆盖时间戳小于 cutoff 的全部原始行，并记录这些行的行数、最大 rowid 和内容指纹
+    （清洗后消息长度之和、发送者与时间戳的校验和）。下次只提取时间戳不小于 cutoff 的行。
+
+回退：若早于高水位的原始行的行数、最大 rowid 或内容指纹发生变化（数据库被重写、VACUUM、删除、
+补录或原地修改了历史消息），或新增行的 rowid 不在高水位之后，或状态文件的版本、群号不匹配，
+则丢弃状态并全量重新计算。指纹只是求和，恰好互相抵消的修改（例如两条消息的长度一增一减）无法发现。
+计算指纹需要读取高水位之前全部消息的内容，校验的耗时与历史消息数成正比（但远低于重新提取和计算）。
+
+状态文件为 NumPy 归档（.npz），元数据以 JSON 字符串保存，不需要 pickle。
+"""
+
+import json
+import os
+
+import numpy as np
+
+from extract_chat_data import _to_epoch_seconds, summarize_chat_rows
+from pair_store import categorical_column
+
+# 状态格式版本；清洗规则或指标定义改变时递增，使旧状态自动失效
+STATE_VERSION = 3
+# 每对用户的充分统计量（下标 12 表示 user1 发言后 user2 回复，21 相反）
+PAIR_STAT_FIELDS = ('resp_sum_12', 'resp_count_12', 'resp_sum_21', 'resp_count_21', 'quick_12', 'quick_21')
+# 每位用户的统计量；last_rows 为最后一条消息在已合并的全部消息中的序号（按提取顺序）
+USER_STAT_FIELDS = ('counts', 'length_sums', 'first_times', 'last_times', 'last_rows')
+# 快速回复的时间阈值（秒），与 intimacy_analysis 中的指标定义一致
+QUICK_REPLY_SECONDS = 60
+
+def new_state(group_id) -> dict:
+    """创建空的增量状态。"""
+    state = {
+        'version': STATE_VERSION,
+        'group_id': int(group_id),
+        'cutoff': None,
+        'rows': 0,
+        'max_rowid': None,
+        'length_sum': 0,
+        'sender_checksum': 0,
+        'user_ids': [],
+        'names': [],
+        'pair_stats': np.zeros((len(PAIR_STAT_FIELDS), 0), dtype=np.int64)
+    }
+    for field in USER_STAT_FIELDS:
+        state[field] = np.zeros(0, dtype=np.int64)
+    return state
+
+def load_state(path):
+    """读取状态文件，文件不存在或无法解析时返回 None。"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as archive:
+            state = json.loads(str(archive['meta']))
+            for field in USER_STAT_FIELDS + ('pair_stats',):
+                state[field] = archive[field].astype(np.int64)
+    except Exception as e:
+        print(f"[WARN] 无法读取增量状态文件 {path}：{e}")
+        return None
+    return state
+
+def save_state(path, state):
+    """写入状态文件（先写临时文件再替换，避免中断时留下不完整的状态）。"""
+    meta = {key: state[key] for key in ('version', 'group_id', 'cutoff', 'rows', 'max_rowid', 'length_sum',
+                                        'sender_checksum', 'user_ids', 'names')}
+    arrays = {field: state[field] for field in USER_STAT_FIELDS + ('pair_stats',)}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps(meta, ensure_ascii=False)), **arrays)
+    os.replace(tmp_path, path)
+
+def _state_mismatch(state, db_path, group_id, start, end):
+    """
+    校验状态能否继续使用，返回 (不可用原因, 新增行统计)；可用时原因为 None。
+    """
+    if state.get('version') != STATE_VERSION:
+        return "状态版本不一致", None
+    if state['group_id'] != int(group_id):
+        return "群号不一致", None
+    if state['cutoff'] is None:
+        return "状态为空", None
+    cutoff = state['cutoff']
+    # 高水位之前的原始行必须与上次完全相同
+    end_ts = _to_epoch_seconds(end)
+    before_end = cutoff - 1 if end_ts is None else min(end_ts, cutoff - 1)
+    before = summarize_chat_rows(db_path, group_id, start, before_end, fingerprint=True)
+    if before['rows'] != state['rows'] or before['max_rowid'] != state['max_rowid']:
+        return "高水位之前的消息发生了变化", None
+    if before['length_sum'] != state['length_sum'] or before['sender_checksum'] != state['sender_checksum']:
+        return "高水位之前的消息内容或发送者被修改", None
+    # 新增行必须排在已合并的行之后，保证用户的首次出现顺序与全量提取一致
+    start_ts = _to_epoch_seconds(start)
+    tail = summarize_chat_rows(db_path, group_id, cutoff if start_ts is None else max(start_ts, cutoff), end,
+                               fingerprint=True)
+    if tail['rows'] and state['max_rowid'] is not None and tail['min_rowid'] <= state['max_rowid']:
+        return "新增消息的 rowid 不在高水位之后", None
+    return None, tail
+
+def open_state(path, db_path, group_id, start=None, end=None):
+    """
+    加载并校验增量状态，确定本次需要提取的时间范围。
+
+    参数：
+        path: 状态文件路径。
+        db_path, group_id, start, end: 同 extract_chat_data。
+    返回：
+        (state, extract_start, extract_end)：
+          - state: 可继续合并的状态；不可用时为新建的空状态（即全量计算）；
+          - extract_start, extract_end: 本次需要提取的时间范围，传给 extract_chat_data。
+        state 的高水位已更新为本次提取后的位置，调用方应在合并新消息后用 save_state 保存。
+    """
+    state = load_state(path)
+    tail = None
+    if state is not None:
+        reason, tail = _state_mismatch(state, db_path, group_id, start, end)
+        if reason:
+            print(f"[WARN] 增量状态不可用（{reason}），将全量重新计算。")
+            state = None
+        else:
+            print(f"[INFO] 已加载增量状态：{state['rows']} 条历史消息，{len(state['user_ids'])} 位用户。")
+    if state is None:
+        state = new_state(group_id)
+        tail = summarize_chat_rows(db_path, group_id, start, end, fingerprint=True)
+        extract_start = start
+    else:
+        start_ts = _to_epoch_seconds(start)
+        extract_start = state['cutoff'] if start_ts is None else max(start_ts, state['cutoff'])
+
+    # 只提取统计时已存在的最大时间戳之前的行；之后写入的行留给下次
+    extract_end = end
+    if tail['rows']:
+        extract_end = tail['max_timestamp']
+        state['cutoff'] = int(tail['max_timestamp']) + 1
+        state['rows'] += int(tail['rows'])
+        state['length_sum'] += int(tail['length_sum'])
+        state['sender_checksum'] += int(tail['sender_checksum'])
+        state['max_rowid'] = int(tail['max_rowid']) if state['max_rowid'] is None \
+            else max(state['max_rowid'], int(tail['max_rowid']))
+    return state, extract_start, extract_end
+
+def merge_timelines(times1, rows1, times2, rows2):
+    """
+    合并两位用户的时间线（_pair_metrics_kernel、pair_delta_kernel 和 sliding_window 共用）。
+    按时间戳排序，同一秒内的消息按行号（提取时的原始顺序）排列，与按时间戳稳定排序原始数据的结果一致。
+
+    参数：
+        times1, rows1, times2, rows2: 两位用户各自按 (时间戳, 行号) 升序排列的时间戳和行号数组。
+    返回：
+        (times, from_user2)：合并后的时间戳数组和每条消息是否由 user2 发送。
+    """
+    times = np.concatenate((times1, times2)).astype(np.int64, copy=False)
+    order = np.lexsort((np.concatenate((rows1, rows2)), times))
+    return times[order], order >= len(times1)
+
+def pair_delta_kernel(times1, rows1, times2, rows2, boundary_time, boundary_sender):
+    """
+    计算一对用户新增消息带来的充分统计量增量。
+
+    参数：
+        times1, rows1, times2, rows2: 两位用户新增消息的时间戳和行号（见 merge_timelines）。
+        boundary_time, boundary_sender: 旧时间线的最后一条消息的时间戳和发送者
+            （0 为 user1，1 为 user2，-1 表示两人此前都没有消息）。
+    返回：
+        与 PAIR_STAT_FIELDS 对应的整数元组。
+    """
+    times, from_user2 = merge_timelines(times1, rows1, times2, rows2)
+    if boundary_sender >= 0:
+        times = np.concatenate(([boundary_time], times))
+        from_user2 = np.concatenate(([boundary_sender == 1], from_user2))
+
+    gaps = np.diff(times)
+    switched = from_user2[1:] != from_user2[:-1]
+    response_times = gaps[switched]
+    to_user2 = from_user2[1:][switched]
+    quick = response_times <= QUICK_REPLY_SECONDS
+    return (
+        int(response_times[to_user2].sum()), int(np.count_nonzero(to_user2)),
+        int(response_times[~to_user2].sum()), int(np.count_nonzero(~to_user2)),
+        int(np.count_nonzero(quick & to_user2)), int(np.count_nonzero(quick & ~to_user2))
+    )
+
+def _pair_positions(codes1, codes2, num_users):
+    """用户对 (code1 < code2) 在 combinations(range(num_users), 2) 顺序中的下标。"""
+    return codes1 * num_users - codes1 * (codes1 + 1) // 2 + codes2 - codes1 - 1
+
+def merge_plan(state, index):
+    """
+    将新消息的索引对齐到状态中的用户编号，并列出需要计算增量的用户对。
+
+    参数：
+        index: 新消息的 build_message_index 结果。
+    返回：
+        (merged_index, items, positions)：
+          - merged_index: 按状态用户编号（新用户按首次出现顺序追加）重排的新消息索引，可发布到共享内存；
+          - items: [(code1, code2, boundary_time, boundary_sender), ...]，传给 pair_delta_kernel；
+          - positions: items 中各用户对在 pair_stats 中的下标。
+    """
+    user_ids, names = list(state['user_ids']), list(state['names'])
+    position = {uid: code for code, uid in enumerate(user_ids)}
+    new_codes = np.empty(len(index['user_ids']), dtype=np.int64)
+    for code, uid in enumerate(index['user_ids']):
+        if uid not in position:
+            position[uid] = len(user_ids)
+            user_ids.append(uid)
+            names.append(index['names'][code])
+        new_codes[code] = position[uid]
+
+    num_users = len(user_ids)
+    counts = np.zeros(num_users, dtype=np.int64)
+    counts[new_codes] = index['counts']
+    offsets = np.zeros(num_users + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    # 按新编号重新排列各用户的消息段
+    segments = np.argsort(new_codes, kind='stable')
+    starts, ends = index['offsets'][:-1][segments], index['offsets'][1:][segments]
+    take = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if len(segments) else np.zeros(0, np.int64)
+    merged_index = {
+        'user_ids': user_ids,
+        'names': names,
+        'counts': counts,
+        'offsets': offsets,
+        'times': index['times'][take],
+        'lengths': index['lengths'][take],
+        'rows': index['rows'][take]
+    }
+
+    # 至少一方有新消息的用户对才需要计算增量：只枚举有新消息的用户与其他所有用户组成的用户对，
+    # 两人都有新消息时只保留一次，计算量与新消息涉及的用户数成正比
+    has_new = counts > 0
+    active = np.flatnonzero(has_new)
+    codes_a = np.repeat(active, num_users)
+    codes_b = np.tile(np.arange(num_users, dtype=np.int64), len(active))
+    keep = (codes_b != codes_a) & (~has_new[codes_b] | (codes_b > codes_a))
+    codes1, codes2 = np.minimum(codes_a, codes_b)[keep], np.maximum(codes_a, codes_b)[keep]
+    old_counts = np.zeros(num_users, dtype=np.int64)
+    old_counts[:len(state['counts'])] = state['counts']
+    last_times = np.zeros(num_users, dtype=np.int64)
+    last_times[:len(state['last_times'])] = state['last_times']
+    last_rows = np.zeros(num_users, dtype=np.int64)
+    last_rows[:len(state['last_rows'])] = state['last_rows']
+    has1, has2 = old_counts[codes1] > 0, old_counts[codes2] > 0
+    last1, last2 = last_times[codes1], last_times[codes2]
+    # 旧时间线的最后一条消息：两人最后一条消息在同一秒时取序号较大（提取顺序靠后）的一条
+    later2 = (last2 > last1) | ((last2 == last1) & (last_rows[codes2] > last_rows[codes1]))
+    sender = np.where(has1 & has2, later2.astype(np.int64), np.where(has2, 1, np.where(has1, 0, -1)))
+    boundary = np.where(sender == 1, last2, last1)
+    items = list(zip(codes1.tolist(), codes2.tolist(), boundary.tolist(), sender.tolist()))
+    return merged_index, items, _pair_positions(codes1, codes2, num_users)
+
+def apply_merge(state, merged_index, positions, deltas):
+    """
+    将新消息合并进状态（原地修改）。
+
+    参数：
+        merged_index, positions: merge_plan 的返回值。
+        deltas: 与 positions 一一对应的 pair_delta_kernel 结果列表。
+    """
+    num_users = len(merged_index['user_ids'])
+    old_users = len(state['user_ids'])
+    if num_users == old_users:
+        # 没有新用户时用户对的下标不变，直接原地累加
+        pair_stats = state['pair_stats']
+    else:
+        # 扩充用户数后，旧用户对在 combinations 顺序中的下标发生变化
+        pair_stats = np.zeros((len(PAIR_STAT_FIELDS), num_users * (num_users - 1) // 2), dtype=np.int64)
+        if old_users > 1:
+            old1, old2 = np.triu_indices(old_users, 1)
+            pair_stats[:, _pair_positions(old1.astype(np.int64), old2.astype(np.int64), num_users)] = \
+                state['pair_stats']
+    if len(deltas):
+        pair_stats[:, positions] += np.asarray(deltas, dtype=np.int64).T
+
+    counts = merged_index['counts']
+    owners = np.repeat(np.arange(num_users), counts)
+    user_stats = {}
+    for field in USER_STAT_FIELDS:
+        user_stats[field] = np.zeros(num_users, dtype=np.int64)
+        user_stats[field][:old_users] = state[field]
+    has_old = user_stats['counts'] > 0
+    has_new = counts > 0
+    first_new = merged_index['times'][merged_index['offsets'][:-1][has_new]]
+    last_new = merged_index['offsets'][1:][has_new] - 1
+    user_stats['first_times'][has_new & ~has_old] = first_new[~has_old[has_new]]
+    user_stats['last_times'][has_new] = merged_index['times'][last_new]
+    # 新消息的序号接在已合并的全部消息之后
+    user_stats['last_rows'][has_new] = int(user_stats['counts'].sum()) + merged_index['rows'][last_new]
+    user_stats['length_sums'] += np.bincount(owners, weights=merged_index['lengths'],
+                                             minlength=num_users).astype(np.int64)
+    user_stats['counts'] += counts
+
+    state.update(user_stats)
+    state['user_ids'] = list(merged_index['user_ids'])
+    state['names'] = list(merged_index['names'])
+    state['pair_stats'] = pair_stats
+
+def metrics_from_statistics(count1, count2, avg_len1, avg_len2, span, resp_sum_12, resp_count_12,
+                            resp_sum_21, resp_count_21, quick_12, quick_21):
+    """
+    由充分统计量向量化地还原各用户对的指标（各参数为等长数组，span 为两人合并时间线的跨度，秒）。
+    返回与 _pair_metrics_kernel 同名的指标字典（不含用户信息）。
+    """
+    total = count1 + count2
+    reply_count = resp_count_12 + resp_count_21
+
+    def mean_or_default(sums, n):
+        # 整数总和在 float64 中是精确的，与内核中 np.mean 的结果相同
+        return np.where(n > 0, sums / np.maximum(n, 1), 300.0)
+
+    return {
+        'avg_response_time': mean_or_default(resp_sum_12 + resp_sum_21, reply_count),
+        'chat_frequency': total / (span // 86400 + 1),
+        'interaction_continuity': total / (total - quick_12 - quick_21),
+        'reciprocity': np.minimum(count1, count2) / np.maximum(count1, count2),
+        'message_length': (avg_len1 + avg_len2) / 2.0,
+        'reply_count': reply_count,
+        'dialogue_continuity': (quick_12 / count1 + quick_21 / count2) / 2.0,
+        'count1': count1,
+        'count2': count2,
+        'resp_time_1_to_2': mean_or_default(resp_sum_12, resp_count_12),
+        'resp_time_2_to_1': mean_or_default(resp_sum_21, resp_count_21),
+        'avg_len_user1': avg_len1,
+        'avg_len_user2': avg_len2
+    }
+
+def state_metrics(state):
+    """
+    由充分统计量还原每对用户的指标，结果的列和取值与全量计算的逐对结果一致。
+
+    返回：
+        字典（列名 -> 数组，QQ号和名称为分类类型），可直接构造 DataFrame。
+    """
+    num_users = len(state['user_ids'])
+    codes1, codes2 = np.triu_indices(num_users, 1)
+    counts, length_sums = state['counts'], state['length_sums']
+    span = np.maximum(state['last_times'][codes1], state['last_times'][codes2]) \
+        - np.minimum(state['first_times'][codes1], state['first_times'][codes2])
+    avg_len = length_sums / np.maximum(counts, 1)
+    user_ids, names = state['user_ids'], state['names']
+    return {
+        'user1': categorical_column(codes1, user_ids),
+        'user2': categorical_column(codes2, user_ids),
+        'name1': categorical_column(codes1, names),
+        'name2': categorical_column(codes2, names),
+        **metrics_from_statistics(counts[codes1], counts[codes2], avg_len[codes1], avg_len[codes2], span,
+                                  *state['pair_stats'])
+    }
@@ -13,36 +13,137 @@ intimacy_analysis.py
   - 对话延续性：一方发言后 60 秒内对方回复的比例。
 
 所有指标归一化后，根据预设权重计算综合亲密度得分，并增加整体活跃度惩罚因子：
-如果整个群聊消息数低于 1000，则综合得分乘以 (总消息数/1000)。
+如果整个群聊消息数低于 1000，则综合得分乘以 (总消息数/1000)（见 scoring.py）。
 
-支持多进程加速计算，适用于 Python 3.13。
-"""
+支持多进程加速计算，适用于 Python 3.13。各工作进程通过共享内存只读访问同一份
+按用户分组的消息索引（见 shared_index.py）。
+
+传入增量状态（见 incremental.py）时，只需传入新增的消息，结果与全量计算一致。
 
-# 定义各指标权重，总和为1
-WEIGHTS = {
-    "avg_response_time": 0.20,
-    "chat_frequency": 0.20,
-    "interaction_continuity": 0.15,
-    "reciprocity": 0.10,
-    "message_length": 0.10,
-    "reply_count": 0.20,
-    "dialogue_continuity": 0.05
-}
+一个群的全量计算也可以拆分为多个分片分别计算（calculate_shard_metrics，可在不同机器上运行），
+再合并评分（merge_shard_metrics，见 shard.py）。
+"""
 
 import pandas as pd
 import numpy as np
-from itertools import combinations
 import re
 import os
 import math
-
-# 全局变量，用于多进程共享 DataFrame
-_df_global = None
-
-def _init_pool(dataframe):
-    """在多进程池中初始化全局 DataFrame"""
-    global _df_global
-    _df_global = dataframe
+from contextlib import contextmanager
+from functools import partial
+
+from coactivity import DEFAULT_BUCKET_SECONDS, PRUNED_PAIR_SCORE, co_activity_overlap, prune_pairs
+from focus_engine import focus_pair_metrics
+from incremental import apply_merge, merge_plan, merge_timelines, metrics_from_statistics, pair_delta_kernel, \
+    state_metrics
+from metrics_store import save_raw_metrics
+from pair_scheduler import run_pair_batches
+from pair_store import allocate_pair_store, categorical_column, new_pair_store, pack_results, store_batch, \
+    store_frame
+import profiling
+from scoring import WEIGHTS, score_metrics
+from shard import data_digest, load_shards, pair_codes, plan_shards
+from shared_index import attach_index, detach_index, shared_message_index
+from sliding_window import window_bounds, window_pair_statistics
+from spill import DEFAULT_BLOCK_PAIRS, pair_blocks, ranked_order, score_spilled, update_extrema
+from topk import top_k_pairs
+
+# 全局变量，用于多进程共享按用户分组的消息索引
+_index_global = None
+# 预热的进程池中当前挂载的共享内存段（见 _run_attached）
+_attached_arrays = None
+
+def _init_pool(handle):
+    """在多进程池中挂载共享内存中的消息索引（只读），并设为全局变量"""
+    global _index_global
+    _index_global = attach_index(handle)
+
+def _warm_up():
+    """预热进程池时提交的空任务，使工作进程在提取数据期间启动并导入本模块。"""
+    return os.getpid()
+
+def _run_attached(handle, fn, *args):
+    """
+    在预热的进程池中执行任务：首次收到某份索引时挂载共享内存，之后直接计算。
+    切换到新的索引时先关闭旧索引的段，常驻的进程池（见 service.py）不会累积已释放的索引。
+    """
+    global _index_global, _attached_arrays
+    if _attached_arrays != handle['arrays']:
+        _index_global = None
+        detach_index()
+        _index_global = attach_index(handle)
+        _attached_arrays = handle['arrays']
+    return fn(*args)
+
+class _SerialExecutor:
+    """在当前进程中立即执行任务的执行器，接口与 Executor.submit 相同（max_workers 为 1 时使用）。"""
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+class _AttachingExecutor:
+    """包装预热的进程池：提交的任务先在工作进程中挂载 handle 指向的共享内存索引（见 _run_attached）。"""
+
+    def __init__(self, pool, handle):
+        self.pool = pool
+        self.handle = handle
+
+    def submit(self, fn, *args):
+        return self.pool.submit(_run_attached, self.handle, fn, *args)
+
+@contextmanager
+def warm_pair_pool(max_workers=None):
+    """
+    提前启动计算用户对的进程池，返回 (pool, workers)，供 _pair_executor 使用。
+    流水线模式（见 pipeline.py）在提取数据之前调用，工作进程的启动和模块导入与提取、清洗同时进行。
+    只有一个进程时 pool 为 None。
+    """
+    workers = max_workers or os.cpu_count() or 1
+    if workers == 1:
+        yield None, 1
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import resource_tracker
+    # 先在主进程中启动资源跟踪进程，工作进程与主进程共用它；否则之后才发布的共享内存段
+    # 会被各工作进程自己的跟踪进程登记，主进程释放后仍在退出时报告泄漏并重复释放
+    resource_tracker.ensure_running()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for _ in range(workers):
+            pool.submit(_warm_up)
+        yield pool, workers
+
+@contextmanager
+def _pair_executor(index, max_workers=None, warm_pool=None):
+    """
+    创建计算用户对的执行器，返回 (executor, workers)。
+    max_workers 默认为 CPU 核数；为 1 时在当前进程中串行计算，不启动进程池也不使用共享内存
+    （例如批量模式下各个群已分散到不同的工作进程）。
+    指定 warm_pool（warm_pair_pool 的返回值）时使用已启动的进程池，只把索引发布到共享内存。
+    """
+    global _index_global
+    if warm_pool is not None:
+        pool, max_workers = warm_pool
+        if pool is not None:
+            with shared_message_index(index) as handle:
+                yield _AttachingExecutor(pool, handle), max_workers
+            return
+    workers = max_workers or os.cpu_count() or 1
+    if workers == 1:
+        previous = _index_global
+        _index_global = index
+        try:
+            yield _SerialExecutor(), 1
+        finally:
+            _index_global = previous
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    # 数值数组只发布一次到共享内存，工作进程挂载后只读访问，内存占用不随进程数增长
+    with shared_message_index(index) as handle, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_pool, initargs=(handle,)) as executor:
+        yield executor, workers
 
 def compute_at_count(pair_df, uid1, uid2, name1, name2):
     """
@@ -50,108 +151,79 @@ def compute_at_count(pair_df, uid1, uid2, name1, name2):
     """
     return 0, 0, 0
 
-def _compute_pair_metrics(pair):
+def _epoch_seconds(timestamps: pd.Series) -> np.ndarray:
+    """将时间戳列转换为 int64 的 Unix 秒数组（兼容 datetime 列和整数秒列）。"""
+    if pd.api.types.is_datetime64_any_dtype(timestamps):
+        return timestamps.to_numpy(dtype='datetime64[s]').astype(np.int64)
+    return timestamps.to_numpy(dtype=np.int64)
+
+def _message_lengths(content: pd.Series) -> np.ndarray:
+    """计算每条消息的字符数，与 content.astype(str).apply(len) 结果一致。"""
+    return content.astype(str).str.len().to_numpy(dtype=np.int64)
+
+def _pair_metrics_kernel(times1, lengths1, rows1, times2, lengths2, rows2):
     """
-    计算单对用户的所有互动指标，用于多进程并行计算。
+    向量化的单对用户指标计算内核。
 
     参数：
-        pair: 一个元组 (uid1, uid2)
+        times1, times2: 两位用户各自按时间升序排列的 int64 Unix 时间戳（秒）数组。
+        lengths1, lengths2: 与时间戳一一对应的消息长度数组。
+        rows1, rows2: 与时间戳一一对应的原始行号（见 build_message_index），决定同一秒内消息的先后。
     返回：
-        一个字典，包含 uid1, uid2, name1, name2 以及各项指标；
-        如果某一用户没有消息，则返回 None。
+        一个字典，包含 WEIGHTS 中的全部指标以及 count1、count2、双向响应时间和双方平均消息长度；
+        若任一用户没有消息，则返回 None。
+
+    两条时间线只合并一次（按时间排序，同一秒内按原始行号，与原实现按时间戳稳定排序的结果一致），
+    之后所有指标都由相邻消息的时间差和发送者切换标记通过数组运算得到。
     """
-    uid1, uid2 = pair
-    df = _df_global  # 使用全局 DataFrame
-    pair_df = df[df['sender_id'].isin([uid1, uid2])].copy()
-    pair_df.sort_values('timestamp', inplace=True)
-    if pair_df.empty:
+    count1 = len(times1)
+    count2 = len(times2)
+    if count1 == 0 or count2 == 0:
         return None
 
-    # 检查 uid1 和 uid2 是否各自存在消息
-    df_uid1 = pair_df[pair_df['sender_id'] == uid1]
-    df_uid2 = pair_df[pair_df['sender_id'] == uid2]
-    if df_uid1.empty or df_uid2.empty:
-        return None
+    # --- 合并两条时间线 ---
+    times, from_user2 = merge_timelines(times1, rows1, times2, rows2)
 
-    # 获取用户昵称
-    try:
-        name1 = df_uid1['sender_nickname'].iloc[0]
-        name2 = df_uid2['sender_nickname'].iloc[0]
-    except IndexError:
-        return None
+    gaps = np.diff(times)
+    switched = from_user2[1:] != from_user2[:-1]   # 相邻两条消息是否为交替发言
+    to_user2 = from_user2[1:]                      # 后一条消息是否由 user2 发送
 
-    # --- 计算响应时间 ---
-    times = pair_df['timestamp'].apply(lambda t: t.timestamp()).tolist()
-    senders = pair_df['sender_id'].tolist()
-    response_times = []       # 所有交替发言的时间间隔
-    reply_count = 0           # 回复次数：即交替回复次数
-    resp_times_1_to_2 = []    # uid1 发言后 uid2 回复时间
-    resp_times_2_to_1 = []    # uid2 发言后 uid1 回复时间
-    for i in range(1, len(pair_df)):
-        if senders[i] != senders[i-1]:
-            dt = times[i] - times[i-1]
-            response_times.append(dt)
-            reply_count += 1
-            if senders[i-1] == uid1 and senders[i] == uid2:
-                resp_times_1_to_2.append(dt)
-            elif senders[i-1] == uid2 and senders[i] == uid1:
-                resp_times_2_to_1.append(dt)
-    avg_resp = float(np.mean(response_times)) if response_times else 300.0
-    avg_resp_1_to_2 = float(np.mean(resp_times_1_to_2)) if resp_times_1_to_2 else 300.0
-    avg_resp_2_to_1 = float(np.mean(resp_times_2_to_1)) if resp_times_2_to_1 else 300.0
+    # --- 响应时间 / 回复次数 ---
+    response_times = gaps[switched].astype(np.float64)
+    resp_times_1_to_2 = response_times[to_user2[switched]]
+    resp_times_2_to_1 = response_times[~to_user2[switched]]
+    reply_count = len(response_times)
+    avg_resp = float(np.mean(response_times)) if reply_count else 300.0
+    avg_resp_1_to_2 = float(np.mean(resp_times_1_to_2)) if len(resp_times_1_to_2) else 300.0
+    avg_resp_2_to_1 = float(np.mean(resp_times_2_to_1)) if len(resp_times_2_to_1) else 300.0
 
     # --- 聊天频率 ---
-    total_msgs = len(pair_df)
-    duration_days = (pair_df['timestamp'].iloc[-1] - pair_df['timestamp'].iloc[0]).days + 1
+    total_msgs = count1 + count2
+    duration_days = int((times[-1] - times[0]) // 86400) + 1
     chat_freq = total_msgs / duration_days if duration_days > 0 else total_msgs
 
-    # --- 互动持续度 ---
-    gap_threshold = 60  # 60秒内视为连续互动
-    chain_lengths = []
-    current_chain = 1
-    for i in range(1, len(pair_df)):
-        gap = times[i] - times[i-1]
-        if gap <= gap_threshold and senders[i] != senders[i-1]:
-            current_chain += 1
-        else:
-            chain_lengths.append(current_chain)
-            current_chain = 1
-    chain_lengths.append(current_chain)
-    interaction_continuity = float(np.mean(chain_lengths)) if chain_lengths else 0.0
+    # --- 互动持续度：每次断开（间隔超过 60 秒或非交替发言）开始一段新的连续互动 ---
+    quick = gaps <= 60
+    chain_breaks = int(np.count_nonzero(~(quick & switched)))
+    interaction_continuity = total_msgs / (chain_breaks + 1)
 
     # --- 互惠程度 ---
-    count1 = (pair_df['sender_id'] == uid1).sum()
-    count2 = (pair_df['sender_id'] == uid2).sum()
-    reciprocity = (min(count1, count2) / max(count1, count2)) if (count1 and count2) else 0.0
+    reciprocity = min(count1, count2) / max(count1, count2)
 
     # --- 消息长度 ---
-    avg_len_user1 = df_uid1['content'].astype(str).apply(len).mean() if count1 > 0 else 0.0
-    avg_len_user2 = df_uid2['content'].astype(str).apply(len).mean() if count2 > 0 else 0.0
+    avg_len_user1 = float(np.mean(lengths1))
+    avg_len_user2 = float(np.mean(lengths2))
     avg_msg_length = (avg_len_user1 + avg_len_user2) / 2.0
 
-    # --- 回复次数 ---
-    reply_count = len(response_times)
-
     # --- 对话延续性 ---
-    quick_resp_count_1 = 0  # uid2 对 uid1 的快速回复次数
-    quick_resp_count_2 = 0  # uid1 对 uid2 的快速回复次数
-    for i in range(1, len(pair_df)):
-        if senders[i] != senders[i-1]:
-            dt = times[i] - times[i-1]
-            if dt <= 60:
-                if senders[i-1] == uid1 and senders[i] == uid2:
-                    quick_resp_count_2 += 1
-                elif senders[i-1] == uid2 and senders[i] == uid1:
-                    quick_resp_count_1 += 1
-    ratio_1 = quick_resp_count_2 / count1 if count1 > 0 else 0.0
-    ratio_2 = quick_resp_count_1 / count2 if count2 > 0 else 0.0
+    quick_switched = quick & switched
+    quick_resp_count_2 = int(np.count_nonzero(quick_switched & to_user2))    # uid1 发言后 uid2 的快速回复
+    quick_resp_count_1 = int(np.count_nonzero(quick_switched & ~to_user2))   # uid2 发言后 uid1 的快速回复
+    ratio_1 = quick_resp_count_2 / count1
+    ratio_2 = quick_resp_count_1 / count2
     dialogue_continuity = (ratio_1 + ratio_2) / 2.0
 
     return {
-        'user1': uid1,
-        'user2': uid2,
-        'name1': name1,
-        'name2': name2,
         'avg_response_time': avg_resp,
         'chat_frequency': chat_freq,
         'interaction_continuity': interaction_continuity,
@@ -159,14 +231,116 @@ def _compute_pair_metrics(pair):
         'message_length': avg_msg_length,
         'reply_count': reply_count,
         'dialogue_continuity': dialogue_continuity,
-        'count1': int(count1),
-        'count2': int(count2),
+        'count1': count1,
+        'count2': count2,
         'resp_time_1_to_2': avg_resp_1_to_2,
         'resp_time_2_to_1': avg_resp_2_to_1,
         'avg_len_user1': avg_len_user1,
         'avg_len_user2': avg_len_user2
     }
 
+def _compute_pair_batch(batch):
+    """计算一批用户对（(n, 2) 编号数组）的指标，返回与 batch 顺序一致的结果列表（供调度器批量下发）。"""
+    return [_compute_pair_metrics(pair) for pair in batch.tolist()]
+
+def _compute_pair_columns_batch(batch):
+    """计算一批用户对的指标并打包成列数组（见 pair_store.py），由主进程直接写入列式存储。"""
+    return pack_results(_compute_pair_batch(batch))
+
+def _compute_pair_delta_batch(batch):
+    """计算一批用户对新增消息带来的充分统计量增量（增量模式，见 incremental.py）。"""
+    results = []
+    for code1, code2, boundary_time, boundary_sender in batch:
+        times1, _, rows1 = _user_messages(_index_global, code1)
+        times2, _, rows2 = _user_messages(_index_global, code2)
+        results.append(pair_delta_kernel(times1, rows1, times2, rows2, boundary_time, boundary_sender))
+    return results
+
+def _compute_pair_window_batch(starts, ends, batch):
+    """计算一批用户对在各时间窗口内的充分统计量（滑动窗口模式，见 sliding_window.py）。"""
+    results = []
+    for code1, code2 in batch.tolist():
+        results.append(window_pair_statistics(*_user_messages(_index_global, code1),
+                                              *_user_messages(_index_global, code2), starts, ends))
+    return results
+
+def build_message_index(df: pd.DataFrame) -> dict:
+    """
+    一次性按发送者对消息分组，构建各用户的有序时间戳和消息长度数组。
+
+    参数：
+        df: 清洗后的聊天记录 DataFrame，必须包含 sender_id, sender_nickname, timestamp，
+            以及 content 或 content_length（已计算好的消息长度）。
+    返回：
+        一个字典：
+          - user_ids: 用户ID列表（按首次出现的顺序，与 df['sender_id'].unique() 一致）
+          - names: 每个用户最早一条消息的昵称
+          - counts: 每个用户的消息数（int64 数组）
+          - offsets: 长度为用户数+1 的偏移数组，第 i 个用户的消息位于 [offsets[i], offsets[i+1])
+          - times: 按 (用户, 时间) 排序后的 int64 Unix 时间戳（秒）
+          - lengths: 与 times 一一对应的消息长度
+          - rows: 与 times 一一对应的消息在 df 中的行号；同一秒内的消息按行号（提取时的原始顺序）排列
+    """
+    codes, uniques = pd.factorize(df['sender_id'])
+    times = _epoch_seconds(df['timestamp'])
+    # 提取阶段已计算消息长度时直接使用，否则由消息内容计算
+    if 'content_length' in df.columns:
+        lengths = df['content_length'].to_numpy(dtype=np.int64)
+    else:
+        lengths = _message_lengths(df['content'])
+    arrays, first_rows = index_arrays(codes, len(uniques), times, lengths)
+    return {
+        'user_ids': [str(uid) for uid in uniques],
+        'names': list(df['sender_nickname'].to_numpy()[first_rows]),
+        **arrays
+    }
+
+def index_arrays(codes, num_users, times, lengths):
+    """
+    由每条消息的用户编号（按首次出现的顺序编号）、时间戳和消息长度构建索引中的数值数组
+    （build_message_index 和流水线模式共用，见 pipeline.py）。
+
+    返回：
+        (arrays, first_rows)：arrays 为 counts、offsets、times、lengths、rows 五个数组；
+        first_rows 为每个用户最早一条消息的行号。
+    """
+    # lexsort 为稳定排序：同一用户内按时间升序，时间相同则保持原始行顺序
+    order = np.lexsort((times, codes))
+    counts = np.bincount(codes, minlength=num_users).astype(np.int64)
+    offsets = np.zeros(num_users + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    arrays = {'counts': counts, 'offsets': offsets, 'times': times[order], 'lengths': lengths[order],
+              'rows': order.astype(np.int64, copy=False)}
+    return arrays, order[offsets[:-1]]
+
+def _user_messages(index, code):
+    """返回索引中第 code 个用户的 (时间戳数组, 消息长度数组, 行号数组) 视图。"""
+    start, end = index['offsets'][code], index['offsets'][code + 1]
+    return index['times'][start:end], index['lengths'][start:end], index['rows'][start:end]
+
+def _compute_pair_metrics(pair):
+    """
+    计算单对用户的所有互动指标，用于多进程并行计算。
+
+    参数：
+        pair: 一个元组 (code1, code2)，为两位用户在消息索引中的编号
+    返回：
+        一个字典，包含 uid1, uid2, name1, name2 以及各项指标；
+        如果某一用户没有消息，则返回 None。
+    """
+    code1, code2 = pair
+    index = _index_global  # 使用全局消息索引，只访问这两位用户的数据
+    metrics = _pair_metrics_kernel(*_user_messages(index, code1), *_user_messages(index, code2))
+    if metrics is None:
+        return None
+    return {
+        'user1': index['user_ids'][code1],
+        'user2': index['user_ids'][code2],
+        'name1': index['names'][code1],
+        'name2': index['names'][code2],
+        **metrics
+    }
+
 def norm_response_time(rt, max_rt=300):
     return max(0, 1 - rt / max_rt)
 
@@ -188,73 +362,435 @@ def norm_reply_count(count, threshold=5):
 def norm_dialogue_continuity(val, threshold=0.5):
     return min(1.0, val / threshold)
 
-def calculate_intimacy_metrics(df: pd.DataFrame, user_name_map: dict = None, focus_user=None) -> pd.DataFrame:
+def _display_name(uid, name, user_name_map):
+    """若提供了用户名映射，则使用映射中的名称（缺失时为空字符串），否则使用昵称。"""
+    return user_name_map.get(str(uid), "") if user_name_map else name
+
+def _candidate_pairs(num_users, focus_code=None):
+    """
+    候选用户对的 (n, 2) int32 编号数组（由 shard.pair_codes 直接生成，不为每对用户构造元组）：
+    默认为 combinations(range(num_users), 2) 顺序的全部用户对，指定 focus_code 时为该用户与其他每位用户。
+    """
+    if focus_code is None:
+        return np.column_stack(pair_codes(num_users, 0, num_users * (num_users - 1) // 2))
+    others = np.delete(np.arange(num_users, dtype=np.int32), focus_code)
+    return np.column_stack((np.full(len(others), focus_code, dtype=np.int32), others))
+
+def _pruned_pairs_frame(index, pairs, user_name_map=None) -> pd.DataFrame:
+    """
+    为被共同活跃度剪枝的用户对生成结果行：各项指标为空，综合得分为下限 PRUNED_PAIR_SCORE。
+    """
+    user_ids = index['user_ids']
+    names = [_display_name(uid, name, user_name_map) for uid, name in zip(user_ids, index['names'])]
+    codes = pairs.astype(np.int64)
+    return pd.DataFrame({
+        'user1': categorical_column(codes[:, 0], user_ids),
+        'user2': categorical_column(codes[:, 1], user_ids),
+        'name1': categorical_column(codes[:, 0], names),
+        'name2': categorical_column(codes[:, 1], names),
+        'count1': index['counts'][codes[:, 0]],
+        'count2': index['counts'][codes[:, 1]],
+        'closeness_score': PRUNED_PAIR_SCORE,
+        'pruned': True
+    })
+
+def _apply_name_map(metrics_df, user_name_map):
+    """按用户名映射替换 name1、name2 列（原地修改）；分类类型的列只按用户映射一次，结果仍为分类类型。"""
+    for user_col, name_col in (('user1', 'name1'), ('user2', 'name2')):
+        users = metrics_df[user_col]
+        if isinstance(users.dtype, pd.CategoricalDtype):
+            names = [user_name_map.get(str(uid), "") for uid in users.cat.categories]
+            metrics_df[name_col] = categorical_column(users.cat.codes.to_numpy(), names)
+        else:
+            metrics_df[name_col] = users.apply(lambda uid: user_name_map.get(str(uid), ""))
+
+def calculate_intimacy_metrics(df: pd.DataFrame, user_name_map: dict = None, focus_user=None,
+                               prune: bool = False, prune_min_overlap: int = 1,
+                               prune_bucket_seconds: int = DEFAULT_BUCKET_SECONDS,
+                               top_k: int = None, state: dict = None, weights: dict = WEIGHTS,
+                               raw_metrics_path: str = None, max_workers: int = None, index: dict = None,
+                               warm_pool=None) -> pd.DataFrame:
     """
     计算群聊中所有用户两两之间的互动指标和综合亲密度得分。
 
     参数：
-        df: 清洗后的聊天记录 DataFrame，必须包含 sender_id, sender_nickname, content, timestamp。
+        df: 清洗后的聊天记录 DataFrame，必须包含 sender_id, sender_nickname, timestamp，
+            以及 content 或 content_length（已计算好的消息长度）。timestamp 可以是 datetime 或 int64 Unix 秒。
         user_name_map: 可选，用户ID到显示名称的映射字典。
-        focus_user: 可选，若指定，则仅计算该用户与其他用户的互动指标。
+        focus_user: 可选，若指定，则仅计算该用户与其他用户的互动指标（由 focus_engine.py 单次扫描完成）。
+        prune: 可选，是否启用共同活跃度剪枝（见 coactivity.py）。被剪枝的用户对不参与归一化，
+            其指标为空、综合得分为 PRUNED_PAIR_SCORE，并在结果中以 pruned 列标记。
+        prune_min_overlap: 保留用户对所需的最少共同活跃时段数，默认为 1（即只剔除从未共同活跃的用户对）。
+        prune_bucket_seconds: 活跃时段长度（秒），默认 1 小时。
+        top_k: 可选，若指定，则只返回综合得分最高的 top_k 对用户，并尽量跳过不可能进入前 top_k 的用户对
+            （见 topk.py；界限无法有效剪枝时改为全量计算）。返回结果与全量计算后取前 top_k 行完全一致。
+        state: 可选，增量状态（见 incremental.open_state）。此时 df 只需包含新增的消息，
+            新消息会被合并进 state（原地修改），并由合并后的充分统计量得到全部用户对的指标；
+            不支持与 focus_user、prune 同时使用。
+        weights: 可选，指标权重，默认为 WEIGHTS。
+        raw_metrics_path: 可选，若指定，则将评分前的原始指标保存到该文件（见 metrics_store.py），
+            之后可用 --rescore 以新的权重重新评分，无需重新计算用户对。
+        max_workers: 可选，计算用户对的进程数，默认为 CPU 核数；为 1 时在当前进程中串行计算。
+        index: 可选，已由 df 构建好的消息索引（流水线模式在提取数据的同时构建，见 pipeline.py）。
+        warm_pool: 可选，warm_pair_pool 预先启动的进程池，指定时忽略 max_workers。
     
     返回：
         DataFrame，每一行代表一对用户的各项指标及综合得分。
     """
+    if state is not None:
+        if focus_user is not None or prune:
+            raise ValueError("增量模式不支持 focus_user 和 prune 参数")
+        touched = merge_into_state(state, df, max_workers)
+        print(f"[INFO] 增量合并：{len(df)} 条新消息，更新了 {touched} 对用户的统计量。")
+        return rank_state(state, user_name_map, weights, top_k, raw_metrics_path)
+    # 一次性按用户建立索引，之后每对用户只访问两人各自的数据
+    if index is None:
+        with profiling.stage('build_index', rows_in=len(df)) as record:
+            index = build_message_index(df)
+            record['rows_out'] = len(index['user_ids'])
+    user_ids = index['user_ids']
+
     # 确保 focus_user 为字符串，与 df 中 sender_id 一致
+    focus_code = None
     if focus_user is not None:
         focus_user = str(focus_user)
-        user_ids = [focus_user] + [uid for uid in df['sender_id'].unique() if uid != focus_user]
-        pairs = [(focus_user, uid) for uid in user_ids if uid != focus_user]
-    else:
-        user_ids = df['sender_id'].unique()
-        pairs = list(combinations(user_ids, 2))
-    if not pairs:
+        if focus_user not in user_ids:
+            return pd.DataFrame()
+        focus_code = user_ids.index(focus_user)
+    pairs = _candidate_pairs(len(user_ids), focus_code)
+    if len(pairs) == 0:
         return pd.DataFrame()
-    
-    # 以下多进程计算保持不变...
-    from concurrent.futures import ProcessPoolExecutor
-    cpu_count = os.cpu_count() or 1
-    with ProcessPoolExecutor(max_workers=cpu_count, initializer=_init_pool, initargs=(df,)) as executor:
-        results = list(executor.map(_compute_pair_metrics, pairs))
-    results = [res for res in results if res is not None]
-    metrics_df = pd.DataFrame(results)
-    if metrics_df.empty:
-        return metrics_df
 
-    if user_name_map:
-        metrics_df['name1'] = metrics_df['user1'].apply(lambda uid: user_name_map.get(str(uid), ""))
-        metrics_df['name2'] = metrics_df['user2'].apply(lambda uid: user_name_map.get(str(uid), ""))
-    
-    # 以下归一化和权重计算部分...
-    metrics_to_normalize = [
-        ('avg_response_time', True),
-        ('chat_frequency', False),
-        ('interaction_continuity', False),
-        ('reciprocity', False),
-        ('message_length', False),
-        ('reply_count', False),
-        ('dialogue_continuity', False)
-    ]
-    for col, reverse in metrics_to_normalize:
-        if metrics_df[col].max() != metrics_df[col].min():
-            if reverse:
-                metrics_df['norm_' + col] = 1 - (metrics_df[col] - metrics_df[col].min()) / (metrics_df[col].max() - metrics_df[col].min())
-            else:
-                metrics_df['norm_' + col] = (metrics_df[col] - metrics_df[col].min()) / (metrics_df[col].max() - metrics_df[col].min())
+    # 共同活跃度剪枝：剔除从未（或极少）在相近时段发言的用户对
+    pruned_pairs = ()
+    if prune:
+        with profiling.stage('prune', rows_in=len(pairs)) as record:
+            overlap = co_activity_overlap(index, prune_bucket_seconds)
+            pairs, pruned_pairs = prune_pairs(pairs, overlap, prune_min_overlap)
+            record['rows_out'] = len(pairs)
+        print(f"[INFO] 共同活跃度剪枝：跳过 {len(pruned_pairs)}/{len(pairs) + len(pruned_pairs)} 对用户。")
+
+    if focus_user is not None:
+        # 只关注一位用户时用单次扫描引擎一次算出全部对象的指标，无需进程池；
+        # 结果很小，Top-K 直接在全部候选上排序截取，与剪枝后的全量结果一致
+        with profiling.stage('pairs', rows_in=len(pairs)) as record:
+            results = focus_pair_metrics(index, focus_code, pairs[:, 1]) if len(pairs) else []
+            record['rows_out'] = len(results)
+        return _rank_raw_metrics(pd.DataFrame(results), len(df), user_name_map, None, index, pruned_pairs,
+                                 weights, top_k, raw_metrics_path)
+
+    extrema = None
+    with profiling.stage('pairs', rows_in=len(pairs)) as record, \
+            _pair_executor(index, max_workers, warm_pool) as (executor, workers):
+        # 按两人消息数估计代价：重量级用户对优先单独下发，轻量级用户对打包成批
+        found = None
+        if top_k:
+            # 界限无法有效剪枝时返回 None，改走下面的全量计算，排序后同样只取前 top_k 行
+            found = top_k_pairs(
+                index, pairs, top_k,
+                lambda batch: run_pair_batches(executor, _compute_pair_batch, batch, index['counts'],
+                                               workers, progress=False),
+                batch_size=workers * 64, weights=weights
+            )
+        if found is not None:
+            results, extrema = found
+            metrics_df = pd.DataFrame([res for res in results if res is not None])
         else:
-            metrics_df['norm_' + col] = 1.0 if metrics_df[col].iloc[0] != 0 else 0.0
+            # 每批结果以列数组返回，到达后直接写入预先分配的列式存储，不为每对用户保留字典
+            store = new_pair_store(pairs)
+            run_pair_batches(executor, _compute_pair_columns_batch, pairs, index['counts'], workers,
+                             collect=partial(store_batch, store))
+            metrics_df = store_frame(store, user_ids, index['names'])
+            del store
+        record['rows_out'] = len(metrics_df)
+    return _rank_raw_metrics(metrics_df, len(df), user_name_map, extrema, index, pruned_pairs, weights,
+                             top_k, raw_metrics_path)
+
+def calculate_spilled_metrics(df: pd.DataFrame, spill_dir: str, user_name_map: dict = None,
+                              weights: dict = WEIGHTS, block_pairs: int = DEFAULT_BLOCK_PAIRS,
+                              max_workers: int = None) -> dict:
+    """
+    内存受限模式（见 spill.py）：分块计算全部用户对，结果写入 spill_dir 中的内存映射文件，
+    同时累积各项指标的最小值和最大值；全部完成后分段评分并排序。
+
+    参数：
+        df, user_name_map, weights, max_workers: 同 calculate_intimacy_metrics。
+        spill_dir: 存放结果列文件的目录（由调用方创建和清理）。
+        block_pairs: 每块的用户对数。
+    返回：
+        结果字典，供 spill.ranked_frame、spill.write_ranked_csv 使用：store（磁盘上的结果列）、
+        order（按综合得分排列的行号）、user_ids、names（显示名称）、total_msgs、extrema、weights；
+        没有用户对时返回 None。用完后清空 store 以关闭内存映射文件。
+    """
+    with profiling.stage('build_index', rows_in=len(df)) as record:
+        index = build_message_index(df)
+        record['rows_out'] = len(index['user_ids'])
+    user_ids = index['user_ids']
+    num_pairs = len(user_ids) * (len(user_ids) - 1) // 2
+    if num_pairs == 0:
+        return None
+    names = [_display_name(uid, name, user_name_map) for uid, name in zip(user_ids, index['names'])]
+
+    store = allocate_pair_store(num_pairs, spill_dir)
+    extrema = {}
+    with profiling.stage('pairs', rows_in=num_pairs) as record, \
+            _pair_executor(index, max_workers) as (executor, workers):
+        for start, block in pair_blocks(len(user_ids), block_pairs):
+            end = start + len(block)
+            store['code1'][start:end] = block[:, 0]
+            store['code2'][start:end] = block[:, 1]
+            run_pair_batches(executor, _compute_pair_columns_batch, block, index['counts'], workers, progress=False,
+                             collect=lambda positions, packed, start=start: store_batch(store, positions + start, packed))
+            update_extrema(extrema, store, start, end)
+            print(f"[INFO] 已完成 {end}/{num_pairs} 对用户（{end * 100 // num_pairs}%）")
+        for column in store.values():
+            column.flush()
+        record['rows_out'] = int(np.count_nonzero(store['valid']))
+
+    with profiling.stage('score', rows_in=num_pairs) as record:
+        order = ranked_order(score_spilled(store, len(df), extrema, weights))
+        record['rows_out'] = len(order)
+    return {'store': store, 'order': order, 'user_ids': user_ids, 'names': names, 'total_msgs': len(df),
+            'extrema': extrema, 'weights': weights}
+
+def calculate_pair_store(index: dict, max_workers: int = None, warm_pool=None) -> dict:
+    """
+    计算全部用户对的原始指标，结果保存在内存中的列式存储（见 pair_store.py），
+    按 combinations(用户, 2) 的顺序排列，不做评分（常驻查询服务用不同的权重反复评分，见 service.py）。
+
+    参数：
+        index: build_message_index 的返回值。
+        max_workers, warm_pool: 同 calculate_intimacy_metrics。
+    """
+    num_users = len(index['user_ids'])
+    store = allocate_pair_store(num_users * (num_users - 1) // 2)
+    pairs = _candidate_pairs(num_users)
+    store['code1'][:], store['code2'][:] = pairs[:, 0], pairs[:, 1]
+    if len(pairs):
+        with profiling.stage('pairs', rows_in=len(pairs)) as record, \
+                _pair_executor(index, max_workers, warm_pool) as (executor, workers):
+            run_pair_batches(executor, _compute_pair_columns_batch, pairs, index['counts'], workers,
+                             collect=partial(store_batch, store))
+            record['rows_out'] = int(np.count_nonzero(store['valid']))
+    return store
+
+def calculate_shard_metrics(df: pd.DataFrame, shard: int, num_shards: int, max_workers: int = None) -> dict:
+    """
+    分片模式（见 shard.py）：按估计代价把全部用户对切分为 num_shards 段，只计算第 shard 段（从 1 开始）。
+
+    参数：
+        df, max_workers: 同 calculate_intimacy_metrics；各分片必须使用相同的数据。
+        shard, num_shards: 分片编号和分片数。
+    返回：
+        结果字典，供 shard.save_shard 使用：store（本段的结果列）、shard、num_shards、start、end、
+        user_ids、names（数据库中的昵称，用户名映射在合并时应用）、digest（数据摘要）、total_msgs。
+    """
+    with profiling.stage('build_index', rows_in=len(df)) as record:
+        index = build_message_index(df)
+        record['rows_out'] = len(index['user_ids'])
+    user_ids = index['user_ids']
+    plan = plan_shards(index['counts'], num_shards)[shard - 1]
+    print(f"[INFO] 第 {shard}/{num_shards} 片：第 {plan['start']}～{plan['end']} 对用户"
+          f"（共 {len(user_ids) * (len(user_ids) - 1) // 2} 对）。")
+
+    pairs = np.column_stack(pair_codes(len(user_ids), plan['start'], plan['end']))
+    store = new_pair_store(pairs)
+    if len(pairs):
+        with profiling.stage('pairs', rows_in=len(pairs)) as record, \
+                _pair_executor(index, max_workers) as (executor, workers):
+            run_pair_batches(executor, _compute_pair_columns_batch, pairs, index['counts'], workers,
+                             collect=partial(store_batch, store))
+            record['rows_out'] = int(np.count_nonzero(store['valid']))
+    return {'store': store, 'shard': shard, 'num_shards': num_shards, 'start': plan['start'], 'end': plan['end'],
+            'user_ids': user_ids, 'names': list(index['names']), 'digest': data_digest(index, len(df)),
+            'total_msgs': len(df)}
+
+def merge_shard_metrics(paths, group_id=None, user_name_map: dict = None, weights: dict = WEIGHTS,
+                        raw_metrics_path: str = None, start=None, end=None) -> pd.DataFrame:
+    """
+    合并 calculate_shard_metrics 保存的全部分片文件，做全局归一化并评分排序，
+    结果（以及保存的原始指标）与单机全量计算一致。
 
-    norm_cols = list(WEIGHTS.keys())
-    metrics_df['closeness_score'] = metrics_df.apply(
-        lambda row: sum(WEIGHTS[col] * row[f"norm_{col}"] for col in norm_cols),
-        axis=1
+    参数：
+        paths: 分片文件路径列表。
+        group_id: 可选，检查各分片的群号。
+        user_name_map, weights, raw_metrics_path: 同 calculate_intimacy_metrics。
+        start, end: 可选，检查各分片提取数据时的起止日期。
+    异常：
+        ValueError：分片文件不完整或不一致（见 shard.load_shards）。
+    """
+    with profiling.stage('load_shards') as record:
+        store, user_ids, names, total_msgs = load_shards(paths, group_id, start, end)
+        metrics_df = store_frame(store, user_ids, names)
+        record['rows_out'] = len(metrics_df)
+    del store
+    return _rank_raw_metrics(metrics_df, total_msgs, user_name_map, weights=weights,
+                             raw_metrics_path=raw_metrics_path)
+
+def merge_into_state(state, df: pd.DataFrame, max_workers: int = None, progress: bool = True) -> int:
+    """
+    将新消息合并进增量状态（原地修改，见 incremental.py），返回更新了统计量的用户对数。
+    计算量只与新消息涉及的用户对成正比，不随历史消息数增长。
+
+    参数：
+        state: 增量状态。
+        df: 新消息（清洗后），格式同 calculate_intimacy_metrics。
+        max_workers: 同 calculate_intimacy_metrics。
+        progress: 是否输出完成进度。
+    """
+    with profiling.stage('merge_state', rows_in=len(df)) as record:
+        index = build_message_index(df)
+        merged_index, items, positions = merge_plan(state, index)
+        deltas = []
+        if items:
+            with _pair_executor(merged_index, max_workers) as (executor, workers):
+                deltas = run_pair_batches(executor, _compute_pair_delta_batch, items, merged_index['counts'],
+                                          workers, progress)
+        apply_merge(state, merged_index, positions, deltas)
+        record['rows_out'] = len(items)
+    return len(items)
+
+def rank_state(state, user_name_map: dict = None, weights: dict = WEIGHTS, top_k: int = None,
+               raw_metrics_path: str = None) -> pd.DataFrame:
+    """由增量状态中的充分统计量还原全部用户对的指标并评分排序，参数同 calculate_intimacy_metrics。"""
+    with profiling.stage('state_metrics') as record:
+        metrics_df = pd.DataFrame(state_metrics(state))
+        record['rows_out'] = len(metrics_df)
+    return _rank_raw_metrics(metrics_df, int(state['counts'].sum()), user_name_map, weights=weights,
+                             top_k=top_k, raw_metrics_path=raw_metrics_path)
+
+def calculate_window_metrics(df: pd.DataFrame, window_seconds: int, step_seconds: int = None,
+                             user_name_map: dict = None, focus_user=None, weights: dict = WEIGHTS,
+                             top_k: int = None, max_workers: int = None) -> pd.DataFrame:
+    """
+    计算滑动时间窗口内各用户对的指标和综合得分（长表格式），用于观察亲密度随时间的变化。
+
+    每对用户只合并一次完整的时间线，各窗口的统计量由前缀和之差得到（见 sliding_window.py）。
+    每个窗口单独归一化和评分，整体活跃度惩罚因子使用该窗口内的群消息总数，
+    结果与只用该窗口内的消息调用 calculate_intimacy_metrics 一致（用户对的 user1/user2 顺序在所有窗口中保持不变）。
+
+    参数：
+        df: 同 calculate_intimacy_metrics。
+        window_seconds: 窗口长度（秒）。
+        step_seconds: 相邻窗口起点的间隔（秒），默认等于窗口长度（互不重叠的窗口）。
+        user_name_map, focus_user, weights: 同 calculate_intimacy_metrics。
+        top_k: 可选，每个窗口只保留得分最高的 top_k 对用户。
+        max_workers: 同 calculate_intimacy_metrics。
+    返回：
+        DataFrame，每行为一个窗口内的一对用户：window_start、window_end（UTC 时间）
+        以及与 calculate_intimacy_metrics 相同的列；按窗口先后、窗口内得分从高到低排列。
+    """
+    index = build_message_index(df)
+    user_ids, names = index['user_ids'], index['names']
+    focus_code = None
+    if focus_user is not None:
+        focus_user = str(focus_user)
+        if focus_user not in user_ids:
+            return pd.DataFrame()
+        focus_code = user_ids.index(focus_user)
+    pairs = _candidate_pairs(len(user_ids), focus_code)
+    if len(pairs) == 0:
+        return pd.DataFrame()
+
+    starts, ends = window_bounds(index['times'], window_seconds, step_seconds or window_seconds)
+    with profiling.stage('window_pairs', rows_in=len(pairs)), \
+            _pair_executor(index, max_workers) as (executor, workers):
+        results = run_pair_batches(executor, partial(_compute_pair_window_batch, starts, ends), pairs,
+                                   index['counts'], workers)
+    active = [(pair, res) for pair, res in zip(pairs, results) if res is not None]
+    if not active:
+        return pd.DataFrame()
+
+    # 拼接所有用户对的窗口统计量，按窗口稳定排序（窗口内保持用户对的原始顺序）
+    def column(field):
+        return np.concatenate([res[field] for _, res in active])
+    sizes = [len(res['windows']) for _, res in active]
+    codes1 = np.repeat([int(pair[0]) for pair, _ in active], sizes)
+    codes2 = np.repeat([int(pair[1]) for pair, _ in active], sizes)
+    window_ids = column('windows')
+    order = np.argsort(window_ids, kind='stable')
+    count1, count2 = column('count1'), column('count2')
+    metrics = metrics_from_statistics(
+        count1, count2, column('length_sum1') / count1, column('length_sum2') / count2, column('span'),
+        *[np.concatenate([res['pair_stats'][i] for _, res in active]) for i in range(6)]
     )
-    
-    # 整体活跃度惩罚因子：如果群总消息数少于 1000，则乘以 (总消息数/1000)
-    total_msgs_overall = len(df)
-    activity_factor = min(1.0, total_msgs_overall / 1000.0)
-    metrics_df['closeness_score'] *= activity_factor
+    raw_df = pd.DataFrame({
+        'user1': categorical_column(codes1, user_ids),
+        'user2': categorical_column(codes2, user_ids),
+        'name1': categorical_column(codes1, names),
+        'name2': categorical_column(codes2, names),
+        **metrics
+    }).iloc[order].reset_index(drop=True)
+    window_ids = window_ids[order]
+    if user_name_map:
+        _apply_name_map(raw_df, user_name_map)
+
+    # 每个窗口内的群消息总数，用于整体活跃度惩罚因子
+    all_times = np.sort(index['times'])
+    window_totals = np.searchsorted(all_times, ends) - np.searchsorted(all_times, starts)
+    frames = []
+    boundaries = np.flatnonzero(np.diff(window_ids)) + 1
+    for rows in np.split(np.arange(len(raw_df)), boundaries):
+        window = window_ids[rows[0]]
+        ranked = rank_pairs(raw_df.iloc[rows].reset_index(drop=True), int(window_totals[window]),
+                            weights=weights, top_k=top_k)
+        ranked.insert(0, 'window_start', pd.to_datetime(starts[window], unit='s'))
+        ranked.insert(1, 'window_end', pd.to_datetime(ends[window], unit='s'))
+        frames.append(ranked)
+    return pd.concat(frames, ignore_index=True)
+
+def _rank_raw_metrics(metrics_df, total_msgs, user_name_map=None, extrema=None, index=None, pruned_pairs=(),
+                      weights=WEIGHTS, top_k=None, raw_metrics_path=None) -> pd.DataFrame:
+    """应用用户名映射、追加被剪枝的用户对得到原始指标，按需保存后评分排序。"""
+    if user_name_map and not metrics_df.empty:
+        _apply_name_map(metrics_df, user_name_map)
+    if len(pruned_pairs):
+        pruned_df = _pruned_pairs_frame(index, pruned_pairs, user_name_map)
+        if metrics_df.empty:
+            metrics_df = pruned_df
+        else:
+            metrics_df['pruned'] = False
+            metrics_df = pd.concat([metrics_df, pruned_df], ignore_index=True)
+    if metrics_df.empty:
+        return metrics_df
+    if raw_metrics_path:
+        with profiling.stage('save_raw_metrics', rows_in=len(metrics_df)):
+            # 只有 Top-K 搜索（提供了 extrema）的结果缺少部分用户对，其余情况保存的都是完整结果
+            save_raw_metrics(raw_metrics_path, metrics_df, total_msgs, extrema,
+                             top_k if extrema is not None else None)
+    with profiling.stage('score', rows_in=len(metrics_df)) as record:
+        ranked = rank_pairs(metrics_df, total_msgs, extrema, weights, top_k)
+        record['rows_out'] = len(ranked)
+    return ranked
+
+def rank_pairs(raw_df: pd.DataFrame, total_msgs: int, extrema: dict = None, weights: dict = WEIGHTS,
+               top_k: int = None) -> pd.DataFrame:
+    """
+    对原始指标评分并排序，返回与 calculate_intimacy_metrics 相同格式的结果。
+
+    参数：
+        raw_df: 评分前的原始指标，按用户对原始顺序排列；可含 pruned 列（被剪枝的用户对不参与归一化）。
+        total_msgs: 群聊总消息数，用于计算整体活跃度惩罚因子。
+        extrema: 可选，归一化使用的 {指标名: (最小值, 最大值)}，默认由未剪枝的用户对统计。
+        weights: 指标权重。
+        top_k: 可选，只返回得分最高的 top_k 行。
+    """
+    if 'pruned' in raw_df.columns:
+        pruned = raw_df['pruned'].to_numpy(dtype=bool)
+        metrics_df = raw_df[~pruned].drop(columns=['closeness_score', 'pruned'], errors='ignore')
+        if not metrics_df.empty:
+            # 归一化、加权求和并乘以整体活跃度惩罚因子
+            score_metrics(metrics_df, total_msgs, extrema, weights)
+            metrics_df['pruned'] = False
+        metrics_df = pd.concat([metrics_df, raw_df[pruned]], ignore_index=True) if not metrics_df.empty \
+            else raw_df.reset_index(drop=True)
+    else:
+        # 归一化（top_k 模式下使用全部候选用户对上的极值）、加权求和并乘以整体活跃度惩罚因子
+        metrics_df = score_metrics(raw_df.copy(), total_msgs, extrema, weights)
 
-    metrics_df.sort_values('closeness_score', ascending=False, inplace=True)
+    # 稳定排序：得分相同时保持用户对的原始顺序
+    metrics_df.sort_values('closeness_score', ascending=False, kind='stable', inplace=True)
     metrics_df.reset_index(drop=True, inplace=True)
+    if top_k:
+        metrics_df = metrics_df.head(top_k)
     return metrics_df
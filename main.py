@@ -8,52 +8,509 @@ main.py
   - 指定特定用户（focus_user 参数），仅计算该用户与其他人的互动。
   - 分析模式：群聊 (group) 或 私聊 (c2c)。
   - 多进程加速计算。
-  - 可交互输入时间段，格式为 YYYY/MM/DD；若不输入则默认使用所有数据。
+  - 提取并清洗后的数据按数据库指纹缓存到磁盘，数据库未变化时跳过提取和清洗（--no-cache 关闭）。
+  - 通过 --save-metrics 保存评分前的原始指标；--rescore 以新的权重（--weights 或 --weights-file）重新评分，不重新计算用户对。
+  - 通过 --state 指定增量状态文件，重复分析同一数据库时只提取并合并新增消息（见 incremental.py）。
+  - 通过 --groups 批量分析多个群或全部群（见 batch_analysis.py），各群分配到不同进程，输出各群结果和汇总表。
+  - 通过 --window/--step 计算滑动时间窗口内的亲密度时间序列（长表 CSV）和趋势图（见 sliding_window.py）。
+  - 通过 --watch 持续监视数据库，增量合并新写入的消息并定期刷新排名 CSV（见 watch_mode.py）。
+  - 通过 --profile 记录各阶段的耗时、CPU 时间、峰值内存、行数和工作进程利用率，输出到控制台和 JSON（见 profiling.py）。
+  - 全量计算的结果写入紧凑的列式存储（见 pair_store.py），--csv-top 限制 CSV 只输出得分最高的前 N 对用户。
+  - 通过 --spill 以内存受限模式分块计算，结果落盘后流式评分和写出 CSV，内存占用不随用户对数成倍增长（见 spill.py）。
+  - 通过 --shard-plan 按估计代价把一个群的用户对切分为 N 片，--shard i/N 只计算其中一片并保存分片文件（可在不同机器上运行），
+    --merge-shards 合并全部分片后统一评分，输出与单机全量计算一致（见 shard.py）。
+  - 通过 --pipeline 以流水线方式同时进行提取、清洗和建立索引，并在提取期间预热进程池（见 pipeline.py）。
+  - 通过 --serve 启动常驻查询服务：载入的群、消息索引和进程池保留在内存中，通过本机 HTTP 接口反复查询
+    排名、单个用户和用户对，重复的查询只需几毫秒（见 service.py）。
+  - 通过 --no-plots 只输出 CSV 不生成图表；图表在工作进程中并行绘制，格式和分辨率由 --plot-format、--dpi 指定。
+    pandas、Matplotlib 和各分析模块在需要时才导入，--help 和参数检查不加载这些依赖，--no-plots 时不导入 Matplotlib。
+  - 通过 --start/--end 指定时间段，格式为 YYYY/MM/DD；时间过滤在 SQL 查询中完成，若不指定则默认使用所有数据。
 所有注释均为中文，确保中英文数字正确显示，删除特殊 Unicode 字符。
 """
 
 import argparse
 import json
-import pandas as pd
-import matplotlib.pyplot as plt
-from datetime import datetime
+import sys
 
-from extract_chat_data import extract_chat_data
-from clean_chat_data import clean_chat_data
-from intimacy_analysis import calculate_intimacy_metrics
-from visualization import plot_radar_multi, plot_bar_chart, plot_comparison
+import profiling
 
-def input_time(prompt):
+# pandas、Matplotlib 和各分析模块（导入它们会加载 pandas）在用到的函数中才导入，
+# 使 --help、参数检查和 --no-plots 运行不必加载用不到的依赖；
+# 因此输出目录、缓存目录和监视间隔等参数的默认值为 None，由 run 按对应模块中的默认值补全。
+PLOT_FORMATS = ["png", "svg", "pdf", "jpg"]
+
+def parse_date(s):
     """
-    交互式输入时间，格式应为 YYYY/MM/DD，若直接回车则返回 None。
+    解析命令行中的日期参数，格式应为 YYYY/MM/DD。
     """
-    s = input(prompt).strip()
-    if s == "":
-        return None
+    import pandas as pd
     try:
         return pd.to_datetime(s, format="%Y/%m/%d")
     except Exception as e:
-        print(f"[WARN] 时间格式错误：{e}")
+        raise argparse.ArgumentTypeError(f"时间格式错误（应为 YYYY/MM/DD）：{e}")
+
+def parse_duration(text):
+    """解析 --window、--step 参数，见 sliding_window.parse_duration。"""
+    from sliding_window import parse_duration as parse
+    return parse(text)
+
+def parse_shard(text):
+    """解析 --shard 参数，见 shard.parse_shard。"""
+    from shard import parse_shard as parse
+    return parse(text)
+
+def analyze(args, user_map, weights, metrics_path):
+    """
+    提取、清洗数据并计算所有用户对的指标和综合得分；metrics_path 不为 None 时同时保存评分前的原始指标。
+    失败时返回 None。
+    """
+    from clean_chat_data import clean_chat_data
+    from data_cache import load_chat_data
+    from extract_chat_data import extract_chat_data
+    from incremental import open_state, save_state
+    from intimacy_analysis import calculate_intimacy_metrics
+
+    if args.pipeline:
+        return analyze_pipelined(args, user_map, weights, metrics_path)
+
+    # 增量模式：只提取高水位之后的新消息，与已保存的统计量合并
+    state = None
+    if args.state:
+        if args.focus_user or args.prune or args.mode == "c2c":
+            print("[WARN] 增量模式不支持 --focus-user、--prune 和 c2c 模式，已忽略 --state。")
+        else:
+            state, extract_start, extract_end = open_state(args.state, args.db, args.group, args.start, args.end)
+
+    print("正在提取数据...")
+    if args.start is not None:
+        print(f"数据起始日期为：{args.start.date()}")
+    if args.end is not None:
+        print(f"数据截止日期为：{args.end.date()}")
+    if state is not None:
+        with profiling.stage('extract') as record:
+            df = extract_chat_data(args.db, args.group, start=extract_start, end=extract_end)
+            record['rows_out'] = len(df)
+        # 增量模式下没有新消息时仍可由已保存的统计量得到结果
+        has_history = len(state['user_ids']) > 0
+        if df.empty and not has_history:
+            print("[ERROR] 未提取到数据，请检查群号和时间范围，程序退出。")
+            return None
+        print(f"提取到 {len(df)} 条消息记录。")
+        print("正在清洗数据...")
+        with profiling.stage('clean', rows_in=len(df)) as record:
+            df = clean_chat_data(df)
+            record['rows_out'] = len(df)
+        if df.empty and not has_history:
+            print("[ERROR] 清洗后的数据为空，程序退出。")
+            return None
+    else:
+        # 数据库未变化时直接读取缓存的清洗结果，跳过提取和清洗
+        df, from_cache = load_chat_data(args.db, args.group, start=args.start, end=args.end,
+                                        cache_dir=args.cache_dir, use_cache=not args.no_cache)
+        if from_cache:
+            print(f"已从缓存读取清洗后的数据，共 {len(df)} 条消息记录。")
+        if df.empty:
+            print("[ERROR] 未提取到数据或清洗后的数据为空，请检查群号和时间范围，程序退出。")
+            return None
+
+    # 模式选择：若 mode 为 c2c 且提供 id，则仅保留与该好友相关数据
+    if args.mode == "c2c" and args.id:
+        df = df[df["sender_id"].isin([args.id])]
+        print(f"筛选后，仅保留与好友 {args.id} 的消息记录，共 {len(df)} 条。")
+
+    focus_user = int(args.focus_user) if args.focus_user else None
+
+    print("正在计算互动指标...")
+    with profiling.stage('metrics', rows_in=len(df)) as record:
+        metrics_df = calculate_intimacy_metrics(df, user_name_map=user_map, focus_user=focus_user,
+                                                prune=args.prune, prune_min_overlap=args.prune_min_overlap,
+                                                top_k=args.top_k, state=state, weights=weights,
+                                                raw_metrics_path=metrics_path)
+        record['rows_out'] = len(metrics_df)
+    if state is not None:
+        save_state(args.state, state)
+        print(f"增量状态已保存到 {args.state}")
+    return metrics_df
+
+def analyze_pipelined(args, user_map, weights, metrics_path):
+    """
+    流水线模式：提取、清洗和建立索引在不同线程中重叠执行，计算用户对的进程池在提取之前启动。
+    结果与 analyze 相同；失败时返回 None。
+    """
+    from intimacy_analysis import calculate_intimacy_metrics, warm_pair_pool
+    from pipeline import load_indexed_chat_data
+
+    if args.start is not None:
+        print(f"数据起始日期为：{args.start.date()}")
+    if args.end is not None:
+        print(f"数据截止日期为：{args.end.date()}")
+    # 只关注一位用户时由单次扫描引擎计算，不需要进程池
+    with warm_pair_pool(1 if args.focus_user else None) as pool:
+        df, index, from_cache = load_indexed_chat_data(args.db, args.group, start=args.start, end=args.end,
+                                                       cache_dir=args.cache_dir, use_cache=not args.no_cache)
+        if from_cache:
+            print(f"已从缓存读取清洗后的数据，共 {len(df)} 条消息记录。")
+        if df is None:
+            print("[ERROR] 未提取到数据或清洗后的数据为空，请检查群号和时间范围，程序退出。")
+            return None
+        focus_user = int(args.focus_user) if args.focus_user else None
+        print("正在计算互动指标...")
+        with profiling.stage('metrics', rows_in=len(df)) as record:
+            metrics_df = calculate_intimacy_metrics(df, user_name_map=user_map, focus_user=focus_user,
+                                                    prune=args.prune, prune_min_overlap=args.prune_min_overlap,
+                                                    top_k=args.top_k, weights=weights, raw_metrics_path=metrics_path,
+                                                    index=index, warm_pool=pool)
+            record['rows_out'] = len(metrics_df)
+    return metrics_df
+
+def write_result_csv(metrics_df, output_csv, csv_top=None):
+    """
+    写出结果 CSV。csv_top 为正数时只写出得分最高的前 csv_top 对用户，为 0 时不写出
+    （配合 --save-metrics 时全部用户对的原始指标仍保存在原始指标文件中，可用 --rescore 重新生成）。
+    """
+    if csv_top == 0:
+        print("已按 --csv-top 0 跳过 CSV 输出。")
+        return
+    rows = metrics_df.head(csv_top) if csv_top else metrics_df
+    with profiling.stage('write_csv', rows_in=len(rows)):
+        rows.to_csv(output_csv, index=False, encoding="gbk")
+    suffix = f"（前 {len(rows)}/{len(metrics_df)} 对用户）" if len(rows) < len(metrics_df) else ""
+    print(f"指标结果已保存到 {output_csv}{suffix}")
+
+def load_messages(args):
+    """读取（或从缓存读取）清洗后的群聊数据，c2c 模式下只保留与指定好友的消息；没有数据时返回 None。"""
+    from data_cache import load_chat_data
+
+    print("正在提取数据...")
+    df, from_cache = load_chat_data(args.db, args.group, start=args.start, end=args.end,
+                                    cache_dir=args.cache_dir, use_cache=not args.no_cache)
+    if from_cache:
+        print(f"已从缓存读取清洗后的数据，共 {len(df)} 条消息记录。")
+    if df.empty:
+        print("[ERROR] 未提取到数据或清洗后的数据为空，请检查群号和时间范围，程序退出。")
         return None
+    if args.mode == "c2c" and args.id:
+        df = df[df["sender_id"].isin([args.id])]
+        print(f"筛选后，仅保留与好友 {args.id} 的消息记录，共 {len(df)} 条。")
+    return df
+
+def run_windows(args, user_map, weights):
+    """滑动窗口模式：计算各时间窗口内的指标，输出长表 CSV 和亲密度趋势图。"""
+    from intimacy_analysis import calculate_window_metrics
+
+    ignored = [flag for flag, value in (("--state", args.state), ("--prune", args.prune)) if value]
+    if ignored:
+        print(f"[WARN] 滑动窗口模式不支持 {'、'.join(ignored)}，已忽略。")
+    df = load_messages(args)
+    if df is None:
+        return
+
+    print("正在计算各时间窗口的互动指标...")
+    with profiling.stage('window_metrics', rows_in=len(df)) as record:
+        windows_df = calculate_window_metrics(df, args.window, args.step, user_name_map=user_map,
+                                              focus_user=args.focus_user, weights=weights, top_k=args.top_k)
+        record['rows_out'] = len(windows_df)
+    if windows_df.empty:
+        print("[ERROR] 计算结果为空，程序退出。")
+        return
+    output_csv = f"intimacy_{args.group}_windows.csv"
+    with profiling.stage('write_csv', rows_in=len(windows_df)):
+        windows_df.to_csv(output_csv, index=False, encoding="gbk")
+    print(f"共 {windows_df['window_start'].nunique()} 个时间窗口，结果已保存到 {output_csv}")
+    if args.no_plots:
+        return
+    from visualization import plot_pair_trend, render_charts
+    with profiling.stage('plot_trend'):
+        render_charts([(plot_pair_trend, {'windows_df': windows_df, 'top_n': 5, 'output_prefix': "trend_chart"})],
+                      font=args.font, fmt=args.plot_format, dpi=args.dpi)
+
+def run_spill(args, user_map, weights):
+    """内存受限模式：分块计算全部用户对并写入临时目录，流式评分和写出 CSV，只为前若干对用户构造结果供图表使用。"""
+    import tempfile
+    from intimacy_analysis import calculate_spilled_metrics
+    from spill import DEFAULT_BLOCK_PAIRS, ranked_frame, write_ranked_csv
+
+    df = load_messages(args)
+    if df is None:
+        return
+
+    print("正在分块计算互动指标...")
+    with tempfile.TemporaryDirectory(prefix="intimacy_spill_", dir=args.spill_dir,
+                                     ignore_cleanup_errors=True) as spill_dir:
+        result = calculate_spilled_metrics(df, spill_dir, user_name_map=user_map, weights=weights,
+                                           block_pairs=args.spill_block or DEFAULT_BLOCK_PAIRS)
+        if result is None or len(result['order']) == 0:
+            print("[ERROR] 计算结果为空，程序退出。")
+            return
+        try:
+            output_csv = f"intimacy_{args.group}.csv"
+            if args.csv_top == 0:
+                print("已按 --csv-top 0 跳过 CSV 输出。")
+            else:
+                with profiling.stage('write_csv') as record:
+                    record['rows_in'] = write_ranked_csv(result, output_csv, args.csv_top)
+                print(f"指标结果已保存到 {output_csv}（共 {len(result['order'])} 对用户）")
+            # 图表只需要前 top_n 对（雷达图为前 5 对）
+            metrics_df = ranked_frame(result, result['order'][:max(args.top_n, 5)])
+        finally:
+            # 关闭内存映射文件，使临时目录可以删除
+            result['store'].clear()
+    plot_results(args, metrics_df)
+
+def run_shard_plan(args):
+    """按估计代价把全部用户对切分为 --shard-plan 片，输出各片的区间和代价，并保存为 shard_plan_<群号>.json。"""
+    from intimacy_analysis import build_message_index
+    from shard import plan_shards
+
+    df = load_messages(args)
+    if df is None:
+        return
+    index = build_message_index(df)
+    num_users = len(index['user_ids'])
+    plan = plan_shards(index['counts'], args.shard_plan)
+    total_cost = sum(item['cost'] for item in plan) or 1
+    print(f"{num_users} 位用户，共 {num_users * (num_users - 1) // 2} 对用户，分为 {len(plan)} 片：")
+    for item in plan:
+        print(f"  第 {item['shard']}/{len(plan)} 片：第 {item['start']}～{item['end']} 对（{item['pairs']} 对），"
+              f"估计代价占 {item['cost'] * 100 / total_cost:.1f}%")
+    output = f"shard_plan_{args.group}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({'group': args.group, 'users': num_users, 'messages': len(df), 'shards': plan}, f,
+                  ensure_ascii=False, indent=2)
+    print(f"分片方案已保存到 {output}。在各台机器上以相同的数据库和参数运行 --shard i/{len(plan)}，"
+          f"再用 --merge-shards 合并。")
+
+def run_shard(args):
+    """分片模式：只计算 --shard i/N 指定的一片用户对，结果保存为分片文件，供 --merge-shards 合并。"""
+    from intimacy_analysis import calculate_shard_metrics
+    from shard import default_shard_path, save_shard
+
+    df = load_messages(args)
+    if df is None:
+        return
+    shard, num_shards = args.shard
+    print("正在计算本分片的互动指标...")
+    result = calculate_shard_metrics(df, shard, num_shards)
+    output = default_shard_path(args.group, shard, num_shards)
+    with profiling.stage('save_shard', rows_in=len(result['store']['valid'])):
+        save_shard(output, result, args.group, args.start, args.end)
+    print(f"分片结果已保存到 {output}")
+
+def merge_shards(paths, group_id, user_map, weights, metrics_path, start=None, end=None):
+    """
+    合并 --shard 保存的全部分片文件，统一归一化、评分；metrics_path 不为 None 时保存原始指标。
+    指定 start、end（--start、--end）时检查各分片使用了同样的时间范围。失败时返回 None。
+    """
+    from intimacy_analysis import merge_shard_metrics
+
+    print(f"正在合并 {len(paths)} 个分片文件...")
+    try:
+        return merge_shard_metrics(paths, group_id, user_name_map=user_map, weights=weights,
+                                   raw_metrics_path=metrics_path, start=start, end=end)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[ERROR] 无法合并分片文件：{e}")
+        return None
+
+def rescore(metrics_path, weights, top_k=None):
+    """
+    读取已保存的原始指标，以新的权重重新归一化、加权并乘以整体活跃度惩罚因子，不重新计算用户对。
+    失败时返回 None。
+    """
+    from intimacy_analysis import rank_pairs
+    from metrics_store import load_raw_metrics
+
+    try:
+        with profiling.stage('load_raw_metrics') as record:
+            raw_df, meta = load_raw_metrics(metrics_path)
+            record['rows_out'] = len(raw_df)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] 无法读取原始指标文件 {metrics_path}：{e}")
+        if isinstance(e, FileNotFoundError):
+            print("[INFO] 原始指标文件只在指定 --save-metrics 时保存，请先以 --save-metrics 运行一次分析。")
+        return None
+    if meta['top_k']:
+        print("[ERROR] 该原始指标文件来自 Top-K 模式，只包含部分用户对，无法以新的权重重新评分。")
+        return None
+    print(f"正在以新的权重重新评分（{len(raw_df)} 对用户）...")
+    with profiling.stage('score', rows_in=len(raw_df)):
+        return rank_pairs(raw_df, meta['total_msgs'], meta['extrema'], weights, top_k)
+
+def run_groups(args, user_map, weights):
+    """批量模式：分析 --groups 指定的多个群，输出各群的 CSV、图表（--save-metrics 时还有原始指标文件）和汇总表。"""
+    from batch_analysis import default_options, parse_group_list, run_batch
+
+    try:
+        group_ids = parse_group_list(args.groups)
+    except ValueError as e:
+        print(f"[ERROR] --groups 参数无效：{e}")
+        return
+    ignored = [flag for flag, value in (("--state", args.state), ("--metrics-file", args.metrics_file),
+                                        ("--mode c2c", args.mode == "c2c")) if value]
+    if args.save_metrics:
+        ignored.append("--save-metrics 的路径（各群的原始指标文件保存在输出目录中）")
+    if ignored:
+        print(f"[WARN] 批量模式不支持 {'、'.join(ignored)}，已忽略。")
+    options = default_options(start=args.start, end=args.end, focus_user=args.focus_user, prune=args.prune,
+                              prune_min_overlap=args.prune_min_overlap, top_k=args.top_k, weights=weights,
+                              user_map=user_map, output_dir=args.output_dir, cache_dir=args.cache_dir,
+                              use_cache=not args.no_cache, csv_top=args.csv_top, plots=not args.no_plots, top_n=args.top_n,
+                              font=args.font, plot_format=args.plot_format, dpi=args.dpi,
+                              save_metrics=args.save_metrics is not None)
+    with profiling.stage('batch'):
+        run_batch(args.db, group_ids, options, args.workers)
+
+def run_watch(args, user_map, weights):
+    """监视模式：持续合并新写入的消息，定期刷新 intimacy_<群号>.csv，不生成图表。"""
+    from watch_mode import watch
+
+    if args.focus_user or args.prune or args.mode == "c2c":
+        print("[ERROR] 监视模式不支持 --focus-user、--prune 和 c2c 模式。")
+        return
+    if args.end is not None:
+        print("[WARN] 监视模式没有截止时间，已忽略 --end。")
+    if args.start is not None:
+        print(f"数据起始日期为：{args.start.date()}")
+    watch(args.db, args.group, f"intimacy_{args.group}.csv", start=args.start, user_name_map=user_map,
+          weights=weights, top_k=args.top_k, state_path=args.state, poll_seconds=args.poll_interval,
+          refresh_seconds=args.refresh_interval, max_iterations=args.max_iterations)
+
+def run_serve(args, user_map, weights):
+    """常驻查询服务：指定 --group 时预先载入该群并计算全部用户对，然后提供本机 HTTP 接口直到按 Ctrl+C。"""
+    from service import DEFAULT_MAX_GROUPS, DEFAULT_PORT, IntimacyService, serve_http
+
+    with IntimacyService(args.db, user_name_map=user_map, weights=weights,
+                         max_groups=args.max_groups or DEFAULT_MAX_GROUPS, cache_dir=args.cache_dir,
+                         use_cache=not args.no_cache) as service:
+        if args.group is not None:
+            try:
+                service.load(args.group, args.start, args.end, pairs=True)
+            except LookupError as e:
+                print(f"[WARN] {e}")
+        serve_http(service, DEFAULT_PORT if args.port is None else args.port)
 
 def main():
     parser = argparse.ArgumentParser(description="QQ 聊天记录互动亲密度分析工具")
-    parser.add_argument("--group", type=int, required=True, help="指定群聊号码，例如951628619")
-    parser.add_argument("--db", type=str, required=True, help="数据库文件路径，例如 nt_msg.clean.db")
+    parser.add_argument("--group", type=int, default=None, help="指定群聊号码，例如951628619")
+    parser.add_argument("--groups", type=str, default=None, help="批量模式：逗号分隔的群号列表，或 all 表示数据库中的所有群（与 --group 二选一）")
+    parser.add_argument("--workers", type=int, default=None, help="批量模式的工作进程数，默认为 CPU 核数")
+    parser.add_argument("--output-dir", type=str, default=None, help="批量模式的输出目录，默认为 batch_output")
+    parser.add_argument("--db", type=str, default=None, help="数据库文件路径，例如 nt_msg.clean.db（--rescore、--merge-shards 时可省略）")
     parser.add_argument("--usermap", type=str, default=None, help="用户名映射文件路径（JSON格式），可选")
     parser.add_argument("--mode", type=str, choices=["c2c", "group"], default="group", help="分析模式：c2c (私聊) 或 group (群聊)")
     parser.add_argument("--id", type=str, default=None, help="当 mode 为 group 时，指定群号；mode 为 c2c 时指定好友QQ号")
     parser.add_argument("--focus-user", type=str, default=None, help="可选，指定单个用户的QQ号，仅计算该用户与其他人的互动")
     parser.add_argument("--top-n", type=int, default=30, help="条形图显示前 top_n 对用户（最多30对）")
+    parser.add_argument("--csv-top", type=int, default=None, help="可选，CSV 只输出综合得分最高的前 N 对用户，为 0 时不输出 CSV（可配合 --save-metrics 把全部结果保存在原始指标文件中）")
+    parser.add_argument("--no-plots", action="store_true", help="可选，只输出 CSV，不生成图表（也不导入 Matplotlib）")
+    parser.add_argument("--plot-format", type=str, choices=PLOT_FORMATS, default="png", help="图表的图片格式，默认 png")
+    parser.add_argument("--dpi", type=int, default=150, help="图表的分辨率（DPI），默认 150")
+    parser.add_argument("--prune", action="store_true", help="可选，启用共同活跃度剪枝，跳过从未在相近时段发言的用户对")
+    parser.add_argument("--prune-min-overlap", type=int, default=1, help="剪枝时保留用户对所需的最少共同活跃时段数（每时段 1 小时），默认 1")
+    parser.add_argument("--top-k", type=int, default=None, help="可选，只计算并输出综合得分最高的 K 对用户，跳过不可能进入前 K 名的用户对")
+    parser.add_argument("--start", type=parse_date, default=None, help="可选，起始日期（含），格式 YYYY/MM/DD，例如 2024/01/01")
+    parser.add_argument("--end", type=parse_date, default=None, help="可选，截止日期，格式 YYYY/MM/DD，例如 2024/12/31")
+    parser.add_argument("--window", type=parse_duration, default=None, help="可选，滑动窗口长度，如 30d、12h、2w（省略单位时按天），输出各窗口的指标和趋势图")
+    parser.add_argument("--step", type=parse_duration, default=None, help="滑动窗口的步长，默认等于窗口长度")
+    parser.add_argument("--watch", action="store_true", help="可选，持续监视数据库，合并新写入的消息并定期刷新排名 CSV（Ctrl+C 停止）")
+    parser.add_argument("--poll-interval", type=float, default=None, help="监视模式的轮询间隔（秒），默认 5")
+    parser.add_argument("--refresh-interval", type=float, default=None, help="监视模式刷新排名 CSV 的间隔（秒），默认 30")
+    parser.add_argument("--max-iterations", type=int, default=None, help="监视模式的轮询次数上限，默认不限")
+    parser.add_argument("--spill", action="store_true", help="可选，内存受限模式：分块计算用户对并写入磁盘，流式评分和写出 CSV，适合内存较小的机器分析超大群")
+    parser.add_argument("--spill-dir", type=str, default=None, help="内存受限模式存放临时结果文件的目录，默认为系统临时目录")
+    parser.add_argument("--spill-block", type=int, default=None, help="内存受限模式每块的用户对数，默认 200000")
+    parser.add_argument("--shard-plan", type=int, default=None, help="可选，按估计代价把全部用户对切分为 N 片，输出各片的区间并保存为 shard_plan_<群号>.json")
+    parser.add_argument("--shard", type=parse_shard, default=None, help="可选，分片模式：只计算第 i 片（格式 i/N，i 从 1 开始），结果保存为 intimacy_<群号>.shard<i>-of-<N>.npz")
+    parser.add_argument("--merge-shards", type=str, nargs="+", default=None, help="可选，合并全部分片文件，统一评分并生成 CSV 和图表（--save-metrics 时还有原始指标文件），不需要 --db")
+    parser.add_argument("--pipeline", action="store_true", help="可选，流水线模式：提取、清洗和建立索引重叠执行，并在提取期间预热进程池")
+    parser.add_argument("--serve", action="store_true", help="可选，启动常驻查询服务：载入的群和进程池保留在内存中，通过本机 HTTP 接口反复查询排名、单个用户和用户对（Ctrl+C 停止），此时 --group 可省略")
+    parser.add_argument("--port", type=int, default=None, help="查询服务的 HTTP 端口（只监听 127.0.0.1），默认 8765")
+    parser.add_argument("--max-groups", type=int, default=None, help="查询服务最多保留在内存中的群数（按最近使用淘汰），默认 4")
+    parser.add_argument("--state", type=str, default=None, help="可选，增量状态文件路径（.npz），只提取并合并上次分析之后的新消息")
+    parser.add_argument("--no-cache", action="store_true", help="可选，不读取也不写入清洗后数据的缓存")
+    parser.add_argument("--cache-dir", type=str, default=None, help="清洗后数据的缓存目录，默认为 .intimacy_cache")
+    parser.add_argument("--weights", type=str, default=None, help="可选，覆盖指标权重，格式为 指标名=权重,指标名=权重，例如 reply_count=0.3,reciprocity=0.05")
+    parser.add_argument("--weights-file", type=str, default=None, help="可选，从 JSON 文件读取指标权重，例如 {\"reply_count\": 0.3}")
+    parser.add_argument("--rescore", action="store_true", help="可选，读取上次保存的原始指标，以新的权重重新评分并生成 CSV 和图表，不重新计算用户对")
+    parser.add_argument("--save-metrics", type=str, nargs="?", const="", default=None, metavar="PATH", help="可选，保存评分前的原始指标（供 --rescore 使用），省略路径时保存到 --metrics-file 或 intimacy_<群号>.metrics.npz")
+    parser.add_argument("--metrics-file", type=str, default=None, help="原始指标文件路径（--rescore 读取、--save-metrics 省略路径时保存），默认为 intimacy_<群号>.metrics.npz")
+    parser.add_argument("--profile", action="store_true", help="可选，记录各阶段的耗时、CPU 时间、峰值内存、行数和工作进程利用率，输出到控制台和 JSON 文件")
+    parser.add_argument("--profile-output", type=str, default=None, help="剖析结果 JSON 的路径，默认为 profile_<群号>.json（批量模式为 profile_batch.json）")
+    parser.add_argument("--profile-kernel", action="store_true", help="可选，同时用 cProfile 剖析用户对计算，结果保存为 <剖析结果文件名>.kernel.prof")
     parser.add_argument("--font", type=str, default="Microsoft YaHei", help="中文字体名称，例如 Microsoft YaHei 或 SimHei")
     args = parser.parse_args()
+    if (args.group is None) == (args.groups is None) and not (args.serve and args.groups is None):
+        parser.error("必须且只能指定 --group 和 --groups 之一（--serve 时 --group 可省略）")
+    if args.groups is not None and args.rescore:
+        parser.error("--rescore 只能用于单个群（--group）")
+    if not args.db and not (args.rescore or args.merge_shards):
+        parser.error("必须指定 --db（仅 --rescore、--merge-shards 时可省略）")
+    if args.step is not None and args.window is None:
+        parser.error("--step 需要与 --window 一起使用")
+    if args.window is not None and (args.groups is not None or args.rescore):
+        parser.error("--window 只能用于单个群（--group），且不能与 --rescore 同时使用")
+    if args.watch and (args.groups is not None or args.rescore or args.window is not None):
+        parser.error("--watch 只能用于单个群（--group），且不能与 --rescore、--window 同时使用")
+    if args.profile_kernel and not args.profile:
+        parser.error("--profile-kernel 需要与 --profile 一起使用")
+    if args.spill and (args.groups is not None or args.rescore or args.window is not None or args.watch
+                       or args.state or args.focus_user or args.top_k or args.prune):
+        parser.error("--spill 只能用于单个群（--group）的全量计算，不能与 --rescore、--window、--watch、--state、"
+                     "--focus-user、--top-k、--prune 同时使用")
+    if args.spill_block is not None and args.spill_block <= 0:
+        parser.error("--spill-block 必须为正整数")
+    sharding = [flag for flag, value in (("--shard-plan", args.shard_plan is not None), ("--shard", args.shard),
+                                         ("--merge-shards", args.merge_shards)) if value]
+    if len(sharding) > 1:
+        parser.error(f"{'、'.join(sharding)} 不能同时使用")
+    if sharding and (args.groups is not None or args.rescore or args.window is not None or args.watch or args.spill
+                     or args.state or args.focus_user or args.top_k or args.prune):
+        parser.error(f"{sharding[0]} 只能用于单个群（--group）的全量计算，不能与 --rescore、--window、--watch、--spill、"
+                     "--state、--focus-user、--top-k、--prune 同时使用")
+    if args.pipeline and (args.groups is not None or args.rescore or args.window is not None or args.watch
+                          or args.spill or args.state or sharding or args.mode == "c2c"):
+        parser.error("--pipeline 只能用于单个群（--group）的群聊分析，不能与 --rescore、--window、--watch、--spill、"
+                     "--state、分片模式和 c2c 模式同时使用")
+    if args.serve and (args.groups is not None or args.rescore or args.window is not None or args.watch or args.spill or args.state or sharding
+                       or args.pipeline or args.focus_user or args.top_k or args.prune or args.mode == "c2c"):
+        parser.error("--serve 不能与 --groups、--rescore、--window、--watch、--spill、--state、分片模式、--pipeline、"
+                     "--focus-user、--top-k、--prune 和 c2c 模式同时使用（查询的用户和名次在请求中指定）")
+    if args.port is not None and not 0 <= args.port <= 65535:
+        parser.error("--port 应在 0 到 65535 之间")
+    if args.max_groups is not None and args.max_groups <= 0:
+        parser.error("--max-groups 必须为正整数")
+    if args.shard_plan is not None and args.shard_plan <= 0:
+        parser.error("--shard-plan 必须为正整数")
+    if args.csv_top is not None and args.csv_top < 0:
+        parser.error("--csv-top 不能为负数")
+    if args.dpi <= 0:
+        parser.error("--dpi 必须为正整数")
+
+    if not args.profile:
+        run(args)
+        return
+    profiling.start(kernel_profile=args.profile_kernel)
+    try:
+        run(args)
+    finally:
+        # 运行出错或被中断时也输出已完成阶段的剖析结果
+        profile_output = args.profile_output or f"profile_{'batch' if args.groups is not None else args.group}.json"
+        profiling.finish(profile_output, sys.argv)
 
-    # 设置 Matplotlib 字体，确保中英文和数字正常显示
-    plt.rcParams['font.sans-serif'] = [args.font, "Arial"]
-    plt.rcParams['axes.unicode_minus'] = False
+def run(args):
+    """按解析后的命令行参数执行分析。"""
+    from batch_analysis import DEFAULT_OUTPUT_DIR
+    from data_cache import DEFAULT_CACHE_DIR
+    from metrics_store import default_metrics_path
+    from scoring import load_weights_file, parse_weights, resolve_weights
+    from watch_mode import DEFAULT_POLL_SECONDS, DEFAULT_REFRESH_SECONDS
+
+    # 未指定的参数使用各模块中的默认值
+    for name, default in (("output_dir", DEFAULT_OUTPUT_DIR), ("cache_dir", DEFAULT_CACHE_DIR),
+                          ("poll_interval", DEFAULT_POLL_SECONDS), ("refresh_interval", DEFAULT_REFRESH_SECONDS)):
+        if getattr(args, name) is None:
+            setattr(args, name, default)
 
     group_id = args.group
-    db_path = args.db
 
     # 加载用户名映射文件（如果提供）
     user_map = {}
@@ -64,56 +521,72 @@ def main():
         except Exception as e:
             print(f"[WARN] 加载用户名映射文件失败：{e}")
 
-    print("正在提取数据...")
-    df = extract_chat_data(db_path, group_id)
-    if df.empty:
-        print("[ERROR] 未提取到数据，程序退出。")
-        return
-    print(f"提取到 {len(df)} 条消息记录。")
-
-    print("正在清洗数据...")
-    df = clean_chat_data(df)
-
-    # 交互输入时间段
-    print("请输入时间段进行数据筛选（格式为 YYYY/MM/DD），直接回车表示不限制：")
-    start_time = input_time("请输入起始日期（例如 2024/01/01）：")
-    end_time = input_time("请输入结束日期（例如 2024/12/31）：")
-    if start_time is not None:
-        df = df[df['timestamp'] >= start_time]
-        print(f"筛选后，数据起始日期为：{start_time.date()}，剩余 {len(df)} 条记录。")
-    if end_time is not None:
-        df = df[df['timestamp'] <= end_time]
-        print(f"筛选后，数据截止日期为：{end_time.date()}，剩余 {len(df)} 条记录。")
-    if df.empty:
-        print("[ERROR] 筛选后的数据为空，请检查时间范围。")
+    # 权重：默认使用 WEIGHTS，可由 JSON 文件和命令行参数覆盖（命令行优先）
+    try:
+        overrides = load_weights_file(args.weights_file) if args.weights_file else {}
+        if args.weights:
+            overrides.update(parse_weights(args.weights))
+        weights = resolve_weights(overrides)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] 权重参数无效：{e}")
         return
 
-    # 模式选择：若 mode 为 c2c 且提供 id，则仅保留与该好友相关数据
-    if args.mode == "c2c" and args.id:
-        df = df[df["sender_id"].isin([args.id])]
-        print(f"筛选后，仅保留与好友 {args.id} 的消息记录，共 {len(df)} 条。")
+    if args.groups is not None:
+        run_groups(args, user_map, weights)
+        return
 
-    focus_user = int(args.focus_user) if args.focus_user else None
+    if args.serve:
+        run_serve(args, user_map, weights)
+        return
 
-    print("正在计算互动指标...")
-    metrics_df = calculate_intimacy_metrics(df, user_name_map=user_map, focus_user=focus_user)
+    if args.window is not None:
+        run_windows(args, user_map, weights)
+        return
+
+    if args.watch:
+        run_watch(args, user_map, weights)
+        return
+
+    if args.spill:
+        run_spill(args, user_map, weights)
+        return
+
+    if args.shard_plan is not None:
+        run_shard_plan(args)
+        return
+
+    if args.shard is not None:
+        run_shard(args)
+        return
+
+    metrics_path = args.metrics_file or default_metrics_path(group_id)
+    # 原始指标文件只在指定 --save-metrics 时保存
+    save_path = (args.save_metrics or metrics_path) if args.save_metrics is not None else None
+    if args.rescore:
+        metrics_df = rescore(metrics_path, weights, args.top_k)
+    elif args.merge_shards:
+        metrics_df = merge_shards(args.merge_shards, group_id, user_map, weights, save_path, args.start, args.end)
+    else:
+        metrics_df = analyze(args, user_map, weights, save_path)
+    if metrics_df is None:
+        return
     if metrics_df.empty:
         print("[ERROR] 计算结果为空，程序退出。")
         return
 
-    output_csv = f"intimacy_{group_id}.csv"
-    metrics_df.to_csv(output_csv, index=False, encoding="gbk")
-    print(f"指标结果已保存到 {output_csv}")
+    write_result_csv(metrics_df, f"intimacy_{group_id}.csv", args.csv_top)
+    plot_results(args, metrics_df)
 
+def plot_results(args, metrics_df):
+    """生成单个群的结果图表（--no-plots 时跳过）。"""
+    if args.no_plots:
+        return
+    from visualization import chart_jobs, render_charts
     print("正在生成图表...")
-    # 绘制多对雷达图（显示前5对用户）
-    top_pairs = metrics_df.head(5)
-    plot_radar_multi(top_pairs, output_prefix="radar_chart_multi")
-    # 绘制条形图（显示前 top_n 对用户）
-    plot_bar_chart(metrics_df, top_n=args.top_n, group_id=group_id, output_prefix="bar_chart")
-    # 绘制指标对比图（对比综合得分最高的一对用户）
-    top_pair = metrics_df.iloc[0]
-    plot_comparison(top_pair, output_prefix="comparison_chart")
+    # 雷达图（前5对用户）、条形图（前 top_n 对用户）和指标对比图（综合得分最高的一对用户）并行绘制
+    with profiling.stage('plots'):
+        render_charts(chart_jobs(metrics_df, top_n=args.top_n, group_id=args.group),
+                      font=args.font, fmt=args.plot_format, dpi=args.dpi)
     print("所有图表生成完毕。")
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+"""
+metrics_store.py
+----------------
+评分前的原始指标的二进制存储。
+
+计算用户对指标是整个流程中最耗时的部分，而归一化和加权求和很便宜。每次分析后将评分前的
+原始指标（按用户对原始顺序）连同群聊总消息数保存为 NumPy 归档（.npz），之后可以用新的权重
+重新评分（main.py --rescore），几秒内重新生成 CSV 和图表，而不必重新计算用户对。
+
+  - 数值列和布尔列按原始类型保存，文本列（QQ号、名称）保存为定长 Unicode 数组；
+    分类类型的文本列（见 pair_store.py）只保存每行的编号和一份类别表，读取后仍为分类类型；
+  - 元数据（列顺序、总消息数、归一化极值、是否为 Top-K 结果）以 JSON 字符串保存，不需要 pickle。
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# 存储格式版本；版本不一致的文件需要重新计算生成
+STORE_VERSION = 2
+
+def default_metrics_path(group_id) -> str:
+    """默认的原始指标文件名，与 CSV 输出文件放在一起。"""
+    return f"intimacy_{group_id}.metrics.npz"
+
+def save_raw_metrics(path, raw_df, total_msgs, extrema=None, top_k=None):
+    """
+    保存评分前的原始指标。
+
+    参数：
+        path: 输出文件路径。
+        raw_df: 原始指标 DataFrame（按用户对原始顺序，可含 pruned 列）。
+        total_msgs: 群聊总消息数。
+        extrema: 可选，归一化使用的极值（Top-K 模式下为全部候选用户对上的极值）。
+        top_k: 可选，若结果来自 Top-K 模式则记录 K，此时文件只包含部分用户对。
+    """
+    categorical_columns = [col for col in raw_df.columns if isinstance(raw_df[col].dtype, pd.CategoricalDtype)]
+    text_columns = [col for col in raw_df.columns
+                    if col not in categorical_columns
+                    and not (pd.api.types.is_numeric_dtype(raw_df[col]) or pd.api.types.is_bool_dtype(raw_df[col]))]
+    meta = {
+        'version': STORE_VERSION,
+        'columns': list(raw_df.columns),
+        'text_columns': text_columns,
+        'categorical_columns': categorical_columns,
+        'total_msgs': int(total_msgs),
+        'extrema': extrema,
+        'top_k': top_k
+    }
+    arrays = {}
+    for i, col in enumerate(raw_df.columns):
+        values = raw_df[col]
+        if col in categorical_columns:
+            arrays[f"col{i}"] = values.cat.codes.to_numpy()
+            arrays[f"col{i}_categories"] = np.array([str(v) for v in values.cat.categories], dtype=str)
+        else:
+            arrays[f"col{i}"] = np.array([str(v) for v in values], dtype=str) if col in text_columns \
+                else values.to_numpy()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps(meta, ensure_ascii=False)), **arrays)
+    os.replace(tmp_path, path)
+
+def load_raw_metrics(path):
+    """
+    读取原始指标。
+
+    返回：
+        (raw_df, meta)：原始指标 DataFrame，以及包含 total_msgs、extrema、top_k 的元数据字典。
+    """
+    with np.load(path, allow_pickle=False) as archive:
+        meta = json.loads(str(archive['meta']))
+        if meta.get('version') != STORE_VERSION:
+            raise ValueError(f"原始指标文件版本不一致：{meta.get('version')}")
+        categorical_columns = meta['categorical_columns']
+        data = {}
+        for i, col in enumerate(meta['columns']):
+            values = archive[f"col{i}"]
+            if col in categorical_columns:
+                data[col] = pd.Categorical.from_codes(values, categories=archive[f"col{i}_categories"].tolist())
+            else:
+                data[col] = values.tolist() if col in meta['text_columns'] else values
+    if meta['extrema']:
+        meta['extrema'] = {col: tuple(bounds) for col, bounds in meta['extrema'].items()}
+    return pd.DataFrame(data, columns=meta['columns']), meta
@@ -0,0 +1,127 @@
+"""
+pair_scheduler.py
+-----------------
+按代价调度用户对的计算任务。
+
+单对用户的计算代价近似与两人消息数之和成正比，不同用户对之间可能相差数千倍。
+若按默认方式逐对提交，少数重量级用户对会在最后拖慢整体进度（长尾）。本模块：
+  - 根据两人的消息数估计每对用户的代价；
+  - 按代价从高到低排序，重量级用户对单独成批优先下发；
+  - 轻量级用户对打包成较大的批次，减少进程间通信开销；用户对以 (n, 2) 的 int32 编号数组给出时，
+    每批只下发该数组的一个切片，不为每对用户构造 Python 元组；
+  - 汇总完成进度并按原始顺序返回结果，或在每批结果到达时交给回调函数处理（例如写入列式存储，见 pair_store.py）。
+开启性能剖析（main.py --profile）时，每批任务在工作进程中计时，并记录各工作进程的忙碌时间（见 profiling.py）。
+"""
+
+import time
+from concurrent.futures import as_completed
+
+import numpy as np
+
+import profiling
+
+# 每对用户的固定开销（折算为消息条数），用于体现调度和函数调用本身的成本
+PAIR_OVERHEAD = 64
+# 每个工作进程期望分到的批次数，越大负载越均衡，但通信开销越高
+BATCHES_PER_WORKER = 8
+# 进度输出间隔（百分比）
+PROGRESS_STEP = 10
+
+def estimate_pair_costs(pairs, counts):
+    """
+    估计每对用户的计算代价。
+
+    参数：
+        pairs: (n, 2) 用户编号数组，或前两项为用户编号的元组列表。
+        counts: 每个用户的消息数数组（按用户编号索引）。
+    返回：
+        int64 数组，与 pairs 一一对应。
+    """
+    if len(pairs) == 0:
+        return np.zeros(0, dtype=np.int64)
+    codes = np.asarray(pairs, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    return counts[codes[:, 0]] + counts[codes[:, 1]] + PAIR_OVERHEAD
+
+def plan_batches(costs, workers):
+    """
+    根据代价将用户对划分为批次。
+
+    参数：
+        costs: estimate_pair_costs 返回的代价数组。
+        workers: 工作进程数。
+    返回：
+        批次列表，每个批次是用户对下标（int64 数组）；批次按代价从高到低排列，
+        重量级用户对单独成批，其余按顺序装箱，每批累计代价约为目标批次代价。
+    """
+    if len(costs) == 0:
+        return []
+    order = np.argsort(-costs, kind='stable')
+    sorted_costs = costs[order]
+    target = max(int(sorted_costs.sum() // (max(workers, 1) * BATCHES_PER_WORKER)), 1)
+    # 代价不低于目标的重量级用户对排在最前，每对单独成批
+    heavy_count = int(np.count_nonzero(sorted_costs >= target))
+    # 其余用户对以起始处的累计代价落在第几个“目标代价区间”作为批次编号进行装箱
+    light_costs = sorted_costs[heavy_count:]
+    batch_ids = (np.cumsum(light_costs) - light_costs) // target
+    boundaries = np.concatenate((
+        np.arange(1, heavy_count + 1),
+        heavy_count + np.flatnonzero(np.diff(batch_ids)) + 1
+    ))
+    return [batch for batch in np.split(order, boundaries) if len(batch)]
+
+def _take(pairs, batch):
+    """取出一批用户对：编号数组取切片，列表取对应的元素。"""
+    return pairs[batch] if isinstance(pairs, np.ndarray) else [pairs[i] for i in batch]
+
+def run_pair_batches(executor, batch_fn, pairs, counts, workers, progress=True, collect=None):
+    """
+    按代价调度并执行所有用户对的计算。
+
+    参数：
+        executor: 已创建的进程池（concurrent.futures.Executor）。
+        batch_fn: 工作函数，接收一批用户对（与 pairs 同类型），返回等长的结果列表。
+        pairs: (n, 2) 的用户编号数组（例如 shard.pair_codes 生成的编号），或任务元组列表。
+        counts: 每个用户的消息数数组。
+        workers: 工作进程数。
+        progress: 是否输出完成进度。
+        collect: 可选，回调函数 collect(下标数组, 批结果)；指定时每批结果到达后立即交给它处理，
+            不再汇总为列表，此时 batch_fn 可以返回任意形式的批结果。
+    返回：
+        与 pairs 顺序一致的结果列表；指定 collect 时返回 None。
+    """
+    started = time.perf_counter()
+    costs = estimate_pair_costs(pairs, counts)
+    batches = plan_batches(costs, workers)
+    # 未开启剖析时直接提交工作函数，不做任何包装
+    kernel_dir = profiling.pair_batch_wrapper()
+    if kernel_dir is None:
+        futures = {executor.submit(batch_fn, _take(pairs, batch)): batch for batch in batches}
+    else:
+        futures = {executor.submit(profiling.timed_batch, batch_fn, kernel_dir, _take(pairs, batch)): batch
+                   for batch in batches}
+    timings = []
+
+    results = [None] * len(pairs) if collect is None else None
+    total = len(pairs)
+    done = 0
+    next_report = PROGRESS_STEP
+    for future in as_completed(futures):
+        batch = futures[future]
+        batch_results = future.result()
+        if kernel_dir is not None:
+            pid, busy, cpu, batch_results = batch_results
+            timings.append((pid, busy, cpu, len(batch)))
+        if collect is not None:
+            collect(batch, batch_results)
+        else:
+            for i, res in zip(batch, batch_results):
+                results[i] = res
+        done += len(batch)
+        percent = done * 100 // total
+        if progress and percent >= next_report:
+            print(f"[INFO] 已完成 {done}/{total} 对用户（{percent}%）")
+            next_report = (percent // PROGRESS_STEP + 1) * PROGRESS_STEP
+    if kernel_dir is not None:
+        profiling.record_pair_run(total, time.perf_counter() - started, timings)
+    return results
@@ -0,0 +1,109 @@
+"""
+pair_store.py
+-------------
+用户对计算结果的紧凑列式存储。
+
+全量计算时群内每两位用户都是一对，2000 人的群约有 200 万对。逐对返回字典再构造 DataFrame 时，
+每对用户都要保留一个字典、十几个装箱的数值和四个字符串对象，峰值内存随用户对数成倍增长。本模块：
+  - 用户对以两人在消息索引中的编号表示（int32，code1 < code2）；编号与综合得分一起即为
+    上三角得分矩阵的稀疏（COO）表示，QQ号和昵称只按用户各保存一份；
+  - 工作进程把每批结果打包成列数组返回（pack_results），主进程按用户对下标直接写入预先分配的
+    列数组（store_batch），不再为每对用户保留字典；
+  - 次数类指标保存为 int32；其余指标保持 float64，使全量、Top-K、增量模式和已保存的原始指标
+    重新评分的结果逐位一致；
+  - 转换为 DataFrame 时 user1、user2、name1、name2 为分类类型，每行只保存用户编号；
+  - 指定目录时各列分配为 .npy 内存映射文件（见 spill.py），结果写入后由操作系统换出到磁盘，
+    常驻内存不随用户对数增长。
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# _pair_metrics_kernel 返回的指标，按结果列的顺序排列
+PAIR_FIELDS = ('avg_response_time', 'chat_frequency', 'interaction_continuity', 'reciprocity', 'message_length',
+               'reply_count', 'dialogue_continuity', 'count1', 'count2', 'resp_time_1_to_2', 'resp_time_2_to_1',
+               'avg_len_user1', 'avg_len_user2')
+# 保存为 int32 的次数类指标
+INT_FIELDS = ('reply_count', 'count1', 'count2')
+
+def _field_dtype(field):
+    return np.int32 if field in INT_FIELDS else np.float64
+
+def pack_results(results) -> dict:
+    """
+    将一批逐对结果（_pair_metrics_kernel 的返回值，没有结果时为 None）打包成列数组，
+    在工作进程中调用，使进程间只传递少量数组而不是大量字典。
+
+    返回：
+        字典：valid（布尔数组，该对是否有结果）以及 PAIR_FIELDS 中各指标的数组（没有结果的位置为 0）。
+    """
+    packed = {'valid': np.array([res is not None for res in results], dtype=bool)}
+    for field in PAIR_FIELDS:
+        packed[field] = np.array([res[field] if res is not None else 0 for res in results], dtype=_field_dtype(field))
+    return packed
+
+def allocate_pair_store(num_pairs, directory=None) -> dict:
+    """
+    预先分配 num_pairs 对用户的结果列。
+
+    参数：
+        num_pairs: 用户对数。
+        directory: 可选，指定时每列分配为该目录下的 <列名>.npy 内存映射文件，否则分配在内存中。
+    返回：
+        字典：code1、code2（int32）、valid（布尔，结果到达前为 False）以及 PAIR_FIELDS 中各指标的列。
+    """
+    dtypes = {'code1': np.int32, 'code2': np.int32, 'valid': bool,
+              **{field: _field_dtype(field) for field in PAIR_FIELDS}}
+    if directory is None:
+        return {column: np.zeros(num_pairs, dtype=dtype) for column, dtype in dtypes.items()}
+    # 新建的 .npy 文件内容为零，未写入的位置 valid 为 False
+    return {column: np.lib.format.open_memmap(os.path.join(directory, f"{column}.npy"), mode='w+',
+                                              dtype=dtype, shape=(num_pairs,))
+            for column, dtype in dtypes.items()}
+
+def new_pair_store(pairs) -> dict:
+    """
+    为一组用户对预先分配内存中的结果列，并填入两人的编号。
+
+    参数：
+        pairs: (n, 2) 用户编号数组（或 [(code1, code2), ...] 列表）。
+    """
+    codes = np.asarray(pairs, dtype=np.int32).reshape(-1, 2)
+    store = allocate_pair_store(len(codes))
+    store['code1'][:] = codes[:, 0]
+    store['code2'][:] = codes[:, 1]
+    return store
+
+def store_batch(store, positions, packed):
+    """将 pack_results 打包的一批结果写入 store 中对应的下标（positions 与批内顺序一致）。"""
+    for column, values in packed.items():
+        store[column][positions] = values
+
+def categorical_column(codes, values) -> pd.Categorical:
+    """
+    由编号数组和按编号排列的取值（例如各用户的QQ号或昵称）构造分类列，取值可以重复。
+    """
+    value_codes, categories = pd.factorize(pd.Series(list(values), dtype=object))
+    return pd.Categorical.from_codes(value_codes[np.asarray(codes)], categories=categories)
+
+def store_frame(store, user_ids, names, rows=None) -> pd.DataFrame:
+    """
+    将 store 中的用户对转换为原始指标 DataFrame，
+    列与逐对结果构造的 DataFrame 相同：user1、user2、name1、name2 和 PAIR_FIELDS。
+
+    参数：
+        user_ids, names: 按用户编号排列的QQ号和显示名称。
+        rows: 可选，要转换的行号（按给定顺序）；默认为全部有结果的用户对（按原始顺序）。
+    """
+    if rows is None:
+        rows = store['valid']
+    codes1, codes2 = store['code1'][rows], store['code2'][rows]
+    return pd.DataFrame({
+        'user1': categorical_column(codes1, user_ids),
+        'user2': categorical_column(codes2, user_ids),
+        'name1': categorical_column(codes1, names),
+        'name2': categorical_column(codes2, names),
+        **{field: store[field][rows] for field in PAIR_FIELDS}
+    })
@@ -0,0 +1,197 @@
+"""
+pipeline.py
+-----------
+提取、清洗和建立索引的流水线执行（main.py --pipeline）。
+
+默认流程严格按顺序执行：提取完全部消息才开始清洗，清洗完才建立索引并启动进程池。
+流水线模式把三个阶段放在不同的线程中，以有界队列逐块传递数据：
+  - 提取线程以只读连接分块读取 SQLite（每块 PIPELINE_CHUNK_SIZE 行），并把每块编码为分类类型
+    （与 extract_chat_data 的结果相同）；
+  - 清洗线程对每块调用 clean_chat_data，清洗规则逐行生效，分块清洗与整体清洗的结果一致；
+  - 主线程按全局的首次出现顺序为清洗后的每块消息编号并累积各列，全部到达后只需一次排序
+    即得到与 build_message_index 完全相同的消息索引；
+  - 队列最多缓存 DEFAULT_QUEUE_CHUNKS 块，较慢的阶段会让前面的阶段等待，内存占用有上限；
+  - 计算用户对的进程池在提取之前启动（intimacy_analysis.warm_pair_pool），
+    工作进程的启动和模块导入（spawn 方式下需要重新导入 pandas）与提取同时进行。
+各阶段重叠执行，总耗时接近最慢的阶段而不是各阶段之和；最终结果与默认流程逐位一致。
+sqlite3 在执行查询时会释放 GIL，但自定义函数 clean_len 和构造 DataFrame 仍需要 GIL，
+因此重叠的程度取决于各阶段中不持有 GIL 的比例。
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from clean_chat_data import clean_chat_data
+from data_cache import DEFAULT_CACHE_DIR, cache_key, evict, load_cleaned, store_cleaned
+from extract_chat_data import _accumulate, _assemble, _new_accumulator, connect_readonly, iter_chat_chunks
+from intimacy_analysis import build_message_index, index_arrays
+import profiling
+
+# 流水线模式每块读取的行数（比默认的分块小，使各阶段能尽早开始）
+PIPELINE_CHUNK_SIZE = 20_000
+# 每个队列最多缓存的块数
+DEFAULT_QUEUE_CHUNKS = 4
+# 队列结束标记
+_DONE = object()
+
+def _put(out_queue, item, stop):
+    """放入队列；队列已满时等待，下游已停止时放弃并返回 False。"""
+    while not stop.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _drain(in_queue):
+    """逐块取出队列中的数据直到结束标记；上游出错时在当前线程重新抛出异常。"""
+    while True:
+        item = in_queue.get()
+        if item is _DONE:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+def _extract_stage(db_path, group_id, start, end, chunksize, out_queue, stop, busy):
+    """提取线程：分块读取数据库，每块编码为与 extract_chat_data 相同的紧凑类型后放入队列。"""
+    try:
+        # sqlite3 连接只能在创建它的线程中使用
+        conn = connect_readonly(db_path)
+        try:
+            chunks = iter_chat_chunks(conn, group_id, start, end, chunksize=chunksize)
+            while not stop.is_set():
+                started = time.perf_counter()
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                acc = _new_accumulator()
+                _accumulate(acc, chunk, 'content_length')
+                chunk = _assemble(acc, 'content_length')
+                busy['extract'] += time.perf_counter() - started
+                if not _put(out_queue, chunk, stop):
+                    return
+        finally:
+            conn.close()
+        _put(out_queue, _DONE, stop)
+    except BaseException as e:
+        _put(out_queue, e, stop)
+
+def _clean_stage(in_queue, out_queue, stop, busy):
+    """清洗线程：逐块清洗后放入下一个队列。"""
+    try:
+        for chunk in _drain(in_queue):
+            started = time.perf_counter()
+            chunk = clean_chat_data(chunk)
+            busy['clean'] += time.perf_counter() - started
+            if not _put(out_queue, chunk, stop):
+                return
+        _put(out_queue, _DONE, stop)
+    except BaseException as e:
+        _put(out_queue, e, stop)
+
+def _finish_index(acc) -> dict:
+    """由累积的编号和各列构建消息索引，与对同样数据调用 build_message_index 的结果相同。"""
+    codes = np.concatenate(acc['sender'])
+    times = np.concatenate(acc['timestamp'])
+    lengths = np.concatenate(acc['text']).astype(np.int64)
+    arrays, first_rows = index_arrays(codes, len(acc['sender_table']), times, lengths)
+    nicknames = np.array(list(acc['nickname_table']), dtype=object)
+    return {
+        'user_ids': list(acc['sender_table']),
+        'names': list(nicknames[np.concatenate(acc['nickname'])[first_rows]]),
+        **arrays
+    }
+
+def pipelined_chat_index(db_path, group_id, start=None, end=None, chunksize=PIPELINE_CHUNK_SIZE,
+                         queue_chunks=DEFAULT_QUEUE_CHUNKS):
+    """
+    以流水线方式提取、清洗指定群聊的消息并建立消息索引。
+
+    参数：
+        db_path, group_id, start, end: 同 extract_chat_data。
+        chunksize: 每块读取的行数。
+        queue_chunks: 每个队列最多缓存的块数。
+    返回：
+        (df, index, busy)：清洗后的 DataFrame（与 extract_chat_data + clean_chat_data 的结果相同，
+        索引已重置）、消息索引，以及 {'extract', 'clean', 'index'} 各阶段实际工作的秒数。
+        没有数据时 df 和 index 为 None。
+    """
+    busy = {'extract': 0.0, 'clean': 0.0, 'index': 0.0}
+    extracted, cleaned = queue.Queue(maxsize=queue_chunks), queue.Queue(maxsize=queue_chunks)
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=_extract_stage, args=(db_path, group_id, start, end, chunksize, extracted, stop, busy),
+                         name="pipeline-extract", daemon=True),
+        threading.Thread(target=_clean_stage, args=(extracted, cleaned, stop, busy),
+                         name="pipeline-clean", daemon=True)
+    ]
+    for thread in threads:
+        thread.start()
+    acc = _new_accumulator()
+    try:
+        for chunk in _drain(cleaned):
+            started = time.perf_counter()
+            _accumulate(acc, chunk, 'content_length')
+            busy['index'] += time.perf_counter() - started
+    finally:
+        # 出错或被中断时通知上游线程停止
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    if not sum(len(part) for part in acc['timestamp']):
+        return None, None, busy
+    started = time.perf_counter()
+    df = _assemble(acc, 'content_length')
+    index = _finish_index(acc)
+    busy['index'] += time.perf_counter() - started
+    return df, index, busy
+
+def load_indexed_chat_data(db_path, group_id, start=None, end=None, cache_dir=DEFAULT_CACHE_DIR, use_cache=True):
+    """
+    返回清洗后的聊天数据和消息索引：缓存命中时读取缓存并建立索引，否则以流水线方式提取、清洗并建立索引，
+    然后写入缓存（缓存与默认流程共用，见 data_cache.py）。
+
+    返回：
+        (df, index, from_cache)；没有数据或查询失败时 df 和 index 为 None。
+    """
+    key = cache_key(db_path, group_id, start, end) if use_cache else None
+    if use_cache:
+        with profiling.stage('load_cache') as record:
+            df = load_cleaned(cache_dir, key)
+            record['rows_out'] = None if df is None else len(df)
+        if df is not None:
+            with profiling.stage('build_index', rows_in=len(df)) as record:
+                index = build_message_index(df)
+                record['rows_out'] = len(index['user_ids'])
+            return df, index, True
+
+    print("正在以流水线方式提取、清洗数据并建立索引...")
+    with profiling.stage('pipeline') as record:
+        wall = time.perf_counter()
+        try:
+            df, index, busy = pipelined_chat_index(db_path, group_id, start, end)
+        except sqlite3.Error as e:
+            print(f"[ERROR] 执行 SQL 查询失败: {e}")
+            return None, None, False
+        wall = time.perf_counter() - wall
+        record['rows_out'] = 0 if df is None else len(df)
+        record['busy_seconds'] = {name: round(seconds, 4) for name, seconds in busy.items()}
+    print(f"[INFO] 流水线：提取 {busy['extract']:.2f} 秒、清洗 {busy['clean']:.2f} 秒、建立索引 {busy['index']:.2f} 秒"
+          f"（合计 {sum(busy.values()):.2f} 秒），实际用时 {wall:.2f} 秒。")
+    if df is None:
+        return None, None, False
+    print(f"清洗后共 {len(df)} 条消息记录。")
+    if key is not None:
+        try:
+            store_cleaned(cache_dir, key, df)
+            evict(cache_dir)
+        except OSError as e:
+            print(f"[WARN] 写入缓存失败：{e}")
+    return df, index, False
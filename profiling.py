@@ -0,0 +1,242 @@
+"""
+profiling.py
+------------
+流水线各阶段的性能剖析（main.py --profile）。
+
+运行缓慢时用于判断瓶颈在提取、清洗、用户对计算还是绘图：
+  - 每个阶段记录墙钟时间、本进程 CPU 时间、已结束子进程（工作进程）的 CPU 时间、
+    阶段结束时的峰值 RSS，以及输入、输出行数；阶段可以嵌套（如指标计算中的评分）；
+  - 用户对计算（pair_scheduler.run_pair_batches）记录用户对数、每秒计算的用户对数，
+    以及每个工作进程处理的批次数、忙碌时间和利用率（忙碌时间占该轮计算墙钟时间的比例）；
+  - 可选用 cProfile 剖析工作进程中的用户对计算，各进程的结果合并为一个 .prof 文件，
+    可用 python -m pstats 或 snakeviz 等工具查看；
+  - 结果输出到控制台并保存为 JSON。
+未开启时 _active 为 None，各插桩点只做一次判断，不计时，也不包装计算任务。
+峰值 RSS 和子进程 CPU 时间依赖 resource 模块（Linux、macOS）；Windows 上安装了 psutil 时记录本进程的峰值内存，否则不记录。
+"""
+
+import cProfile
+import glob
+import json
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 当前的剖析记录；未开启 --profile 时为 None
+_active = None
+# 工作进程中累积的用户对计算剖析器（只在开启 cProfile 时创建）
+_kernel_profiler = None
+# 控制台报告中列出的 cProfile 函数数
+KERNEL_TOP_FUNCTIONS = 15
+
+def _peak_rss_mb(who='self'):
+    """本进程（或已结束子进程中最大）的峰值常驻内存（MB），无法获取时返回 None。"""
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+        # Linux 上 ru_maxrss 的单位为 KB，macOS 上为字节
+        return round(usage.ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024), 1)
+    if who != 'self':
+        return None
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / 1024 ** 2, 1)
+    except (ImportError, AttributeError):
+        return None
+
+def _children_cpu():
+    """已结束并回收的子进程的 CPU 时间（秒），无法获取时返回 None。"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def start(kernel_profile=False):
+    """
+    开启剖析。
+
+    参数：
+        kernel_profile: 为 True 时用 cProfile 剖析用户对计算。
+    """
+    global _active
+    _active = {
+        'started': time.perf_counter(),
+        'cpu_started': time.process_time(),
+        'children_cpu_started': _children_cpu(),
+        'depth': 0,
+        'stages': [],
+        'pair_runs': [],
+        'kernel_dir': tempfile.mkdtemp(prefix="intimacy_profile_") if kernel_profile else None
+    }
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+    记录一个阶段。返回的字典中可填写 rows_in、rows_out 等附加信息；未开启剖析时返回的字典不会被使用。
+    """
+    if _active is None:
+        yield {}
+        return
+    record = {'stage': name, 'depth': _active['depth'], 'rows_in': rows_in, 'rows_out': None}
+    # 先占位，使嵌套阶段排在外层阶段之后
+    _active['stages'].append(record)
+    _active['depth'] += 1
+    wall, cpu, children = time.perf_counter(), time.process_time(), _children_cpu()
+    try:
+        yield record
+    finally:
+        _active['depth'] -= 1
+        record['wall_seconds'] = round(time.perf_counter() - wall, 4)
+        record['cpu_seconds'] = round(time.process_time() - cpu, 4)
+        record['worker_cpu_seconds'] = None if children is None else round(_children_cpu() - children, 4)
+        record['peak_rss_mb'] = _peak_rss_mb()
+
+def pair_batch_wrapper():
+    """
+    run_pair_batches 用来包装工作函数的参数：未开启剖析时返回 None（不包装），
+    否则返回传给 timed_batch 的 cProfile 输出目录（不剖析时为空字符串）。
+    """
+    if _active is None:
+        return None
+    return _active['kernel_dir'] or ''
+
+def timed_batch(batch_fn, kernel_dir, batch):
+    """
+    在工作进程中执行一批用户对并计时，返回 (进程号, 墙钟时间, CPU 时间, 结果)。
+    kernel_dir 不为空时用该进程的 cProfile 剖析器累积剖析，并写入 kernel_dir/kernel_<进程号>.prof。
+    """
+    global _kernel_profiler
+    wall, cpu = time.perf_counter(), time.process_time()
+    if kernel_dir:
+        if _kernel_profiler is None:
+            _kernel_profiler = cProfile.Profile()
+        _kernel_profiler.enable()
+        try:
+            result = batch_fn(batch)
+        finally:
+            _kernel_profiler.disable()
+        _kernel_profiler.dump_stats(os.path.join(kernel_dir, f"kernel_{os.getpid()}.prof"))
+    else:
+        result = batch_fn(batch)
+    return os.getpid(), time.perf_counter() - wall, time.process_time() - cpu, result
+
+def record_pair_run(pairs, wall_seconds, batch_timings):
+    """
+    记录一轮用户对计算。
+
+    参数：
+        pairs: 用户对数。
+        wall_seconds: 该轮计算的墙钟时间。
+        batch_timings: [(进程号, 墙钟时间, CPU 时间, 用户对数), ...]，每批一项。
+    """
+    workers = {}
+    for pid, busy, cpu, count in batch_timings:
+        worker = workers.setdefault(pid, {'pid': pid, 'batches': 0, 'pairs': 0, 'busy_seconds': 0.0, 'cpu_seconds': 0.0})
+        worker['batches'] += 1
+        worker['pairs'] += count
+        worker['busy_seconds'] += busy
+        worker['cpu_seconds'] += cpu
+    for worker in workers.values():
+        worker['utilization'] = round(worker['busy_seconds'] / wall_seconds, 3) if wall_seconds > 0 else None
+        worker['busy_seconds'] = round(worker['busy_seconds'], 4)
+        worker['cpu_seconds'] = round(worker['cpu_seconds'], 4)
+    _active['pair_runs'].append({
+        'pairs': pairs,
+        'wall_seconds': round(wall_seconds, 4),
+        'pairs_per_second': round(pairs / wall_seconds, 1) if wall_seconds > 0 else None,
+        'workers': sorted(workers.values(), key=lambda worker: worker['pid'])
+    })
+
+def _merge_kernel_profiles(kernel_dir, output_path):
+    """合并各进程的 cProfile 结果，返回合并后的 pstats.Stats；没有结果时返回 None。"""
+    files = sorted(glob.glob(os.path.join(kernel_dir, "kernel_*.prof")))
+    if not files:
+        return None
+    stats = pstats.Stats(files[0], stream=sys.stdout)
+    for path in files[1:]:
+        stats.add(path)
+    stats.dump_stats(output_path)
+    return stats
+
+def _fmt(value, spec):
+    """格式化报告中的数值，无法获取的值显示为 -（保留 spec 中的宽度）。"""
+    if value is None:
+        width = ''.join(ch for ch in spec.split(',')[0].split('.')[0] if ch.isdigit())
+        return format('-', f'>{width}')
+    return format(value, spec)
+
+def finish(output_path, argv=None) -> dict:
+    """
+    结束剖析：打印报告并把结果保存为 JSON（开启 cProfile 时另存 <JSON 文件名>.kernel.prof），返回报告字典。
+    """
+    global _active
+    active, _active = _active, None
+    children = _children_cpu()
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'argv': list(argv or sys.argv),
+        'wall_seconds': round(time.perf_counter() - active['started'], 4),
+        'cpu_seconds': round(time.process_time() - active['cpu_started'], 4),
+        'worker_cpu_seconds': None if children is None else round(children - active['children_cpu_started'], 4),
+        'peak_rss_mb': _peak_rss_mb(),
+        'worker_peak_rss_mb': _peak_rss_mb('children'),
+        'stages': active['stages'],
+        'pair_runs': active['pair_runs'],
+        'kernel_profile': None
+    }
+    for record in report['stages']:
+        rows = record['rows_in'] if record['rows_in'] is not None else record['rows_out']
+        record['rows_per_second'] = round(rows / record['wall_seconds'], 1) \
+            if rows and record['wall_seconds'] > 0 else None
+    stats = None
+    if active['kernel_dir']:
+        kernel_path = os.path.splitext(output_path)[0] + ".kernel.prof"
+        stats = _merge_kernel_profiles(active['kernel_dir'], kernel_path)
+        shutil.rmtree(active['kernel_dir'], ignore_errors=True)
+        if stats is not None:
+            report['kernel_profile'] = kernel_path
+
+    print("========== 性能剖析 ==========")
+    print(f"{'阶段':<24}{'墙钟(秒)':>10}{'CPU(秒)':>10}{'子进程CPU':>10}{'峰值RSS(MB)':>12}{'输入行数':>10}{'输出行数':>10}{'每秒行数':>12}")
+    for record in report['stages']:
+        name = "  " * record['depth'] + record['stage']
+        print(f"{name:<24}{record['wall_seconds']:>10.3f}{record['cpu_seconds']:>10.3f}"
+              f"{_fmt(record['worker_cpu_seconds'], '>10.3f')}{_fmt(record['peak_rss_mb'], '>12.1f')}"
+              f"{_fmt(record['rows_in'], '>10')}{_fmt(record['rows_out'], '>10')}"
+              f"{_fmt(record['rows_per_second'], '>12,.0f')}")
+    if report['pair_runs']:
+        # 控制台按进程汇总所有轮次（Top-K 模式会分多轮计算），每轮的明细见 JSON
+        runs = report['pair_runs']
+        pairs = sum(run['pairs'] for run in runs)
+        wall = sum(run['wall_seconds'] for run in runs)
+        print(f"用户对计算：{len(runs)} 轮，共 {pairs} 对，{wall:.3f} 秒，"
+              f"{_fmt(pairs / wall if wall > 0 else None, ',.0f')} 对/秒")
+        workers = {}
+        for run in runs:
+            for worker in run['workers']:
+                total = workers.setdefault(worker['pid'], {'batches': 0, 'pairs': 0, 'busy_seconds': 0.0, 'cpu_seconds': 0.0})
+                for key in total:
+                    total[key] += worker[key]
+        for pid, worker in sorted(workers.items()):
+            utilization = worker['busy_seconds'] / wall if wall > 0 else None
+            print(f"  进程 {pid}：{worker['batches']} 批，{worker['pairs']} 对，忙碌 {worker['busy_seconds']:.3f} 秒"
+                  f"（利用率 {_fmt(utilization, '.0%')}），CPU {worker['cpu_seconds']:.3f} 秒")
+    print(f"总计：墙钟 {report['wall_seconds']:.3f} 秒，本进程 CPU {report['cpu_seconds']:.3f} 秒，"
+          f"工作进程 CPU {_fmt(report['worker_cpu_seconds'], '.3f')} 秒，"
+          f"峰值 RSS {_fmt(report['peak_rss_mb'], '.1f')} MB（工作进程 {_fmt(report['worker_peak_rss_mb'], '.1f')} MB）")
+    if stats is not None:
+        print(f"用户对计算的 cProfile 结果（按累计时间排序的前 {KERNEL_TOP_FUNCTIONS} 项）：")
+        stats.sort_stats('cumulative').print_stats(KERNEL_TOP_FUNCTIONS)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"剖析结果已保存到 {output_path}" + (f"，cProfile 结果已保存到 {report['kernel_profile']}" if stats else ""))
+    return report
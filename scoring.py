@@ -0,0 +1,125 @@
+"""
+scoring.py
+----------
+指标归一化与综合亲密度得分计算。
+
+  - 各项指标在所有用户对上做 min-max 归一化，平均响应时间越小越好，归一化时取反；
+    若某项指标在所有用户对上取值相同，则非零时记为 1，为零时记为 0。
+  - 归一化后的指标按 WEIGHTS 加权求和得到综合得分（归一化矩阵与权重向量的一次矩阵-向量乘法）。
+    权重可通过命令行或 JSON 文件覆盖（见 parse_weights、load_weights_file）。
+  - 整体活跃度惩罚因子：如果群总消息数少于 1000，则综合得分乘以 (总消息数/1000)。
+"""
+
+import json
+
+import numpy as np
+
+# 定义各指标权重，总和为1
+WEIGHTS = {
+    "avg_response_time": 0.20,
+    "chat_frequency": 0.20,
+    "interaction_continuity": 0.15,
+    "reciprocity": 0.10,
+    "message_length": 0.10,
+    "reply_count": 0.20,
+    "dialogue_continuity": 0.05
+}
+
+# 需要归一化的指标及是否取反
+METRICS_TO_NORMALIZE = [
+    ('avg_response_time', True),
+    ('chat_frequency', False),
+    ('interaction_continuity', False),
+    ('reciprocity', False),
+    ('message_length', False),
+    ('reply_count', False),
+    ('dialogue_continuity', False)
+]
+
+def metric_extrema(metrics) -> dict:
+    """
+    统计各项指标在所有用户对上的最小值和最大值。
+
+    参数：
+        metrics: 指标名到取值（数组或 Series）的映射，例如指标 DataFrame。
+    返回：
+        字典 {指标名: (最小值, 最大值)}。
+    """
+    return {col: (float(np.min(metrics[col])), float(np.max(metrics[col]))) for col, _ in METRICS_TO_NORMALIZE}
+
+def normalize_metric(values, minimum, maximum, reverse=False):
+    """按给定的最小值和最大值对一项指标做 min-max 归一化，返回 float64 数组。"""
+    values = np.asarray(values, dtype=np.float64)
+    if maximum != minimum:
+        scaled = (values - minimum) / (maximum - minimum)
+        return 1 - scaled if reverse else scaled
+    return np.full(len(values), 1.0 if minimum != 0 else 0.0)
+
+def weighted_score(norms, weights=WEIGHTS):
+    """
+    按权重对归一化后的指标求和：将各项指标按 WEIGHTS 的顺序排成矩阵，与权重向量做一次矩阵-向量乘法。
+
+    参数：
+        norms: 指标名到归一化取值数组的映射。
+        weights: 指标权重，默认为 WEIGHTS。
+    """
+    matrix = np.column_stack([np.asarray(norms[col], dtype=np.float64) for col in WEIGHTS])
+    return matrix @ np.array([weights[col] for col in WEIGHTS], dtype=np.float64)
+
+def parse_weights(text: str) -> dict:
+    """
+    解析命令行中的权重参数，格式为 "指标名=权重,指标名=权重"，例如 "reply_count=0.3,reciprocity=0.05"。
+    """
+    weights = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError(f"权重格式错误（应为 指标名=权重）：{item}")
+        weights[name.strip()] = float(value)
+    return weights
+
+def load_weights_file(path: str) -> dict:
+    """从 JSON 文件读取权重，格式为 {"指标名": 权重, ...}。"""
+    with open(path, "r", encoding="utf-8") as f:
+        return {name: float(value) for name, value in json.load(f).items()}
+
+def resolve_weights(overrides=None) -> dict:
+    """
+    以 WEIGHTS 为默认值合并权重覆盖项，未指定的指标保持默认权重。
+    指标名不存在时抛出 ValueError；权重之和不为 1 时给出提示。
+    """
+    weights = dict(WEIGHTS)
+    for name, value in (overrides or {}).items():
+        if name not in WEIGHTS:
+            raise ValueError(f"未知的指标名：{name}（可选：{', '.join(WEIGHTS)}）")
+        weights[name] = value
+    total = sum(weights.values())
+    if not np.isclose(total, 1.0):
+        print(f"[WARN] 权重之和为 {total:.4f}，不等于 1，综合得分的取值范围会相应变化。")
+    return weights
+
+def activity_factor(total_msgs):
+    """整体活跃度惩罚因子：群总消息数少于 1000 时为 (总消息数/1000)，否则为 1。"""
+    return min(1.0, total_msgs / 1000.0)
+
+def score_metrics(metrics_df, total_msgs, extrema=None, weights=WEIGHTS):
+    """
+    为指标 DataFrame 添加 norm_* 归一化列和 closeness_score 综合得分列（原地修改并返回）。
+
+    参数：
+        metrics_df: 每行一对用户的原始指标。
+        total_msgs: 群聊总消息数，用于计算活跃度惩罚因子。
+        extrema: 可选，{指标名: (最小值, 最大值)}；默认由 metrics_df 自身统计。
+        weights: 指标权重，默认为 WEIGHTS。
+    """
+    if extrema is None:
+        extrema = metric_extrema(metrics_df)
+    norms = {}
+    for col, reverse in METRICS_TO_NORMALIZE:
+        minimum, maximum = extrema[col]
+        norms[col] = normalize_metric(metrics_df[col], minimum, maximum, reverse)
+        metrics_df['norm_' + col] = norms[col]
+    metrics_df['closeness_score'] = weighted_score(norms, weights) * activity_factor(total_msgs)
+    return metrics_df
@@ -0,0 +1,415 @@
+"""
+service.py
+----------
+常驻的查询服务（main.py --serve）。
+
+每次运行命令行都要重新读取数据、建立索引、启动进程池并计算用户对，反复查询同一个群时这些开销远大于查询本身。
+本模块把它们保留在常驻进程中：
+  - 群按 (群号, 起止日期) 载入一次：读取清洗后的数据（优先读取缓存，见 data_cache.py）并建立消息索引；
+    已载入同一群的全部时间段时，子时间段直接从内存中的数据按时间戳截取，不再读取数据库；
+  - 计算用户对的进程池在服务启动时创建并一直保留（intimacy_analysis.warm_pair_pool），
+    载入新的群时只需把索引发布到共享内存；
+  - 全部用户对的原始指标在第一次查询排名或用户对时计算一次，保存在列式存储中（见 pair_store.py），
+    之后按权重评分（spill.score_spilled）并缓存得分和名次，查询前 N 名和单个用户对只需几毫秒；
+  - 查询某位用户时用单次扫描引擎直接在内存中的索引上计算（见 focus_engine.py），结果与 --focus-user 一致；
+  - 已载入的群按最近使用的顺序最多保留 max_groups 个（LRU），数据库文件变化后自动重新载入，
+    并释放该群按旧数据载入的各时间段。
+提供 Python 接口（IntimacyService）和只监听本机地址的 HTTP 接口（serve_http），结果与命令行的输出一致。
+"""
+
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from data_cache import DEFAULT_CACHE_DIR, _file_signature, cache_key, load_chat_data
+from extract_chat_data import _to_epoch_seconds
+from intimacy_analysis import _display_name, build_message_index, calculate_intimacy_metrics, \
+    calculate_pair_store, warm_pair_pool
+from scoring import WEIGHTS, parse_weights, resolve_weights
+from spill import ranked_frame, ranked_order, score_spilled, update_extrema
+
+# 默认最多保留的已载入群数
+DEFAULT_MAX_GROUPS = 4
+# 每个群缓存评分结果的权重组数
+SCORE_CACHE_SIZE = 4
+# HTTP 接口默认监听的地址和端口（只接受本机连接）
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+class IntimacyService:
+    """
+    常驻的查询服务，方法可以在多个线程中调用（同一时刻只执行一个查询）。
+
+    用法：
+        with IntimacyService("nt_msg.clean.db") as service:
+            service.top(951628619, n=10)
+            service.focus(951628619, "123456789")
+            service.pair(951628619, "123456789", "987654321")
+    """
+
+    def __init__(self, db_path, user_name_map=None, weights=WEIGHTS, max_groups=DEFAULT_MAX_GROUPS,
+                 max_workers=None, cache_dir=DEFAULT_CACHE_DIR, use_cache=True):
+        """
+        参数：
+            db_path: 数据库文件路径。
+            user_name_map: 可选，用户ID到显示名称的映射字典。
+            weights: 查询未指定权重时使用的指标权重。
+            max_groups: 最多保留的已载入群数。
+            max_workers: 计算用户对的进程数，默认为 CPU 核数。
+            cache_dir, use_cache: 同 data_cache.load_chat_data。
+        """
+        self.db_path = db_path
+        self.user_name_map = user_name_map
+        self.weights = weights
+        self.max_groups = max_groups
+        self.cache_dir = cache_dir
+        self.use_cache = use_cache
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool_context = warm_pair_pool(max_workers)
+        self._warm_pool = self._pool_context.__enter__()
+
+    def close(self):
+        """释放已载入的群并关闭进程池。"""
+        with self._lock:
+            self._groups.clear()
+            if self._pool_context is not None:
+                self._pool_context.__exit__(None, None, None)
+                self._pool_context = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def load(self, group_id, start=None, end=None, pairs=False) -> dict:
+        """
+        载入一个群（已载入时只更新最近使用顺序），返回该群的概况（见 groups）。
+
+        参数：
+            group_id: 群号。
+            start, end: 可选，起止日期，同 extract_chat_data。
+            pairs: 为 True 时同时计算全部用户对，之后的第一次排名查询不必等待。
+        异常：
+            LookupError：该群在指定时间范围内没有消息。
+        """
+        with self._lock:
+            entry = self._entry(group_id, start, end)
+            if pairs:
+                self._compute_pairs(entry)
+            return _summary(entry)
+
+    def groups(self) -> list:
+        """已载入的群的概况（从最久未使用到最近使用）：group、start、end、users、messages、pairs_computed。"""
+        with self._lock:
+            return [_summary(entry) for entry in self._groups.values()]
+
+    def top(self, group_id, n=10, start=None, end=None, weights=None):
+        """
+        综合得分最高的前 n 对用户，与全量计算的结果 CSV 的前 n 行相同。
+
+        返回：
+            DataFrame，格式同 calculate_intimacy_metrics。
+        异常：
+            ValueError：n 为负数。
+        """
+        _check_count(n)
+        with self._lock:
+            result = self._scored(self._entry(group_id, start, end), weights or self.weights)
+            return ranked_frame(result, result['order'][:n])
+
+    def focus(self, group_id, user, n=None, start=None, end=None, weights=None):
+        """
+        某位用户与其他人的互动指标，与 --focus-user 的结果相同（归一化只在该用户的用户对之间进行）。
+
+        参数：
+            n: 可选，只返回综合得分最高的前 n 行。
+        异常：
+            LookupError：该用户在指定时间范围内没有发言。
+            ValueError：n 为负数。
+        """
+        if n is not None:
+            _check_count(n)
+        with self._lock:
+            entry = self._entry(group_id, start, end)
+            _user_code(entry, user)
+            metrics_df = calculate_intimacy_metrics(entry['df'], self.user_name_map, focus_user=user,
+                                                    weights=weights or self.weights, index=entry['index'])
+            return metrics_df.head(n) if n else metrics_df
+
+    def pair(self, group_id, user1, user2, start=None, end=None, weights=None):
+        """
+        两位用户这一对的指标、综合得分和名次（rank，从 1 开始，与全量计算的结果 CSV 中的行号一致）。
+
+        返回：
+            字典，列同 calculate_intimacy_metrics 的结果（user1 为两人中在群里先发言的一位）；
+            两人之间没有可计算的互动时返回 None。
+        异常：
+            LookupError：某位用户在指定时间范围内没有发言。
+        """
+        with self._lock:
+            entry = self._entry(group_id, start, end)
+            code1, code2 = sorted((_user_code(entry, user1), _user_code(entry, user2)))
+            if code1 == code2:
+                raise ValueError("两位用户不能相同")
+            result = self._scored(entry, weights or self.weights)
+            # 用户对在 combinations(用户, 2) 中的下标
+            num_users = len(entry['user_ids'])
+            position = code1 * (2 * num_users - code1 - 1) // 2 + code2 - code1 - 1
+            rank = result['ranks'][position]
+            if rank < 0:
+                return None
+            row = ranked_frame(result, [position]).to_dict('records')[0]
+            row['rank'] = int(rank) + 1
+            return row
+
+    def _entry(self, group_id, start, end) -> dict:
+        """
+        返回已载入的群，未载入时载入，并按 LRU 淘汰超出 max_groups 的群。
+        数据库文件变化后缓存键随之变化，同一群按旧数据载入的各时间段不会再被使用，载入时一并释放。
+        """
+        key = cache_key(self.db_path, group_id, start, end)
+        entry = self._groups.get(key)
+        if entry is not None:
+            self._groups.move_to_end(key)
+            return entry
+        signature = [_file_signature(self.db_path), _file_signature(self.db_path + '-wal')]
+        entry = self._load(group_id, start, end)
+        entry['signature'] = signature
+        stale = [old_key for old_key, old in self._groups.items()
+                 if old['group'] == entry['group'] and old['signature'] != signature]
+        for old_key in stale:
+            evicted = self._groups.pop(old_key)
+            print(f"[INFO] 数据库已变化，释放群 {evicted['group']} 按旧数据载入的结果（{_range_text(evicted)}）。")
+        self._groups[key] = entry
+        while len(self._groups) > self.max_groups:
+            _, evicted = self._groups.popitem(last=False)
+            print(f"[INFO] 释放最久未使用的群 {evicted['group']}（{_range_text(evicted)}）。")
+        return entry
+
+    def _load(self, group_id, start, end) -> dict:
+        """读取并清洗一个群的消息，建立消息索引。"""
+        started = time.perf_counter()
+        df = None
+        if start is not None or end is not None:
+            base = self._groups.get(cache_key(self.db_path, group_id))
+            if base is not None:
+                df = _slice_messages(base['df'], start, end)
+        if df is None:
+            df, _ = load_chat_data(self.db_path, group_id, start=start, end=end, cache_dir=self.cache_dir,
+                                   use_cache=self.use_cache)
+        if df.empty:
+            raise LookupError(f"群 {group_id} 在指定时间范围内没有消息")
+        index = build_message_index(df)
+        entry = {
+            'group': int(group_id), 'start': start, 'end': end, 'df': df, 'index': index,
+            'user_ids': index['user_ids'],
+            'codes': {uid: code for code, uid in enumerate(index['user_ids'])},
+            'names': [_display_name(uid, name, self.user_name_map)
+                      for uid, name in zip(index['user_ids'], index['names'])],
+            'store': None, 'extrema': None, 'scores': OrderedDict()
+        }
+        print(f"[INFO] 已载入群 {group_id}（{_range_text(entry)}）：{len(index['user_ids'])} 位用户、"
+              f"{len(df)} 条消息，用时 {time.perf_counter() - started:.2f} 秒。")
+        return entry
+
+    def _compute_pairs(self, entry):
+        """用常驻的进程池计算全部用户对的原始指标（每个群只计算一次）。"""
+        if entry['store'] is not None:
+            return
+        started = time.perf_counter()
+        store = calculate_pair_store(entry['index'], warm_pool=self._warm_pool)
+        extrema = {}
+        update_extrema(extrema, store, 0, len(store['valid']))
+        entry['store'], entry['extrema'] = store, extrema
+        print(f"[INFO] 群 {entry['group']}：已计算 {len(store['valid'])} 对用户，"
+              f"用时 {time.perf_counter() - started:.2f} 秒。")
+
+    def _scored(self, entry, weights) -> dict:
+        """
+        按权重评分并排序，结果按权重缓存。
+
+        返回：
+            字典，供 spill.ranked_frame 使用：store、order（按综合得分排列的行号）、
+            ranks（每对用户的名次，从 0 开始，没有结果时为 -1）、user_ids、names、total_msgs、extrema、weights。
+        """
+        self._compute_pairs(entry)
+        key = tuple(sorted(weights.items()))
+        scored = entry['scores'].get(key)
+        if scored is None:
+            num_pairs = len(entry['store']['valid'])
+            if entry['extrema']:
+                order = ranked_order(score_spilled(entry['store'], len(entry['df']), entry['extrema'], weights))
+            else:
+                order = np.empty(0, dtype=np.int64)
+            ranks = np.full(num_pairs, -1, dtype=np.int64)
+            ranks[order] = np.arange(len(order))
+            scored = {'order': order, 'ranks': ranks}
+            entry['scores'][key] = scored
+            while len(entry['scores']) > SCORE_CACHE_SIZE:
+                entry['scores'].popitem(last=False)
+        else:
+            entry['scores'].move_to_end(key)
+        return {**scored, 'store': entry['store'], 'user_ids': entry['user_ids'], 'names': entry['names'],
+                'total_msgs': len(entry['df']), 'extrema': entry['extrema'], 'weights': weights}
+
+def _slice_messages(df, start, end):
+    """从已载入的全部消息中按时间戳截取 [start, end]，结果与直接按该时间范围提取、清洗相同。"""
+    times = df['timestamp'].to_numpy()
+    mask = np.ones(len(times), dtype=bool)
+    start_ts, end_ts = _to_epoch_seconds(start), _to_epoch_seconds(end)
+    if start_ts is not None:
+        mask &= times >= start_ts
+    if end_ts is not None:
+        mask &= times <= end_ts
+    df = df[mask].reset_index(drop=True)
+    for col in df.columns:
+        if hasattr(df[col], 'cat'):
+            df[col] = df[col].cat.remove_unused_categories()
+    return df
+
+def _check_count(n):
+    """查询的行数不能为负数（否则 head、切片会从末尾去掉行，而不是返回前 n 行）。"""
+    if n < 0:
+        raise ValueError(f"参数 n 不能为负数：{n}")
+
+def _user_code(entry, user) -> int:
+    """用户在消息索引中的编号，该用户没有发言时抛出 LookupError。"""
+    code = entry['codes'].get(str(user))
+    if code is None:
+        raise LookupError(f"群 {entry['group']} 在指定时间范围内没有用户 {user} 的消息")
+    return code
+
+def _range_text(entry) -> str:
+    """时间范围的显示文本。"""
+    def date_text(value):
+        return "不限" if value is None else str(value)[:10]
+    return f"{date_text(entry['start'])} 至 {date_text(entry['end'])}"
+
+def _summary(entry) -> dict:
+    return {
+        'group': entry['group'],
+        'start': None if entry['start'] is None else str(entry['start'])[:10],
+        'end': None if entry['end'] is None else str(entry['end'])[:10],
+        'users': len(entry['user_ids']),
+        'messages': len(entry['df']),
+        'pairs_computed': entry['store'] is not None
+    }
+
+def _json_value(value):
+    """将 NaN 转换为 null，其余取值由 to_dict 转换为 Python 原生类型后直接输出。"""
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+def _records(metrics_df) -> list:
+    return [{col: _json_value(value) for col, value in row.items()} for row in metrics_df.to_dict('records')]
+
+def _parse_date(text):
+    """解析查询参数中的日期，格式同命令行的 --start、--end（YYYY/MM/DD）。"""
+    import pandas as pd
+    if not text:
+        return None
+    try:
+        return pd.to_datetime(text, format="%Y/%m/%d")
+    except ValueError:
+        raise ValueError(f"时间格式错误（应为 YYYY/MM/DD）：{text}") from None
+
+def _int_param(params, name, default=None):
+    text = params.get(name)
+    if text is None:
+        if default is None:
+            raise ValueError(f"缺少参数 {name}")
+        return default
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError(f"参数 {name} 应为整数：{text}") from None
+
+def _answer(service, path, params):
+    """执行一次 HTTP 查询，返回可序列化为 JSON 的结果。"""
+    if path == '/groups':
+        return {'groups': service.groups()}
+    if path not in ('/top', '/focus', '/pair', '/load'):
+        raise LookupError(f"未知的接口：{path}（可选：/top、/focus、/pair、/load、/groups）")
+    group_id = _int_param(params, 'group')
+    start, end = _parse_date(params.get('start')), _parse_date(params.get('end'))
+    weights = None
+    if params.get('weights'):
+        weights = resolve_weights({**service.weights, **parse_weights(params['weights'])})
+    if path == '/top':
+        metrics_df = service.top(group_id, _int_param(params, 'n', 10), start, end, weights)
+        return {'group': group_id, 'rows': _records(metrics_df)}
+    if path == '/focus':
+        user = params.get('user')
+        if not user:
+            raise ValueError("缺少参数 user")
+        metrics_df = service.focus(group_id, user, _int_param(params, 'n', 0), start, end, weights)
+        return {'group': group_id, 'user': user, 'rows': _records(metrics_df)}
+    if path == '/pair':
+        if not params.get('user1') or not params.get('user2'):
+            raise ValueError("缺少参数 user1 或 user2")
+        row = service.pair(group_id, params['user1'], params['user2'], start, end, weights)
+        return {'group': group_id, 'pair': None if row is None else {col: _json_value(value)
+                                                                      for col, value in row.items()}}
+    return {'group': service.load(group_id, start, end, pairs=True)}
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    """HTTP 接口的请求处理器，service 由 serve_http 设置。"""
+
+    service = None
+
+    def do_GET(self):
+        started = time.perf_counter()
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            status, payload = 200, _answer(self.service, url.path.rstrip('/') or '/', params)
+        except LookupError as e:
+            status, payload = 404, {'error': str(e)}
+        except ValueError as e:
+            status, payload = 400, {'error': str(e)}
+        except Exception as e:
+            print(f"[ERROR] 处理请求 {self.path} 失败：{e}")
+            status, payload = 500, {'error': str(e)}
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        payload['elapsed_ms'] = round(elapsed_ms, 3)
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        print(f"[INFO] {url.path} {status}，用时 {elapsed_ms:.1f} 毫秒")
+
+    def log_message(self, format, *args):
+        # 每个请求已在 do_GET 中输出一行，不再重复输出访问日志
+        pass
+
+def serve_http(service, port=DEFAULT_PORT, host=DEFAULT_HOST):
+    """
+    在本机地址上提供 HTTP 查询接口，直到按 Ctrl+C。请求逐个处理，载入新的群时其他请求会等待。
+
+    接口（GET，参数放在查询字符串中，返回 JSON，出错时返回 {"error": ...}）：
+        /top?group=群号&n=10                       综合得分最高的前 n 对用户
+        /focus?group=群号&user=QQ号&n=10           某位用户与其他人的互动（同 --focus-user，n 可省略）
+        /pair?group=群号&user1=QQ号&user2=QQ号     两位用户这一对的指标和名次
+        /load?group=群号                           预先载入一个群并计算全部用户对
+        /groups                                    已载入的群
+    /top、/focus、/pair、/load 都可以带 start、end（YYYY/MM/DD）参数，前三者还可以带 weights 参数
+    （格式同 --weights，在服务的权重基础上覆盖）。
+    """
+    handler = type('QueryHandler', (_QueryHandler,), {'service': service})
+    server = HTTPServer((host, port), handler)
+    print(f"[INFO] 查询服务已启动：http://{host}:{server.server_port}/（按 Ctrl+C 停止）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("[INFO] 查询服务已停止。")
+    finally:
+        server.server_close()
@@ -0,0 +1,230 @@
+"""
+shard.py
+--------
+把一个群的用户对计算拆分到多台机器（main.py --shard-plan、--shard、--merge-shards）。
+
+最大的群即使在多核机器上全量计算也很慢。本模块把 combinations(用户, 2) 顺序下的全部用户对
+按估计代价（与 pair_scheduler.estimate_pair_costs 相同：两人消息数之和加固定开销）切分为 N 段
+连续的区间（plan_shards），各段代价大致相等：
+  - 每个分片由一个独立的进程（可以在不同机器上）读取同一数据库，建立相同的消息索引，
+    按同样的数据重新计算分片方案，只计算自己区间内的用户对，结果保存为分片文件（save_shard）；
+  - 合并时（load_shards）检查各分片来自同一份数据（消息索引的摘要：用户列表、每条消息的时间戳、长度和先后）、
+    时间范围（--start、--end）相同，且区间恰好覆盖全部用户对，
+    按用户对下标拼回列式存储（见 pair_store.py），再统一做全局归一化和活跃度惩罚，
+    输出的 CSV、原始指标文件和图表与单机全量计算逐位一致。
+分片文件为 NumPy 归档（.npz），元数据以 JSON 字符串保存，不需要 pickle。
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+from extract_chat_data import _to_epoch_seconds
+from pair_scheduler import PAIR_OVERHEAD
+from pair_store import PAIR_FIELDS, allocate_pair_store
+
+# 分片文件格式版本
+SHARD_VERSION = 2
+
+def parse_shard(text):
+    """
+    解析 --shard 参数，格式为 i/N（第 i 个分片，共 N 个，i 从 1 开始）。
+
+    返回：
+        (i, N)
+    """
+    try:
+        shard, num_shards = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f"分片格式应为 i/N，例如 1/4：{text}") from None
+    if num_shards <= 0 or not 1 <= shard <= num_shards:
+        raise ValueError(f"分片编号应在 1 到 N 之间：{text}")
+    return shard, num_shards
+
+def default_shard_path(group_id, shard, num_shards) -> str:
+    """默认的分片文件名，例如 intimacy_98765432.shard1-of-4.npz。"""
+    return f"intimacy_{group_id}.shard{shard}-of-{num_shards}.npz"
+
+def _row_starts(num_users):
+    """combinations(range(num_users), 2) 中以 code1 = 0..num_users-1 开头的第一对用户的下标。"""
+    rows = np.arange(num_users, dtype=np.int64)
+    return rows * (2 * num_users - rows - 1) // 2
+
+def pair_codes(num_users, start, end):
+    """
+    返回 combinations(range(num_users), 2) 中下标 [start, end) 的用户对。
+
+    返回：
+        (code1, code2)：两个 int32 数组。
+    """
+    positions = np.arange(start, end, dtype=np.int64)
+    row_starts = _row_starts(num_users)
+    code1 = np.searchsorted(row_starts, positions, side='right') - 1
+    code2 = positions - row_starts[code1] + code1 + 1
+    return code1.astype(np.int32), code2.astype(np.int32)
+
+def plan_shards(counts, num_shards) -> list:
+    """
+    按估计代价把全部用户对切分为 num_shards 段连续区间，各段代价大致相等。
+    只按用户逐行累计代价，不为每对用户生成数组，内存占用与用户数成正比。
+
+    参数：
+        counts: 每个用户的消息数数组（按用户编号索引）。
+        num_shards: 分片数。
+    返回：
+        列表，每个元素为 {'shard', 'start', 'end', 'pairs', 'cost'}，shard 从 1 开始。
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    num_users = len(counts)
+    num_pairs = num_users * (num_users - 1) // 2
+    row_starts = _row_starts(num_users)
+    # prefix[k] 为前 k 个用户的消息数之和
+    prefix = np.concatenate(([0], np.cumsum(counts)))
+    # 第 r 行为 (r, r+1), ..., (r, n-1)，代价为 (n-1-r)*(counts[r]+开销) 加上其后各用户的消息数之和
+    row_costs = (num_users - 1 - np.arange(num_users)) * (counts + PAIR_OVERHEAD) + prefix[-1] - prefix[1:]
+    row_before = np.cumsum(row_costs) - row_costs
+
+    def cost_before(position):
+        """下标 position 之前全部用户对的代价之和。"""
+        if position >= num_pairs:
+            return int(row_costs.sum())
+        row = int(np.searchsorted(row_starts, position, side='right')) - 1
+        within = position - int(row_starts[row])
+        return int(row_before[row] + within * (counts[row] + PAIR_OVERHEAD)
+                   + prefix[row + 1 + within] - prefix[row + 1])
+
+    total = cost_before(num_pairs)
+    boundaries = [0]
+    for k in range(1, num_shards):
+        # 分界点：累计代价（不含自身）小于第 k 个等分点的用户对数
+        target = total * k / num_shards
+        row = int(np.searchsorted(row_before, target, side='left')) - 1
+        if row < 0:
+            boundaries.append(0)
+            continue
+        pair_costs = counts[row] + PAIR_OVERHEAD + counts[row + 1:]
+        before = row_before[row] + np.cumsum(pair_costs) - pair_costs
+        boundaries.append(int(row_starts[row] + np.searchsorted(before, target, side='left')))
+    boundaries.append(num_pairs)
+
+    return [{'shard': shard, 'start': start, 'end': end, 'pairs': end - start,
+             'cost': cost_before(end) - cost_before(start)}
+            for shard, (start, end) in enumerate(zip(boundaries[:-1], boundaries[1:]), start=1)]
+
+def data_digest(index, total_msgs) -> str:
+    """
+    由消息索引（用户列表、各用户消息数，以及每条消息的时间戳、长度和行号）和总消息数计算摘要，
+    用于确认各分片读取的是同一份数据：任何影响指标的差异（时间戳平移、消息长度、同一秒内的先后）都会改变摘要。
+    """
+    digest = hashlib.sha1()
+    digest.update('\n'.join(index['user_ids']).encode('utf-8'))
+    for field in ('counts', 'times', 'lengths', 'rows'):
+        digest.update(np.ascontiguousarray(index[field], dtype=np.int64).tobytes())
+    digest.update(str(int(total_msgs)).encode('ascii'))
+    return digest.hexdigest()
+
+def _range_bounds(start, end) -> list:
+    """时间范围（--start、--end）转换为 [起, 止] Unix 秒，未指定的一端为 None。"""
+    return [_to_epoch_seconds(start), _to_epoch_seconds(end)]
+
+def _range_text(bounds) -> str:
+    """时间范围的显示文本。"""
+    def date_text(value):
+        return "不限" if value is None else str(datetime.fromtimestamp(value, timezone.utc).date())
+    return f"{date_text(bounds[0])} 至 {date_text(bounds[1])}"
+
+def save_shard(path, result, group_id=None, start=None, end=None):
+    """
+    保存分片的计算结果。
+
+    参数：
+        path: 输出文件路径。
+        result: intimacy_analysis.calculate_shard_metrics 的返回值。
+        group_id: 可选，群号，合并时用于检查。
+        start, end: 提取数据时的起止日期（同 extract_chat_data），合并时用于检查。
+    """
+    meta = {
+        'version': SHARD_VERSION,
+        'group': group_id,
+        'range': _range_bounds(start, end),
+        'shard': result['shard'],
+        'num_shards': result['num_shards'],
+        'start': result['start'],
+        'end': result['end'],
+        'total_msgs': int(result['total_msgs']),
+        'digest': result['digest'],
+        'user_ids': result['user_ids'],
+        'names': result['names']
+    }
+    store = result['store']
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps(meta, ensure_ascii=False)),
+                 **{column: store[column] for column in ('valid',) + PAIR_FIELDS})
+    os.replace(tmp_path, path)
+
+def load_shards(paths, group_id=None, start=None, end=None):
+    """
+    读取并合并全部分片文件。
+
+    参数：
+        paths: 分片文件路径列表（顺序任意）。
+        group_id: 可选，若指定则检查各分片的群号与之一致。
+        start, end: 可选，若指定其中之一，则检查各分片提取数据时的时间范围与之一致。
+    返回：
+        (store, user_ids, names, total_msgs)：按用户对原始顺序排列的结果列、用户列表、昵称和总消息数。
+    异常：
+        ValueError：分片文件版本不一致、时间范围不同、来自不同的数据，或不能恰好覆盖全部用户对。
+    """
+    expected_range = _range_bounds(start, end) if start is not None or end is not None else None
+    store = None
+    covered = []
+    shards = []
+    for path in paths:
+        with np.load(path, allow_pickle=False) as archive:
+            meta = json.loads(str(archive['meta']))
+            if meta.get('version') != SHARD_VERSION:
+                raise ValueError(f"{path}：分片文件版本不一致：{meta.get('version')}")
+            if group_id is not None and meta['group'] is not None and meta['group'] != group_id:
+                raise ValueError(f"{path}：分片来自群 {meta['group']}，而不是群 {group_id}")
+            if expected_range is not None and meta['range'] != expected_range:
+                raise ValueError(f"{path}：分片的时间范围为 {_range_text(meta['range'])}，"
+                                 f"而不是 {_range_text(expected_range)}")
+            if store is None:
+                first = meta
+                user_ids, names = meta['user_ids'], meta['names']
+                num_users = len(user_ids)
+                store = allocate_pair_store(num_users * (num_users - 1) // 2)
+                store['code1'][:], store['code2'][:] = pair_codes(num_users, 0, len(store['valid']))
+            elif meta['range'] != first['range']:
+                raise ValueError(f"{path}：时间范围（{_range_text(meta['range'])}）与 {paths[0]}"
+                                 f"（{_range_text(first['range'])}）不同")
+            elif (meta['digest'], meta['num_shards']) != (first['digest'], first['num_shards']):
+                raise ValueError(f"{path}：与 {paths[0]} 不是同一次分片（数据或分片数不同）")
+            start, end = meta['start'], meta['end']
+            for column in ('valid',) + PAIR_FIELDS:
+                store[column][start:end] = archive[column]
+            covered.append((start, end, meta['shard'], path))
+            shards.append(meta['shard'])
+
+    num_shards = first['num_shards']
+    missing = sorted(set(range(1, num_shards + 1)) - set(shards))
+    if missing:
+        listed = '、'.join(map(str, missing[:10])) + (" 等" if len(missing) > 10 else "")
+        raise ValueError(f"缺少 {len(missing)}/{num_shards} 片（第 {listed}）")
+    if len(shards) != len(set(shards)):
+        raise ValueError("同一分片的文件出现了多次")
+    # 各分片的区间应首尾相接，恰好覆盖全部用户对
+    covered.sort()
+    position = 0
+    for start, end, shard, path in covered:
+        if start != position:
+            raise ValueError(f"分片区间不连续：{path}（第 {shard}/{first['num_shards']} 片）从第 {start} 对开始，"
+                             f"应从第 {position} 对开始")
+        position = end
+    if position != len(store['valid']):
+        raise ValueError(f"分片区间只覆盖了 {position}/{len(store['valid'])} 对用户")
+    return store, user_ids, names, first['total_msgs']
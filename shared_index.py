@@ -0,0 +1,106 @@
+"""
+shared_index.py
+---------------
+将按用户分组的消息索引（见 intimacy_analysis.build_message_index）发布到共享内存，
+供多进程池中的各个工作进程以只读方式零拷贝访问。
+
+  - 主进程只发布一次数值数组（counts、offsets、times、lengths、rows），每个数组占用一个
+    multiprocessing.shared_memory 段；工作进程初始化时按名称挂载，不再各自拷贝一份数据。
+  - 用户目录（user_ids、names）体量为 O(用户数)，随初始化参数一起传递。
+  - 共享内存段在计算结束或发生异常时统一关闭并释放（unlink）。
+"""
+
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# 需要放入共享内存的数值数组字段
+SHARED_ARRAY_FIELDS = ('counts', 'offsets', 'times', 'lengths', 'rows')
+
+# 工作进程中挂载的共享内存段，需保持引用，否则映射会随对象回收而失效
+_attached_segments = []
+
+def _attach_segment(name):
+    """按名称挂载已有的共享内存段，工作进程不参与段的生命周期管理。"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 之前没有 track 参数，由创建段的主进程负责释放
+        return shared_memory.SharedMemory(name=name)
+
+def publish_index(index):
+    """
+    将消息索引中的数值数组拷贝到新建的共享内存段。
+
+    参数：
+        index: build_message_index 返回的字典。
+    返回：
+        (handle, segments)：
+          - handle: 可被 pickle 的描述信息，传给 attach_index 在工作进程中还原索引；
+          - segments: 主进程持有的 SharedMemory 对象列表，用完后交给 release_segments 释放。
+    """
+    handle = {'user_ids': index['user_ids'], 'names': index['names'], 'arrays': {}}
+    segments = []
+    try:
+        for field in SHARED_ARRAY_FIELDS:
+            array = np.ascontiguousarray(index[field])
+            # 共享内存段大小必须大于 0
+            segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            segments.append(segment)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+            handle['arrays'][field] = (segment.name, array.shape, array.dtype.str)
+    except Exception:
+        release_segments(segments)
+        raise
+    return handle, segments
+
+def attach_index(handle):
+    """
+    在工作进程中根据 handle 挂载共享内存，返回与 build_message_index 结构相同的只读索引。
+    """
+    index = {'user_ids': handle['user_ids'], 'names': handle['names']}
+    for field, (name, shape, dtype) in handle['arrays'].items():
+        segment = _attach_segment(name)
+        _attached_segments.append(segment)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+        array.flags.writeable = False
+        index[field] = array
+    return index
+
+def detach_index():
+    """
+    关闭工作进程中已挂载的全部共享内存段（常驻的进程池切换到另一份索引之前调用，见 service.py），
+    调用前应先释放对旧索引数组的引用；仍被引用的段保持挂载。
+    """
+    remaining = []
+    for segment in _attached_segments:
+        try:
+            segment.close()
+        except BufferError:
+            remaining.append(segment)
+    _attached_segments[:] = remaining
+
+def release_segments(segments):
+    """关闭并释放主进程创建的共享内存段，重复释放时忽略错误。"""
+    for segment in segments:
+        try:
+            segment.close()
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+@contextmanager
+def shared_message_index(index):
+    """
+    上下文管理器：发布消息索引到共享内存，并保证退出（包括异常退出）时释放所有段。
+
+    用法：
+        with shared_message_index(index) as handle:
+            ProcessPoolExecutor(initializer=..., initargs=(handle,))
+    """
+    handle, segments = publish_index(index)
+    try:
+        yield handle
+    finally:
+        release_segments(segments)
@@ -0,0 +1,110 @@
+"""
+sliding_window.py
+-----------------
+滑动时间窗口的亲密度时间序列（main.py --window/--step）。
+
+按月观察亲密度变化时，若对每个时间段重新运行一次程序，每次都要重新提取数据并重新计算。
+本模块对每对用户只合并一次完整的时间线，然后让窗口沿时间线滑动：
+
+  - 某个时间窗口 [start, end) 内两人的消息在合并时间线上是连续的一段，窗口内的相邻消息
+    恰好是两端都落在窗口内的那些相邻消息对；
+  - 因此对每种相邻消息贡献（双向回复间隔之和与次数、快速回复次数）以及每人的消息数、消息长度
+    各建立一次前缀和，窗口向前滑动时，新进入窗口的贡献加到前缀和之差的末端，移出窗口的贡献
+    从首端扣除，每个窗口只需 O(1) 次查表，无需重新计算；
+  - 由窗口内的充分统计量还原的指标与只用该窗口内的数据计算的结果一致（见 incremental.metrics_from_statistics）。
+
+窗口按 UTC 零点对齐：第一个窗口从第一条消息当天的零点开始，之后每隔 step 开始一个新窗口，
+直到覆盖最后一条消息。两人在窗口内都有消息时才输出该窗口的一行。
+"""
+
+import re
+
+import numpy as np
+
+from incremental import QUICK_REPLY_SECONDS, merge_timelines
+
+# 时长单位（秒）
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+_DURATION_PATTERN = re.compile(r'^\s*(\d+)\s*([smhdw]?)\s*$', re.IGNORECASE)
+
+def parse_duration(text) -> int:
+    """
+    解析时长参数，如 30d、12h、2w、3600s；省略单位时按天计算。返回秒数。
+    """
+    match = _DURATION_PATTERN.match(str(text))
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"无效的时长：{text}（示例：30d、12h、2w）")
+    return int(match.group(1)) * _DURATION_UNITS[(match.group(2) or 'd').lower()]
+
+def window_bounds(times, window_seconds, step_seconds):
+    """
+    计算覆盖全部消息的滑动窗口。
+
+    参数：
+        times: 所有消息的 Unix 时间戳（秒），无需排序。
+        window_seconds: 窗口长度（秒）。
+        step_seconds: 相邻窗口起点的间隔（秒）。
+    返回：
+        (starts, ends)：各窗口的起止时间（int64 数组），窗口为左闭右开区间 [start, end)。
+    """
+    first, last = int(np.min(times)), int(np.max(times))
+    origin = first - first % 86400
+    starts = np.arange(origin, last + 1, step_seconds, dtype=np.int64)
+    return starts, starts + window_seconds
+
+def window_pair_statistics(times1, lengths1, rows1, times2, lengths2, rows2, starts, ends):
+    """
+    一次合并两人的时间线，得到每个窗口内的充分统计量。
+
+    参数：
+        times1, lengths1, rows1, times2, lengths2, rows2: 同 _pair_metrics_kernel。
+        starts, ends: window_bounds 返回的窗口起止时间。
+    返回：
+        两人都有消息的窗口的统计量字典（各项为等长数组）：windows（窗口编号）、count1、count2、
+        length_sum1、length_sum2、span，以及与 incremental.PAIR_STAT_FIELDS 同序的 pair_stats；
+        没有这样的窗口时返回 None。
+    """
+    # 每人在各窗口内的消息范围
+    lo1, hi1 = np.searchsorted(times1, starts), np.searchsorted(times1, ends)
+    lo2, hi2 = np.searchsorted(times2, starts), np.searchsorted(times2, ends)
+    windows = np.flatnonzero((hi1 > lo1) & (hi2 > lo2))
+    if len(windows) == 0:
+        return None
+    lo1, hi1, lo2, hi2 = lo1[windows], hi1[windows], lo2[windows], hi2[windows]
+    length_cum1 = np.concatenate(([0], np.cumsum(lengths1, dtype=np.int64)))
+    length_cum2 = np.concatenate(([0], np.cumsum(lengths2, dtype=np.int64)))
+    span = np.maximum(times1[hi1 - 1], times2[hi2 - 1]) - np.minimum(times1[lo1], times2[lo2])
+
+    # 合并时间线（与 _pair_metrics_kernel 一致；同一秒内按原始行号排列，窗口内的先后与单独计算该窗口时相同）
+    times, from_user2 = merge_timelines(times1, rows1, times2, rows2)
+    gaps = np.diff(times)
+    switched = from_user2[1:] != from_user2[:-1]
+    to_user2 = from_user2[1:]
+    quick = gaps <= QUICK_REPLY_SECONDS
+    reply_12 = switched & to_user2
+    reply_21 = switched & ~to_user2
+
+    # 窗口内的相邻消息对为第 lo 条到第 hi-1 条消息之间的 hi-1-lo 对，统计量为前缀和之差
+    lo = np.searchsorted(times, starts[windows])
+    hi = np.searchsorted(times, ends[windows]) - 1
+
+    def windowed(values):
+        cum = np.concatenate(([0], np.cumsum(values, dtype=np.int64)))
+        return cum[hi] - cum[lo]
+
+    return {
+        'windows': windows,
+        'count1': hi1 - lo1,
+        'count2': hi2 - lo2,
+        'length_sum1': length_cum1[hi1] - length_cum1[lo1],
+        'length_sum2': length_cum2[hi2] - length_cum2[lo2],
+        'span': span,
+        'pair_stats': [
+            windowed(np.where(reply_12, gaps, 0)),
+            windowed(reply_12),
+            windowed(np.where(reply_21, gaps, 0)),
+            windowed(reply_21),
+            windowed(reply_12 & quick),
+            windowed(reply_21 & quick)
+        ]
+    }
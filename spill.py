@@ -0,0 +1,107 @@
+"""
+spill.py
+--------
+内存受限的分块计算模式（main.py --spill）。
+
+全量计算需要同时在内存中保存全部用户对的结果，超大群在内存较小的机器上可能因内存不足被终止。本模式分两遍处理：
+  1. 按 combinations(用户, 2) 的顺序把用户对划分为若干块（pair_blocks），每块计算完成后结果写入
+     磁盘上的内存映射列（见 pair_store.allocate_pair_store），内存中只累积各项指标的最小值和最大值；
+  2. 全部块完成后即得到全局归一化区间，分段读取原始指标计算综合得分（score_spilled），
+     常驻内存的只有每对用户一个 float64 得分。
+排序后按名次分段写出 CSV（write_ranked_csv），只为前 N 对用户构造 DataFrame 供图表使用（ranked_frame）。
+得分、排序和 CSV 与全量计算逐位一致；本模式不写出原始指标文件，因此不能用 --rescore 重新评分。
+"""
+
+import numpy as np
+import pandas as pd
+
+from pair_store import store_frame
+from scoring import METRICS_TO_NORMALIZE, WEIGHTS, activity_factor, metric_extrema, normalize_metric, \
+    score_metrics, weighted_score
+from shard import pair_codes
+
+# 每块的用户对数，决定第一遍计算时的内存占用
+DEFAULT_BLOCK_PAIRS = 200_000
+# 第二遍评分和写出 CSV 时每段的行数
+CHUNK_ROWS = 100_000
+
+def pair_blocks(num_users, block_pairs=DEFAULT_BLOCK_PAIRS):
+    """
+    按 combinations(range(num_users), 2) 的顺序生成用户对块，每块约 block_pairs 对
+    （同一 code1 的用户对不拆到两块中）。
+
+    生成：
+        (起始位置, 用户对)，起始位置为该块第一对用户在全部用户对中的序号，用户对为 (n, 2) 的 int32 编号数组。
+    """
+    position = 0
+    code1 = 0
+    while code1 < num_users - 1:
+        size = 0
+        while code1 < num_users - 1 and (not size or size + num_users - 1 - code1 <= block_pairs):
+            size += num_users - 1 - code1
+            code1 += 1
+        yield position, np.column_stack(pair_codes(num_users, position, position + size))
+        position += size
+
+def update_extrema(extrema, store, start, end):
+    """用 store 中 [start, end) 行里有结果的用户对更新各项指标的最小值和最大值（extrema 原地更新，初始为空字典）。"""
+    valid = store['valid'][start:end]
+    if not valid.any():
+        return
+    block = metric_extrema({col: store[col][start:end][valid] for col, _ in METRICS_TO_NORMALIZE})
+    for col, (minimum, maximum) in block.items():
+        if col in extrema:
+            minimum, maximum = min(minimum, extrema[col][0]), max(maximum, extrema[col][1])
+        extrema[col] = (minimum, maximum)
+
+def score_spilled(store, total_msgs, extrema, weights=WEIGHTS, chunk_rows=CHUNK_ROWS):
+    """
+    第二遍：分段读取原始指标，按全局归一化区间计算综合得分，与 score_metrics 的结果逐位一致。
+
+    返回：
+        float64 数组，与 store 的行一一对应，没有结果的用户对为 NaN。
+    """
+    num_rows = len(store['valid'])
+    scores = np.full(num_rows, np.nan)
+    factor = activity_factor(total_msgs)
+    for start in range(0, num_rows, chunk_rows):
+        end = min(start + chunk_rows, num_rows)
+        norms = {col: normalize_metric(store[col][start:end], *extrema[col], reverse)
+                 for col, reverse in METRICS_TO_NORMALIZE}
+        scores[start:end] = weighted_score(norms, weights) * factor
+    scores[~np.asarray(store['valid'])] = np.nan
+    return scores
+
+def ranked_order(scores):
+    """按综合得分从高到低排列有结果的用户对（得分相同时保持原始顺序，与 rank_pairs 一致），返回行号数组。"""
+    valid = np.flatnonzero(~np.isnan(scores))
+    order = pd.Series(scores[valid]).sort_values(ascending=False, kind='stable').index.to_numpy()
+    return valid[order]
+
+def ranked_frame(result, rows) -> pd.DataFrame:
+    """
+    为指定名次的用户对构造与 calculate_intimacy_metrics 相同格式的结果 DataFrame。
+
+    参数：
+        result: calculate_spilled_metrics 的返回值。
+        rows: 行号数组，例如 result['order'][:N] 为前 N 名。
+    """
+    frame = store_frame(result['store'], result['user_ids'], result['names'], rows)
+    return score_metrics(frame, result['total_msgs'], result['extrema'], result['weights'])
+
+def write_ranked_csv(result, path, limit=None, chunk_rows=CHUNK_ROWS) -> int:
+    """
+    按名次分段写出结果 CSV（与全量计算的 CSV 相同），每段只在内存中构造 chunk_rows 行。
+
+    参数：
+        result: calculate_spilled_metrics 的返回值。
+        path: 输出文件路径。
+        limit: 可选，只写出前 limit 名。
+    返回：
+        写出的行数。
+    """
+    order = result['order'][:limit] if limit else result['order']
+    with open(path, 'w', encoding='gbk', newline='') as f:
+        for start in range(0, len(order), chunk_rows):
+            ranked_frame(result, order[start:start + chunk_rows]).to_csv(f, header=start == 0, index=False)
+    return len(order)
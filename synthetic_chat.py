@@ -0,0 +1,212 @@
+"""
+synthetic_chat.py
+-----------------
+生成合成的 QQ 聊天数据库，用于性能测试（见 benchmark.py）和在没有真实数据时试用本工具。
+
+生成的 SQLite 文件包含与 NT QQ 导出数据库相同列号的 group_msg_table（"40001"、"40027"、"40033"、
+"40090"、"40093"、"40050"、"40080"、"40011"、"40012"），可直接传给 main.py --db。数据特征可配置：
+  - 用户活跃度偏斜（skew）：第 i 活跃的用户的发言权重为 1 / i^skew，少数人贡献大部分消息；
+  - 突发性（burstiness）：消息以对话为单位成簇出现，簇内间隔为数秒到数十秒（含同一秒内的多条消息），
+    簇之间为数小时的空闲；簇内一部分消息是对上上条发言者的回复，形成你来我往的对话；
+  - Emoji 比例（emoji_rate）：消息和昵称中混入 Emoji、零宽字符、方向控制符和韩文填充字符的比例；
+  - 噪声比例（noise_rate）：图片等非文本消息、空白消息和系统账号（10000）消息的比例，这些行会在提取或清洗时被过滤；
+  - 其他群（other_groups）：同一张表中穿插其他群的消息，用于测试按群号过滤。
+相同参数和随机种子生成的数据库完全相同。
+
+用法：
+    python synthetic_chat.py synthetic.db --users 200 --messages 100000
+"""
+
+import argparse
+import os
+import sqlite3
+
+import numpy as np
+
+# 生成规则版本：修改生成规则时递增，使 benchmark.py 保存的合成数据库重新生成
+SYNTHETIC_VERSION = 1
+# 默认群号
+DEFAULT_GROUP_ID = 900000001
+# 第一条消息的时间（2023-01-01 00:00:00 UTC）
+DEFAULT_START = 1_672_531_200
+# 簇内消息的平均间隔和簇之间的平均空闲时间（秒）
+BURST_GAP_SECONDS = 15
+IDLE_GAP_SECONDS = 3 * 3600
+# 簇内消息是对上上条发言者的回复的概率
+REPLY_BACK_RATE = 0.5
+# 写入数据库时每批插入的行数
+INSERT_BATCH = 50_000
+
+# 消息内容片段和会被清洗掉的特殊字符
+TEXT_PIECES = ['哈哈', '好的', 'ok', '明天见', '在吗', '？', '123', 'hello world', '收到', '……', '今天吃什么',
+               '笑死', '确实', '+1', '晚安', '有人吗', '6', '真的假的', 'gg', '冲']
+EMOJI_CHARS = ['\U0001F600', '\U0001F389', '\U0001F914', '\U0001F602', '\U0001F33B', '\U0001F380', '\U0001F97A']
+INVISIBLE_CHARS = ['\u200B', '\u202E', '\uFEFF', '\u3164', '\u200E']
+
+_SCHEMA = '''CREATE TABLE group_msg_table (
+    "40001" INTEGER, "40027" INTEGER, "40033" INTEGER, "40090" TEXT, "40093" TEXT,
+    "40050" INTEGER, "40080" TEXT, "40011" INTEGER, "40012" INTEGER)'''
+
+def _decorate(rng, texts, rate):
+    """按 rate 的比例在文本中随机位置插入 Emoji 或不可见字符。"""
+    texts = list(texts)
+    specials = EMOJI_CHARS + INVISIBLE_CHARS
+    for i in np.flatnonzero(rng.random(len(texts)) < rate):
+        pos = int(rng.integers(0, len(texts[i]) + 1))
+        texts[i] = texts[i][:pos] + specials[int(rng.integers(0, len(specials)))] + texts[i][pos:]
+    return texts
+
+def _user_profiles(rng, users, emoji_rate, first_uid):
+    """生成用户的 QQ 号、群昵称和 QQ 名称。约三成用户没有群昵称，部分群昵称带括号内的 QQ 号。"""
+    uids = first_uid + np.arange(users, dtype=np.int64)
+    qq_names = _decorate(rng, [f"用户{uid % 100000}" for uid in uids], emoji_rate)
+    group_names = []
+    for uid, kind in zip(uids, rng.random(users)):
+        if kind < 0.3:
+            group_names.append('')
+        elif kind < 0.45:
+            group_names.append(f"群友{uid % 1000}({uid})")
+        else:
+            group_names.append(f"群友{uid % 1000}")
+    return uids, _decorate(rng, group_names, emoji_rate), qq_names
+
+def _timestamps(rng, messages, burstiness, start):
+    """生成成簇出现的消息时间戳，返回 (时间戳, 是否为簇内消息)。"""
+    in_burst = rng.random(messages) < burstiness
+    in_burst[0] = False
+    gaps = np.where(in_burst, rng.exponential(BURST_GAP_SECONDS, messages),
+                    rng.exponential(IDLE_GAP_SECONDS, messages)).astype(np.int64)
+    gaps[0] = 0
+    return start + np.cumsum(gaps), in_burst
+
+def _senders(rng, messages, users, skew, in_burst):
+    """按偏斜的活跃度抽取发言者，簇内部分消息改为上上条的发言者（回复对方）。"""
+    weights = 1.0 / np.arange(1, users + 1) ** skew
+    # 活跃度排名与 QQ 号的顺序无关
+    weights = rng.permutation(weights)
+    senders = rng.choice(users, size=messages, p=weights / weights.sum()).tolist()
+    reply_back = in_burst & (rng.random(messages) < REPLY_BACK_RATE)
+    reply_back[:2] = False
+    for i in np.flatnonzero(reply_back).tolist():
+        senders[i] = senders[i - 2]
+    return np.array(senders, dtype=np.int64)
+
+def _contents(rng, messages, emoji_rate):
+    """生成消息内容：1 到 4 个片段拼接，偶尔重复较长，并按 emoji_rate 混入特殊字符。"""
+    pieces = rng.integers(0, len(TEXT_PIECES), size=(messages, 4))
+    counts = np.minimum(rng.geometric(0.5, messages), 4)
+    texts = [''.join(TEXT_PIECES[p] for p in row[:k]) for row, k in zip(pieces.tolist(), counts.tolist())]
+    for i in np.flatnonzero(rng.random(messages) < 0.02).tolist():
+        texts[i] = texts[i] * int(rng.integers(5, 30))
+    return _decorate(rng, texts, emoji_rate)
+
+def _group_rows(rng, group_id, users, messages, burstiness, emoji_rate, skew, noise_rate, start, first_uid):
+    """生成一个群的全部行（按时间排列），各列为等长列表。"""
+    uids, group_names, qq_names = _user_profiles(rng, users, emoji_rate, first_uid)
+    times, in_burst = _timestamps(rng, messages, burstiness, start)
+    senders = _senders(rng, messages, users, skew, in_burst)
+    rows = {
+        'group': [group_id] * messages,
+        'sender': uids[senders].tolist(),
+        'group_name': [group_names[s] for s in senders.tolist()],
+        'qq_name': [qq_names[s] for s in senders.tolist()],
+        'time': times.tolist(),
+        'content': _contents(rng, messages, emoji_rate),
+        'type': [2] * messages,
+        'subtype': [1] * messages
+    }
+    # 噪声行：非文本消息、空白消息、系统账号消息各占约三分之一
+    noise = np.flatnonzero(rng.random(messages) < noise_rate).tolist()
+    for i, kind in zip(noise, rng.integers(0, 3, len(noise)).tolist()):
+        if kind == 0:
+            rows['type'][i], rows['subtype'][i] = 5, 0
+        elif kind == 1:
+            rows['content'][i] = ' '
+        else:
+            rows['sender'][i], rows['group_name'][i], rows['qq_name'][i] = 10000, '', '系统消息'
+    return rows
+
+def generate_chat_db(path, users=200, messages=100_000, group_id=DEFAULT_GROUP_ID, burstiness=0.7,
+                     emoji_rate=0.1, skew=1.2, noise_rate=0.02, other_groups=0, start=DEFAULT_START,
+                     seed=0, index=False) -> dict:
+    """
+    生成合成聊天数据库（已存在的文件会被覆盖）。
+
+    参数：
+        path: 输出的 SQLite 文件路径。
+        users: 群成员数。
+        messages: 该群的消息行数（含噪声行）。
+        group_id: 群号。
+        burstiness: 簇内消息的比例（0 到 1），越大对话越集中。
+        emoji_rate: 消息和昵称中混入特殊字符的比例（0 到 1）。
+        skew: 用户活跃度的偏斜指数，0 表示所有人同样活跃。
+        noise_rate: 噪声行的比例（0 到 1）。
+        other_groups: 穿插在表中的其他群的个数，每个群的消息数为 messages 的十分之一。
+        start: 第一条消息的 Unix 时间戳（秒）。
+        seed: 随机种子。
+        index: 为 True 时在 ("40027", "40050") 上建立索引。
+    返回：
+        生成结果摘要：rows（总行数）、group_rows（该群行数）、first_timestamp、last_timestamp。
+    """
+    if users < 2 or messages < 1:
+        raise ValueError("至少需要 2 位用户和 1 条消息")
+    for name, value in (('burstiness', burstiness), ('emoji_rate', emoji_rate), ('noise_rate', noise_rate)):
+        if not 0 <= value <= 1:
+            raise ValueError(f"{name} 应在 0 到 1 之间：{value}")
+    rng = np.random.default_rng(seed)
+    groups = [_group_rows(rng, group_id, users, messages, burstiness, emoji_rate, skew, noise_rate,
+                          start, 100000)]
+    for g in range(other_groups):
+        groups.append(_group_rows(rng, group_id + g + 1, max(2, users // 4), max(1, messages // 10), burstiness,
+                                  emoji_rate, skew, noise_rate, start, 500000 + g * 100000))
+    columns = list(groups[0])
+    merged = {column: [value for rows in groups for value in rows[column]] for column in columns}
+    # 各群的消息按时间交错写入，rowid 顺序与时间顺序一致（与客户端追加写入的数据库相同）
+    order = np.argsort(np.array(merged['time'], dtype=np.int64), kind='stable').tolist()
+
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute(_SCHEMA)
+        for begin in range(0, len(order), INSERT_BATCH):
+            batch = order[begin:begin + INSERT_BATCH]
+            conn.executemany('INSERT INTO group_msg_table VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             ((begin + k + 1, *(merged[column][i] for column in columns))
+                              for k, i in enumerate(batch)))
+        if index:
+            conn.execute('CREATE INDEX idx_group_time ON group_msg_table ("40027", "40050")')
+        conn.commit()
+    finally:
+        conn.close()
+    times = groups[0]['time']
+    return {'rows': len(order), 'group_rows': messages, 'first_timestamp': times[0], 'last_timestamp': times[-1]}
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成的 QQ 群聊数据库")
+    parser.add_argument("output", type=str, help="输出的 SQLite 文件路径（已存在时覆盖）")
+    parser.add_argument("--users", type=int, default=200, help="群成员数，默认 200")
+    parser.add_argument("--messages", type=int, default=100_000, help="消息行数，默认 100000")
+    parser.add_argument("--group", type=int, default=DEFAULT_GROUP_ID, help=f"群号，默认 {DEFAULT_GROUP_ID}")
+    parser.add_argument("--burstiness", type=float, default=0.7, help="簇内消息的比例（0~1），默认 0.7")
+    parser.add_argument("--emoji-rate", type=float, default=0.1, help="混入 Emoji 等特殊字符的比例（0~1），默认 0.1")
+    parser.add_argument("--skew", type=float, default=1.2, help="用户活跃度偏斜指数，默认 1.2（0 表示均匀）")
+    parser.add_argument("--noise-rate", type=float, default=0.02, help="非文本、空白和系统消息的比例（0~1），默认 0.02")
+    parser.add_argument("--other-groups", type=int, default=0, help="穿插写入的其他群个数，默认 0")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子，默认 0")
+    parser.add_argument("--index", action="store_true", help="在群号和时间列上建立索引")
+    args = parser.parse_args()
+    try:
+        summary = generate_chat_db(args.output, users=args.users, messages=args.messages, group_id=args.group,
+                                   burstiness=args.burstiness, emoji_rate=args.emoji_rate, skew=args.skew,
+                                   noise_rate=args.noise_rate, other_groups=args.other_groups, seed=args.seed,
+                                   index=args.index)
+    except ValueError as e:
+        print(f"[ERROR] 参数无效：{e}")
+        return
+    print(f"[INFO] 已生成 {args.output}：共 {summary['rows']} 行，群 {args.group} 有 {summary['group_rows']} 行。")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+测试共用的数据构造函数和夹具。
+
+各模块位于仓库根目录（没有包结构），这里把根目录加入 sys.path，
+使 `pytest` 和 `python -m pytest` 在任意目录下运行时都能导入。
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+def make_chat(users=8, messages=600, seed=0, start=1_700_000_000, tie_rate=0.3, span_days=20):
+    """
+    构造清洗后的聊天记录 DataFrame（按时间排列），格式同 clean_chat_data 的输出。
+
+    参数：
+        tie_rate: 与上一条消息落在同一秒的比例，用于覆盖不同用户同一秒发言的情况。
+        span_days: 消息大致覆盖的天数。
+    """
+    rng = np.random.default_rng(seed)
+    gaps = rng.exponential(span_days * 86400 / messages, messages).astype(np.int64)
+    gaps[rng.random(messages) < tie_rate] = 0
+    # 一部分消息在 60 秒内连续出现，覆盖快速回复和连续互动
+    quick = rng.random(messages) < 0.4
+    gaps[quick] = np.minimum(gaps[quick], rng.integers(0, 60, int(quick.sum())))
+    times = start + np.cumsum(gaps)
+    senders = rng.zipf(1.6, messages) % users
+    return pd.DataFrame({
+        'sender_id': [str(100000 + s) for s in senders],
+        'sender_nickname': [f"用户{s}" for s in senders],
+        'timestamp': times.astype(np.int64),
+        'content_length': rng.integers(1, 40, messages).astype(np.int32)
+    })
+
+@pytest.fixture
+def chat():
+    return make_chat()
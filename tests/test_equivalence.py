@@ -0,0 +1,148 @@
+"""
+各种加速模式与全量计算的一致性：Top-K、增量合并、单用户扫描引擎和滑动窗口。
+"""
+
+from functools import partial
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_chat
+import intimacy_analysis
+import topk
+from focus_engine import focus_pair_metrics
+from incremental import new_state
+from intimacy_analysis import _compute_pair_metrics, _pair_metrics_kernel, _user_messages, build_message_index, \
+    calculate_intimacy_metrics, calculate_window_metrics, merge_into_state, rank_state
+
+# 交换 user1、user2 时需要对调的列
+SWAPPED_COLUMNS = (('user1', 'user2'), ('name1', 'name2'), ('count1', 'count2'),
+                   ('resp_time_1_to_2', 'resp_time_2_to_1'), ('avg_len_user1', 'avg_len_user2'))
+
+def _plain(frame):
+    """把分类列转换为普通字符串列，便于比较不同来源的结果。"""
+    frame = frame.copy()
+    for col in frame.columns:
+        if isinstance(frame[col].dtype, pd.CategoricalDtype):
+            frame[col] = frame[col].astype(str)
+    return frame.reset_index(drop=True)
+
+def assert_same_results(actual, expected, **kwargs):
+    """比较两份结果的取值（次数类指标在列式存储中为 int32，逐对结果中为 int64，不比较数据类型）。"""
+    pd.testing.assert_frame_equal(_plain(actual), _plain(expected), check_dtype=False, **kwargs)
+
+@pytest.mark.parametrize('k', [1, 5, 12, 1000])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_top_k_equals_head_of_full_ranking(k, seed):
+    df = make_chat(users=10, messages=800, seed=seed)
+    full = calculate_intimacy_metrics(df, max_workers=1)
+    top = calculate_intimacy_metrics(df, max_workers=1, top_k=k)
+    assert_same_results(top, full.head(k))
+
+@pytest.mark.parametrize('k', [1, 5, 12])
+def test_top_k_search_without_full_run_fallback(k, monkeypatch):
+    # 关闭回退，确保两阶段搜索本身（而不是全量计算）得到同样的结果
+    monkeypatch.setattr(intimacy_analysis, 'top_k_pairs', partial(topk.top_k_pairs, full_run_fraction=None))
+    df = make_chat(users=12, messages=900, seed=2)
+    full = calculate_intimacy_metrics(df, max_workers=1)
+    top = calculate_intimacy_metrics(df, max_workers=1, top_k=k)
+    assert_same_results(top, full.head(k))
+
+@pytest.mark.parametrize('seed', range(5))
+def test_top_k_bounds_contain_exact_metrics(seed):
+    df = make_chat(users=15, messages=1500, seed=seed, span_days=60)
+    index = build_message_index(df)
+    pairs = np.array(list(combinations(range(len(index['user_ids'])), 2)))
+    near = topk.co_activity_messages(index, topk.DEFAULT_BUCKET_SECONDS)
+    _, lower, upper = topk._cheap_metrics(index, pairs[:, 0], pairs[:, 1], near, topk.DEFAULT_BUCKET_SECONDS)
+    for pos, pair in enumerate(pairs):
+        metrics = _pair_metrics_kernel(*_user_messages(index, pair[0]), *_user_messages(index, pair[1]))
+        for col in upper:
+            assert lower[col][pos] - 1e-9 <= metrics[col] <= upper[col][pos] + 1e-9, col
+
+def test_top_k_with_prune_equals_head_of_pruned_ranking(chat):
+    full = calculate_intimacy_metrics(chat, max_workers=1, prune=True)
+    top = calculate_intimacy_metrics(chat, max_workers=1, prune=True, top_k=4)
+    assert_same_results(top, full.head(4))
+
+@pytest.mark.parametrize('parts', [2, 3, 5])
+def test_incremental_merges_equal_full_run(parts):
+    df = make_chat(users=9, messages=900, seed=parts)
+    times = df['timestamp'].to_numpy()
+    # 在时间戳边界上切分（与高水位一致：同一秒的消息总在同一次合并中）
+    cuts = np.quantile(times, np.linspace(0, 1, parts + 1)[1:-1]).astype(np.int64)
+    state = new_state(900000001)
+    previous = times.min()
+    for cut in list(cuts) + [times.max() + 1]:
+        chunk = df[(times >= previous) & (times < cut)].reset_index(drop=True)
+        if len(chunk):
+            merge_into_state(state, chunk, max_workers=1, progress=False)
+        previous = cut
+    assert_same_results(rank_state(state), calculate_intimacy_metrics(df, max_workers=1))
+
+def test_incremental_late_joiners_keep_full_run_user_order():
+    df = make_chat(users=6, messages=300, seed=7)
+    # 后半段才出现的新用户
+    late = make_chat(users=3, messages=200, seed=8, start=int(df['timestamp'].max()) + 10)
+    late['sender_id'] = late['sender_id'].str.replace('100', '200', n=1)
+    full_df = pd.concat([df, late], ignore_index=True)
+    state = new_state(1)
+    merge_into_state(state, df, max_workers=1, progress=False)
+    merge_into_state(state, late, max_workers=1, progress=False)
+    assert_same_results(rank_state(state), calculate_intimacy_metrics(full_df, max_workers=1))
+
+def test_focus_engine_matches_pairwise_kernel(chat, monkeypatch):
+    index = build_message_index(chat)
+    monkeypatch.setattr(intimacy_analysis, '_index_global', index)
+    num_users = len(index['user_ids'])
+    for focus_code in range(num_users):
+        partners = [code for code in range(num_users) if code != focus_code]
+        columns = focus_pair_metrics(index, focus_code, partners)
+        for row, partner in enumerate(partners):
+            expected = _compute_pair_metrics((focus_code, partner))
+            for field, value in expected.items():
+                actual = columns[field][row]
+                if isinstance(value, str):
+                    assert str(actual) == value, field
+                else:
+                    assert actual == pytest.approx(value, rel=1e-12, abs=1e-12), (focus_code, partner, field)
+
+def test_focus_user_run_matches_full_kernel_rows(chat):
+    focus_user = chat['sender_id'].iloc[0]
+    focus = _plain(calculate_intimacy_metrics(chat, max_workers=1, focus_user=focus_user))
+    assert (focus['user1'] == focus_user).all()
+    full = _plain(calculate_intimacy_metrics(chat, max_workers=1))
+    # 全量结果中关注用户是 user1 的行（关注用户在群里第一个发言，所有行都是）
+    expected = full[full['user1'] == focus_user].set_index('user2')
+    for row in focus.to_dict('records'):
+        for field in ('avg_response_time', 'reply_count', 'interaction_continuity', 'dialogue_continuity',
+                      'count1', 'count2', 'chat_frequency'):
+            assert row[field] == pytest.approx(expected.loc[row['user2'], field], rel=1e-12), field
+
+def _oriented(frame, user_order):
+    """按 user_order 中的先后调整每行的 user1、user2 方向，返回以用户对为索引的结果。"""
+    frame = _plain(frame)
+    swap = frame['user1'].map(user_order) > frame['user2'].map(user_order)
+    for left, right in SWAPPED_COLUMNS:
+        frame.loc[swap, [left, right]] = frame.loc[swap, [right, left]].to_numpy()
+    return frame.set_index(['user1', 'user2']).sort_index()
+
+@pytest.mark.parametrize('window_days, step_days', [(3, 3), (5, 2)])
+def test_windows_match_per_window_full_runs(window_days, step_days):
+    # 同一秒内的消息按原始行号排列，窗口内两人的先后与单独计算该窗口时一致
+    df = make_chat(users=7, messages=700, seed=4)
+    windows = calculate_window_metrics(df, window_days * 86400, step_days * 86400, max_workers=1)
+    user_order = {uid: code for code, uid in enumerate(build_message_index(df)['user_ids'])}
+    starts = pd.to_datetime(df['timestamp'], unit='s')
+    checked = 0
+    for (start, end), rows in windows.groupby(['window_start', 'window_end'], sort=False):
+        window_df = df[(starts >= start) & (starts < end)].reset_index(drop=True)
+        expected = calculate_intimacy_metrics(window_df, max_workers=1)
+        actual = rows.drop(columns=['window_start', 'window_end'])
+        # 各窗口使用全部消息中最早的昵称，这里每位用户的昵称不变
+        pd.testing.assert_frame_equal(_oriented(actual, user_order), _oriented(expected, user_order),
+                                      check_dtype=False, check_exact=False, rtol=1e-12)
+        checked += 1
+    assert checked > 1
@@ -0,0 +1,79 @@
+"""
+增量状态的高水位校验：历史消息被原地修改（内容、发送者）时应丢弃状态并全量重新计算。
+"""
+
+import sqlite3
+
+import pytest
+
+from test_equivalence import assert_same_results
+from clean_chat_data import clean_chat_data
+from extract_chat_data import extract_chat_data, fingerprint_rows, summarize_chat_rows
+from incremental import open_state, save_state
+from intimacy_analysis import calculate_intimacy_metrics
+from synthetic_chat import DEFAULT_GROUP_ID, generate_chat_db
+
+TEXT_ROWS = f"""FROM group_msg_table WHERE "40027" = {DEFAULT_GROUP_ID} AND "40011" = 2 AND "40012" = 1
+    AND "40080" IS NOT NULL AND TRIM("40080") <> '' AND "40050" IS NOT NULL"""
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'chat.db')
+    generate_chat_db(path, users=12, messages=3000, seed=5)
+    return path
+
+def _incremental_run(db_path, state_path):
+    """与 main.py 的 --state 流程相同：校验状态、只提取高水位之后的消息、合并并保存。"""
+    state, extract_start, extract_end = open_state(state_path, db_path, DEFAULT_GROUP_ID)
+    df = clean_chat_data(extract_chat_data(db_path, DEFAULT_GROUP_ID, start=extract_start, end=extract_end))
+    result = calculate_intimacy_metrics(df, max_workers=1, state=state)
+    save_state(state_path, state)
+    return result
+
+def _full_run(db_path):
+    return calculate_intimacy_metrics(clean_chat_data(extract_chat_data(db_path, DEFAULT_GROUP_ID)), max_workers=1)
+
+def _edit_content(conn, rowid):
+    # 内容变长：行数和 rowid 不变，只有清洗后长度之和改变
+    conn.execute("""UPDATE group_msg_table SET "40080" = "40080" || 'abcdefgh' WHERE rowid = ?""", (rowid,))
+
+def _edit_sender(conn, rowid):
+    # 改为群内另一位成员发送
+    sender = conn.execute('SELECT "40033" FROM group_msg_table WHERE rowid = ?', (rowid,)).fetchone()[0]
+    other = conn.execute(f'SELECT "40033" {TEXT_ROWS} AND "40033" <> ? LIMIT 1', (sender,)).fetchone()[0]
+    conn.execute('UPDATE group_msg_table SET "40033" = ? WHERE rowid = ?', (other, rowid))
+
+def _update(db_path, edit):
+    """原地修改第 100 条可提取的历史消息。"""
+    conn = sqlite3.connect(db_path)
+    try:
+        rowid = conn.execute(f"SELECT rowid {TEXT_ROWS} ORDER BY rowid LIMIT 1 OFFSET 100").fetchone()[0]
+        edit(conn, rowid)
+        conn.commit()
+    finally:
+        conn.close()
+
+def test_fingerprint_of_extracted_rows_matches_sql(db):
+    summary = summarize_chat_rows(db, DEFAULT_GROUP_ID, fingerprint=True)
+    raw = extract_chat_data(db, DEFAULT_GROUP_ID, rowid_range=(0, summary['max_rowid']))
+    assert fingerprint_rows(raw) == (summary['length_sum'], summary['sender_checksum'])
+
+def test_unchanged_history_reuses_state(db, tmp_path, capsys):
+    state_path = str(tmp_path / 'state.npz')
+    _incremental_run(db, state_path)
+    capsys.readouterr()
+    result = _incremental_run(db, state_path)
+    assert "已加载增量状态" in capsys.readouterr().out
+    assert_same_results(result, _full_run(db))
+
+@pytest.mark.parametrize('edit', [_edit_content, _edit_sender])
+def test_in_place_edit_below_cutoff_drops_state(db, tmp_path, capsys, edit):
+    state_path = str(tmp_path / 'state.npz')
+    before = _incremental_run(db, state_path)
+    _update(db, edit)
+    capsys.readouterr()
+    result = _incremental_run(db, state_path)
+    assert "高水位之前的消息内容或发送者被修改" in capsys.readouterr().out
+    expected = _full_run(db)
+    assert_same_results(result, expected)
+    assert not result.equals(before)
@@ -0,0 +1,143 @@
+"""
+向量化内核（_pair_metrics_kernel）与原始逐对循环的一致性，以及空群、单人群等边界情况。
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_chat
+from intimacy_analysis import _pair_metrics_kernel, _user_messages, build_message_index, calculate_intimacy_metrics
+
+def baseline_pair_metrics(df, uid1, uid2):
+    """
+    原始实现的逐条消息循环（向量化之前的 _compute_pair_metrics），作为参照。
+    两人的消息按时间戳稳定排序：同一秒内的消息保持在 df 中的先后。
+    """
+    pair_df = df[df['sender_id'].isin([uid1, uid2])].sort_values('timestamp', kind='stable')
+    lengths1 = pair_df.loc[pair_df['sender_id'] == uid1, 'content_length'].to_numpy()
+    lengths2 = pair_df.loc[pair_df['sender_id'] == uid2, 'content_length'].to_numpy()
+    if not len(lengths1) or not len(lengths2):
+        return None
+    times = [int(t) for t in pair_df['timestamp']]
+    senders = [0 if uid == uid1 else 1 for uid in pair_df['sender_id']]
+
+    response_times, resp_12, resp_21 = [], [], []
+    for i in range(1, len(times)):
+        if senders[i] != senders[i - 1]:
+            dt = times[i] - times[i - 1]
+            response_times.append(dt)
+            (resp_12 if senders[i - 1] == 0 else resp_21).append(dt)
+    avg_resp = float(np.mean(response_times)) if response_times else 300.0
+
+    duration_days = (times[-1] - times[0]) // 86400 + 1
+    chat_freq = len(times) / duration_days
+
+    chain_lengths, current = [], 1
+    for i in range(1, len(times)):
+        if times[i] - times[i - 1] <= 60 and senders[i] != senders[i - 1]:
+            current += 1
+        else:
+            chain_lengths.append(current)
+            current = 1
+    chain_lengths.append(current)
+
+    count1, count2 = len(lengths1), len(lengths2)
+    quick_2, quick_1 = 0, 0
+    for i in range(1, len(times)):
+        if senders[i] != senders[i - 1] and times[i] - times[i - 1] <= 60:
+            if senders[i - 1] == 0:
+                quick_2 += 1
+            else:
+                quick_1 += 1
+    avg_len_user1 = float(np.mean(lengths1))
+    avg_len_user2 = float(np.mean(lengths2))
+    return {
+        'avg_response_time': avg_resp,
+        'chat_frequency': chat_freq,
+        'interaction_continuity': float(np.mean(chain_lengths)),
+        'reciprocity': min(count1, count2) / max(count1, count2),
+        'message_length': (avg_len_user1 + avg_len_user2) / 2.0,
+        'reply_count': len(response_times),
+        'dialogue_continuity': (quick_2 / count1 + quick_1 / count2) / 2.0,
+        'count1': count1,
+        'count2': count2,
+        'resp_time_1_to_2': float(np.mean(resp_12)) if resp_12 else 300.0,
+        'resp_time_2_to_1': float(np.mean(resp_21)) if resp_21 else 300.0,
+        'avg_len_user1': avg_len_user1,
+        'avg_len_user2': avg_len_user2
+    }
+
+def assert_metrics_equal(actual, expected):
+    assert actual.keys() == expected.keys()
+    for field, value in expected.items():
+        assert actual[field] == pytest.approx(value, rel=1e-12, abs=1e-12), field
+
+@pytest.mark.parametrize('seed', range(20))
+def test_kernel_matches_baseline_loop(seed):
+    rng = np.random.default_rng(seed)
+    messages = int(rng.integers(2, 120))
+    # 时间取值范围很小，两人经常在同一秒发言；行的先后与时间无关（例如补录的消息）
+    df = pd.DataFrame({
+        'sender_id': rng.choice(['1', '2'], messages),
+        'sender_nickname': 'x',
+        'timestamp': rng.integers(0, 3 * 86400 // (seed + 1) + 50, messages),
+        'content_length': rng.integers(1, 30, messages)
+    })
+    index = build_message_index(df)
+    if len(index['user_ids']) < 2:
+        return
+    metrics = _pair_metrics_kernel(*_user_messages(index, 0), *_user_messages(index, 1))
+    assert_metrics_equal(metrics, baseline_pair_metrics(df, *index['user_ids']))
+
+@pytest.mark.parametrize('rows1, rows2, replies', [([1, 2], [0], 1), ([0, 2], [1], 2)])
+def test_same_second_follows_row_order(rows1, rows2, replies):
+    times1, lengths1 = np.array([0, 100]), np.array([2, 2])
+    times2, lengths2 = np.array([0]), np.array([4])
+    metrics = _pair_metrics_kernel(times1, lengths1, np.array(rows1), times2, lengths2, np.array(rows2))
+    assert metrics['reply_count'] == replies
+    if replies == 1:
+        # 顺序为 u2@0, u1@0, u1@100：只有一次 2->1 的交替回复，间隔 0 秒
+        assert metrics['resp_time_2_to_1'] == 0.0
+        assert metrics['resp_time_1_to_2'] == 300.0
+        assert metrics['dialogue_continuity'] == pytest.approx((0 / 2 + 1 / 1) / 2)
+    else:
+        # 顺序为 u1@0, u2@0, u1@100：1->2 间隔 0 秒，2->1 间隔 100 秒
+        assert metrics['resp_time_1_to_2'] == 0.0
+        assert metrics['resp_time_2_to_1'] == 100.0
+        assert metrics['dialogue_continuity'] == pytest.approx((1 / 2 + 0 / 1) / 2)
+
+def test_kernel_returns_none_without_messages():
+    empty = np.array([], dtype=np.int64)
+    assert _pair_metrics_kernel(empty, empty, empty, np.array([5]), np.array([1]), np.array([0])) is None
+
+def test_full_run_matches_baseline_for_every_pair():
+    df = make_chat(users=6, messages=400, seed=3)
+    result = calculate_intimacy_metrics(df, max_workers=1)
+    index = build_message_index(df)
+    num_users = len(index['user_ids'])
+    assert len(result) == num_users * (num_users - 1) // 2
+    for row in result.to_dict('records'):
+        code1, code2 = index['user_ids'].index(row['user1']), index['user_ids'].index(row['user2'])
+        assert code1 < code2
+        expected = baseline_pair_metrics(df, row['user1'], row['user2'])
+        assert_metrics_equal({field: row[field] for field in expected}, expected)
+    assert result['closeness_score'].is_monotonic_decreasing
+
+def test_empty_group_returns_empty_frame():
+    df = make_chat().iloc[:0]
+    assert calculate_intimacy_metrics(df, max_workers=1).empty
+    assert calculate_intimacy_metrics(df, max_workers=1, top_k=3).empty
+
+def test_single_user_group_returns_empty_frame():
+    df = make_chat()
+    df = df[df['sender_id'] == df['sender_id'].iloc[0]]
+    assert calculate_intimacy_metrics(df, max_workers=1).empty
+    assert calculate_intimacy_metrics(df, max_workers=1, focus_user=df['sender_id'].iloc[0]).empty
+
+def test_unknown_focus_user_returns_empty_frame(chat):
+    assert calculate_intimacy_metrics(chat, max_workers=1, focus_user='1').empty
+
+def test_worker_pool_matches_serial(chat):
+    pd.testing.assert_frame_equal(calculate_intimacy_metrics(chat, max_workers=2),
+                                  calculate_intimacy_metrics(chat, max_workers=1))
@@ -0,0 +1,81 @@
+"""
+常驻查询服务：查询参数校验（HTTP 状态码）和数据库变化后的重新载入。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+from http.server import HTTPServer
+
+import pandas as pd
+import pytest
+
+from service import IntimacyService, _QueryHandler
+from synthetic_chat import DEFAULT_GROUP_ID, generate_chat_db
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'chat.db')
+    generate_chat_db(path, users=10, messages=2000, seed=8)
+    return path
+
+@pytest.fixture
+def service(db):
+    with IntimacyService(db, max_workers=1, use_cache=False) as service:
+        yield service
+
+def _get(port, query):
+    """发送一次 GET 请求，返回 (状态码, JSON)。"""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{query}") as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def test_negative_count_is_rejected(service):
+    with pytest.raises(ValueError):
+        service.top(DEFAULT_GROUP_ID, n=-1)
+    with pytest.raises(ValueError):
+        service.focus(DEFAULT_GROUP_ID, service.top(DEFAULT_GROUP_ID, n=1)['user1'][0], n=-1)
+
+    handler = type('QueryHandler', (_QueryHandler,), {'service': service})
+    server = HTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        port = server.server_port
+        status, payload = _get(port, f"/top?group={DEFAULT_GROUP_ID}&n=-3")
+        assert status == 400 and 'n' in payload['error']
+        status, payload = _get(port, f"/top?group={DEFAULT_GROUP_ID}&n=3")
+        assert status == 200 and len(payload['rows']) == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+def test_changed_database_releases_stale_entries(service, db):
+    service.load(DEFAULT_GROUP_ID)
+    service.load(DEFAULT_GROUP_ID, start=pd.Timestamp('2023-02-01'))
+    before = service.groups()
+    assert len(before) == 2
+
+    # 追加一条新消息：数据库文件的大小和修改时间变化
+    conn = sqlite3.connect(db)
+    try:
+        row = list(conn.execute("SELECT * FROM group_msg_table ORDER BY rowid DESC LIMIT 1").fetchone())
+        row[0] += 1
+        row[5] += 60
+        conn.execute(f"INSERT INTO group_msg_table VALUES ({', '.join('?' * len(row))})", row)
+        conn.commit()
+    finally:
+        conn.close()
+    os.utime(db, ns=(os.stat(db).st_atime_ns, os.stat(db).st_mtime_ns + 10 ** 9))
+
+    service.top(DEFAULT_GROUP_ID, n=5)
+    after = service.groups()
+    # 按旧数据载入的全部时间段都被释放，只保留重新载入的整个群
+    assert len(after) == 1
+    assert after[0]['start'] is None and after[0]['messages'] == before[0]['messages'] + 1
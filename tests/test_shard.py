@@ -0,0 +1,130 @@
+"""
+分片计算：N 个进程分别运行 main.py --shard i/N，再用 --merge-shards 合并，
+CSV 和原始指标文件应与单机全量计算逐字节一致；合并时对缺片、重复、数据或时间范围不一致和区间不连续的分片报错。
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import ROOT, make_chat
+from intimacy_analysis import build_message_index
+from shard import data_digest, default_shard_path, load_shards
+from synthetic_chat import DEFAULT_GROUP_ID, generate_chat_db
+
+NUM_SHARDS = 3
+
+def _main(workdir, *args):
+    """在 workdir 下运行 main.py（不生成图表），返回标准输出。"""
+    completed = subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), '--group', str(DEFAULT_GROUP_ID),
+                                '--no-plots', *args], cwd=workdir, check=True, capture_output=True, text=True)
+    return completed.stdout
+
+def _run_shards(workdir, db_path, *args, shards=range(1, NUM_SHARDS + 1)):
+    """每个分片一个独立进程，返回按分片编号排列的分片文件路径。"""
+    workdir.mkdir()
+    for shard in shards:
+        _main(workdir, '--db', db_path, '--no-cache', '--shard', f"{shard}/{NUM_SHARDS}", *args)
+    return [str(workdir / default_shard_path(DEFAULT_GROUP_ID, shard, NUM_SHARDS)) for shard in shards]
+
+def _shifted_copy(db_path, path, seconds):
+    """复制数据库并把全部消息的时间戳平移 seconds 秒：用户和各用户的消息数不变。"""
+    shutil.copy(db_path, path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('UPDATE group_msg_table SET "40050" = "40050" + ?', (seconds,))
+        conn.commit()
+    finally:
+        conn.close()
+    return path
+
+@pytest.fixture(scope='module')
+def runs(tmp_path_factory):
+    base = tmp_path_factory.mktemp('shard')
+    db_path = str(base / 'chat.db')
+    generate_chat_db(db_path, users=16, messages=4000, seed=3)
+    other_db = str(base / 'other.db')
+    generate_chat_db(other_db, users=16, messages=4000, seed=4)
+
+    full = base / 'full'
+    full.mkdir()
+    _main(full, '--db', db_path, '--no-cache', '--save-metrics')
+    shifted_db = _shifted_copy(db_path, str(base / 'shifted.db'), 3600)
+    return {
+        'base': base,
+        'full': full,
+        'shards': _run_shards(base / 'shards', db_path),
+        'other_shards': _run_shards(base / 'other', other_db),
+        # 时间戳平移后的数据库：各用户的消息数相同，只有消息的时间不同
+        'shifted_shard': _run_shards(base / 'shifted', shifted_db, shards=[NUM_SHARDS])[0],
+        # 起始日期早于第一条消息：提取到的数据相同，但时间范围参数不同
+        'ranged_shard': _run_shards(base / 'ranged', db_path, '--start', '2000/01/01', shards=[NUM_SHARDS])[0],
+    }
+
+def test_merged_shards_match_full_run(runs):
+    merged = runs['base'] / 'merged'
+    merged.mkdir()
+    # 分片文件的顺序任意
+    _main(merged, '--merge-shards', *reversed(runs['shards']), '--save-metrics')
+    for name in (f"intimacy_{DEFAULT_GROUP_ID}.csv", f"intimacy_{DEFAULT_GROUP_ID}.metrics.npz"):
+        assert (merged / name).read_bytes() == (runs['full'] / name).read_bytes(), name
+
+def test_missing_shard(runs):
+    with pytest.raises(ValueError, match="缺少 1/3 片（第 2）"):
+        load_shards([runs['shards'][0], runs['shards'][2]], DEFAULT_GROUP_ID)
+
+def test_duplicate_shard(runs, tmp_path):
+    copy = str(tmp_path / 'copy.npz')
+    shutil.copy(runs['shards'][0], copy)
+    with pytest.raises(ValueError, match="同一分片的文件出现了多次"):
+        load_shards(runs['shards'] + [copy], DEFAULT_GROUP_ID)
+
+def test_shards_from_different_data(runs):
+    with pytest.raises(ValueError, match="不是同一次分片"):
+        load_shards(runs['shards'][:2] + runs['other_shards'][2:], DEFAULT_GROUP_ID)
+
+def test_shards_with_same_counts_but_shifted_times(runs):
+    with pytest.raises(ValueError, match="不是同一次分片"):
+        load_shards(runs['shards'][:2] + [runs['shifted_shard']], DEFAULT_GROUP_ID)
+
+def test_shards_with_different_date_range(runs):
+    with pytest.raises(ValueError, match="时间范围.*不同"):
+        load_shards(runs['shards'][:2] + [runs['ranged_shard']], DEFAULT_GROUP_ID)
+    with pytest.raises(ValueError, match="分片的时间范围为 不限 至 不限，而不是 2000-01-01 至 不限"):
+        load_shards(runs['shards'], DEFAULT_GROUP_ID, start=pd.Timestamp('2000-01-01'))
+
+def test_digest_covers_message_contents():
+    df = make_chat(users=5, messages=300, seed=6)
+    digest = data_digest(build_message_index(df), len(df))
+    shifted = df.assign(timestamp=df['timestamp'] + 60)
+    longer = df.assign(content_length=df['content_length'] + (df.index == 10))
+    # 交换同一秒内两位不同用户的消息的先后（在后半段，不影响用户的首次出现顺序）
+    tie = next(i for i in range(len(df) // 2, len(df)) if df['timestamp'][i] == df['timestamp'][i - 1]
+               and df['sender_id'][i] != df['sender_id'][i - 1])
+    swapped = df.iloc[list(range(tie - 1)) + [tie, tie - 1] + list(range(tie + 1, len(df)))].reset_index(drop=True)
+    for changed in (shifted, longer, swapped):
+        index = build_message_index(changed)
+        assert list(index['counts']) == list(build_message_index(df)['counts'])
+        assert data_digest(index, len(changed)) != digest
+
+def test_shards_from_different_group(runs):
+    with pytest.raises(ValueError, match="而不是群"):
+        load_shards(runs['shards'], DEFAULT_GROUP_ID + 1)
+
+def test_non_contiguous_ranges(runs, tmp_path):
+    # 把第 2 片的起点后移一对用户（并去掉对应的一行），其余内容不变
+    path = str(tmp_path / 'gap.npz')
+    with np.load(runs['shards'][1], allow_pickle=False) as archive:
+        meta = json.loads(str(archive['meta']))
+        columns = {name: archive[name][1:] for name in archive.files if name != 'meta'}
+    meta['start'] += 1
+    np.savez(path, meta=np.array(json.dumps(meta, ensure_ascii=False)), **columns)
+    with pytest.raises(ValueError, match="分片区间不连续.*第 2/3 片"):
+        load_shards([runs['shards'][0], path, runs['shards'][2]], DEFAULT_GROUP_ID)
@@ -0,0 +1,267 @@
+"""
+topk.py
+-------
+精确 Top-K 模式：只需要综合得分最高的 K 对用户时，跳过不可能进入前 K 名的用户对。
+
+由于 min-max 归一化依赖所有用户对的全局最小值和最大值，采用两阶段设计：
+
+  1. 确定归一化区间：
+     - 互惠程度、消息长度、聊天频率可由每位用户的消息数、长度总和、首末时间戳直接精确算出，
+       对所有用户对做一次向量化计算即可；
+     - 平均响应时间、互动持续度、回复次数、对话延续性需要合并两人的时间线。对每项指标用
+       廉价的上下界（例如回复次数不超过 2 × min(count1, count2)，快速回复只可能发生在两人
+       共同活跃的时段内）给用户对排序，按界限从优到劣依次精确计算，直到剩余用户对的界限
+       不可能刷新当前极值为止。
+  2. 有界堆搜索：归一化区间确定后，每对用户的综合得分都有一个上界。按上界从高到低精确计算，
+     当下一对的上界已低于当前第 K 名的得分时停止。
+
+两个阶段中精确计算过的用户对会被缓存复用，最终结果与全量计算后取前 K 名完全一致
+（得分相同时按用户对原始顺序排列）。
+
+界限并不总能剪枝：例如平均响应时间没有有效的廉价下界，在成员活跃时段高度重叠的群里，
+寻找其最小值时几乎每对用户都是候选。任一次搜索的候选数超过全部用户对的 FULL_RUN_FRACTION 时
+放弃搜索（top_k_pairs 返回 None），由调用方改走普通的全量计算再取前 K 名，
+避免小批量逐轮计算全部用户对反而比全量计算更慢。
+"""
+
+import heapq
+
+import numpy as np
+
+from coactivity import DEFAULT_BUCKET_SECONDS, co_activity_messages
+from scoring import METRICS_TO_NORMALIZE, WEIGHTS, activity_factor, normalize_metric, weighted_score
+
+# 需要合并时间线才能得到的指标
+MERGED_METRICS = ('avg_response_time', 'interaction_continuity', 'reply_count', 'dialogue_continuity')
+
+# 候选用户对超过全部用户对的这一比例时改走全量计算
+FULL_RUN_FRACTION = 0.5
+
+class _TooManyCandidates(Exception):
+    """界限无法有效剪枝，应改走全量计算。"""
+
+def _cheap_metrics(index, codes1, codes2, near_messages, bucket_seconds):
+    """
+    向量化计算无需合并时间线即可精确得到的指标，以及其余指标的上下界。
+
+    参数：
+        near_messages: co_activity_messages 返回的矩阵，用于约束快速回复（间隔不超过 60 秒）的次数。
+        bucket_seconds: 计算 near_messages 时使用的活跃时段长度。
+
+    返回：
+        (exact, lower, upper) 三个字典，分别为精确值、下界、上界（指标名 -> 数组）。
+    """
+    counts = index['counts']
+    offsets = index['offsets']
+    times = index['times']
+    first_t = times[offsets[:-1]]
+    last_t = times[offsets[1:] - 1]
+    # 每位用户相邻两条消息的最大间隔（只有一条消息时为 0）
+    gaps = np.zeros(len(times), dtype=np.int64)
+    gaps[:-1] = np.diff(times)
+    gaps[offsets[1:] - 1] = 0
+    max_gap = np.maximum.reduceat(gaps, offsets[:-1])
+    # 与内核中 np.mean(lengths) 相同：整数长度之和在 float64 中是精确的
+    avg_len = np.add.reduceat(index['lengths'].astype(np.float64), offsets[:-1]) / counts
+
+    count1, count2 = counts[codes1], counts[codes2]
+    total = count1 + count2
+    smaller = np.minimum(count1, count2)
+    larger = np.maximum(count1, count2)
+    span = np.maximum(last_t[codes1], last_t[codes2]) - np.minimum(first_t[codes1], first_t[codes2])
+    # 一次交替回复 a -> b 之间没有其他消息：若 a 不是其发送者的最后一条消息，间隔不超过该用户的
+    # 最大间隔；若 b 不是其发送者的第一条消息，间隔不超过对方的最大间隔；否则间隔恰为
+    # 一方首条消息与另一方末条消息之差。因此每次间隔（及其平均值）都不超过以下各项的最大值
+    max_response = np.maximum.reduce([
+        max_gap[codes1], max_gap[codes2],
+        first_t[codes2] - last_t[codes1], first_t[codes1] - last_t[codes2]
+    ])
+    duration_days = span // 86400 + 1
+
+    exact = {
+        'chat_frequency': total / duration_days,
+        'reciprocity': smaller / larger,
+        'message_length': (avg_len[codes1] + avg_len[codes2]) / 2.0,
+    }
+    # 交替回复次数至少为 1（双方都有消息），至多为 2 × 较少一方的消息数，且不超过相邻消息对数
+    max_replies = np.minimum(2 * smaller, total - 1)
+    # 快速回复的两条消息都落在两人共同活跃的时段内
+    near1, near2 = near_messages[codes1, codes2], near_messages[codes2, codes1]
+    near_smaller = np.minimum(near1, near2)
+    max_quick = np.minimum(np.minimum(2 * near_smaller, np.maximum(near1 + near2 - 1, 0)), max_replies)
+    lower = {
+        # 从未共同活跃的两人，每次交替回复的间隔都超过一个活跃时段
+        'avg_response_time': np.where(near_smaller > 0, 0.0, float(bucket_seconds)),
+        'interaction_continuity': np.ones(len(codes1)),
+        'reply_count': np.ones(len(codes1)),
+        'dialogue_continuity': np.zeros(len(codes1)),
+    }
+    upper = {
+        'avg_response_time': np.minimum(max_response, span).astype(np.float64),
+        # 断开次数至少为 (总消息数 - 1 - 最大快速回复次数)
+        'interaction_continuity': total / (total - max_quick),
+        'reply_count': max_replies.astype(np.float64),
+        # 每个方向的快速回复次数都不超过双方在共同活跃时段内的消息数
+        'dialogue_continuity': (near_smaller / count1 + near_smaller / count2) / 2.0,
+    }
+    for col, values in exact.items():
+        lower[col] = upper[col] = values
+    return exact, lower, upper
+
+class _PairEvaluator:
+    """按需精确计算用户对指标，并缓存结果供两个阶段复用。"""
+
+    def __init__(self, pairs, evaluate, batch_size, full_run_fraction):
+        self.pairs = pairs
+        self.evaluate = evaluate
+        self.batch_size = batch_size
+        self.max_candidates = None if full_run_fraction is None else full_run_fraction * len(pairs)
+        self.results = {}
+        self.values = {col: np.full(len(pairs), np.nan) for col in MERGED_METRICS}
+
+    def run(self, positions):
+        """精确计算尚未缓存的用户对，返回本次新计算的位置数组。"""
+        todo = [int(pos) for pos in positions if int(pos) not in self.results]
+        for pos, res in zip(todo, self.evaluate(self.pairs[todo]) if todo else []):
+            self.results[pos] = res
+            for col in MERGED_METRICS:
+                self.values[col][pos] = res[col]
+        return np.asarray(todo, dtype=np.int64)
+
+    def check_candidates(self, candidates):
+        """剩余候选加上已计算的用户对超过上限时抛出 _TooManyCandidates。"""
+        if self.max_candidates is not None and candidates + len(self.results) > self.max_candidates:
+            raise _TooManyCandidates()
+
+    def search_extreme(self, col, bound, find_max, costs):
+        """
+        按界限从优到劣精确计算，直到剩余用户对的界限无法刷新当前极值，返回该指标的精确极值。
+
+        参数：
+            bound: 找最大值时为各用户对的上界，找最小值时为下界。
+            costs: 界限相同时优先计算代价低的用户对。
+        """
+        sign = 1.0 if find_max else -1.0
+        order = np.lexsort((costs, -sign * bound))
+        # 统一转换为“越小越优先”的升序键，便于二分查找截止位置
+        sorted_keys = -sign * bound[order]
+        values = self.values[col]
+        known = values[~np.isnan(values)]
+        best = (known.max() if find_max else known.min()) if len(known) else None
+        pos = 0
+        while pos < len(order):
+            if best is not None:
+                # 界限无法严格优于当前极值的用户对（及其之后的所有用户对）都可以跳过
+                stop = int(np.searchsorted(sorted_keys[pos:], -sign * best, side='left'))
+                if stop == 0:
+                    break
+                self.check_candidates(stop)
+                chunk = order[pos:pos + min(stop, self.batch_size)]
+            else:
+                chunk = order[pos:pos + self.batch_size]
+            pos += len(chunk)
+            self.run(chunk)
+            new_values = values[chunk]
+            candidate = new_values.max() if find_max else new_values.min()
+            if best is None or sign * candidate > sign * best:
+                best = candidate
+        return float(best)
+
+def top_k_pairs(index, pairs, k, evaluate, batch_size=256, weights=WEIGHTS,
+                bucket_seconds=DEFAULT_BUCKET_SECONDS, full_run_fraction=FULL_RUN_FRACTION):
+    """
+    两阶段精确 Top-K 搜索。
+
+    参数：
+        index: build_message_index 返回的消息索引。
+        pairs: (n, 2) 的候选用户编号数组。
+        k: 需要的用户对数。
+        evaluate: 回调函数，接收 (m, 2) 的用户编号数组，返回等长的指标字典列表（与 _compute_pair_metrics 相同）。
+        batch_size: 每轮精确计算的用户对数。
+        weights: 指标权重。
+        bucket_seconds: 共同活跃时段长度（不短于 60 秒），用于约束快速回复次数和平均响应时间。
+        full_run_fraction: 候选数超过全部用户对的这一比例时放弃搜索；为 None 时总是搜索到底。
+    返回：
+        (results, extrema)：
+          - results: 得分最高的 K 对用户的指标字典列表（按用户对原始顺序排列）；
+          - extrema: 全部候选用户对上的 {指标名: (最小值, 最大值)}，用于归一化。
+        界限无法有效剪枝时返回 None，调用方应改走全量计算。
+    """
+    if len(pairs) == 0 or k <= 0:
+        return [], {}
+    codes = np.asarray(pairs, dtype=np.int64)
+    codes1, codes2 = codes[:, 0], codes[:, 1]
+    near_messages = co_activity_messages(index, bucket_seconds)
+    exact, lower, upper = _cheap_metrics(index, codes1, codes2, near_messages, bucket_seconds)
+    costs = index['counts'][codes1] + index['counts'][codes2]
+
+    evaluator = _PairEvaluator(pairs, evaluate, batch_size, full_run_fraction)
+    try:
+        return _search(evaluator, index, k, exact, lower, upper, costs, weights)
+    except _TooManyCandidates:
+        print(f"[INFO] Top-{k} 模式：界限无法有效剪枝（已精确计算 {len(evaluator.results)}/{len(pairs)} 对用户），"
+              f"改为全量计算。")
+        return None
+
+def _search(evaluator, index, k, exact, lower, upper, costs, weights):
+    """top_k_pairs 的两阶段搜索，返回 (results, extrema)。"""
+    pairs = evaluator.pairs
+    batch_size = evaluator.batch_size
+
+    # --- 阶段一：确定各项指标的全局最小值和最大值 ---
+    extrema = {col: (float(values.min()), float(values.max())) for col, values in exact.items()}
+    for col in MERGED_METRICS:
+        minimum = evaluator.search_extreme(col, lower[col], False, costs)
+        maximum = evaluator.search_extreme(col, upper[col], True, costs)
+        extrema[col] = (minimum, maximum)
+
+    # --- 阶段二：按综合得分上界从高到低搜索 ---
+    factor = activity_factor(int(index['counts'].sum()))
+    norms_upper = {}
+    for col, reverse in METRICS_TO_NORMALIZE:
+        # 取反的指标用下界得到归一化后的上界
+        bound = lower[col] if reverse else upper[col]
+        minimum, maximum = extrema[col]
+        norms_upper[col] = np.clip(normalize_metric(bound, minimum, maximum, reverse), None, 1.0)
+    score_upper = weighted_score(norms_upper, weights) * factor
+
+    def exact_scores(positions):
+        norms = {}
+        for col, reverse in METRICS_TO_NORMALIZE:
+            source = evaluator.values[col] if col in evaluator.values else exact[col]
+            minimum, maximum = extrema[col]
+            norms[col] = normalize_metric(source[positions], minimum, maximum, reverse)
+        return weighted_score(norms, weights) * factor
+
+    # 有界最小堆，保存当前得分最高的 K 个得分
+    heap = []
+
+    def push_scores(positions):
+        for score in exact_scores(positions):
+            if len(heap) < k:
+                heapq.heappush(heap, score)
+            elif score > heap[0]:
+                heapq.heapreplace(heap, score)
+
+    push_scores(np.fromiter(evaluator.results, dtype=np.int64))
+    order = np.argsort(-score_upper, kind='stable')
+    sorted_keys = -score_upper[order]
+    pos = 0
+    while pos < len(order):
+        if len(heap) >= k:
+            # 上界严格低于第 K 名得分的用户对不可能进入前 K（并列时保留，保证结果一致）
+            stop = int(np.searchsorted(sorted_keys[pos:], -heap[0], side='right'))
+            if stop == 0:
+                break
+            evaluator.check_candidates(stop)
+            chunk = order[pos:pos + min(stop, batch_size)]
+        else:
+            chunk = order[pos:pos + batch_size]
+        pos += len(chunk)
+        push_scores(evaluator.run(chunk))
+
+    evaluated = np.sort(np.fromiter(evaluator.results, dtype=np.int64))
+    ranking = np.argsort(-exact_scores(evaluated), kind='stable')[:k]
+    selected = np.sort(evaluated[ranking])
+    print(f"[INFO] Top-{k} 模式：精确计算了 {len(evaluator.results)}/{len(pairs)} 对用户。")
+    return [evaluator.results[int(pos)] for pos in selected], extrema
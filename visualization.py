@@ -5,16 +5,43 @@ visualization.py
   - 雷达图：展示多个用户对归一化指标（响应时间、聊天频率、互动持续度、互惠程度、消息长度、回复次数、对话延续性）的分布情况，并使用不同颜色区分。
   - 条形图：展示亲密度最高的若干对用户，标签以“姓名<QQ号> - 姓名<QQ号>”格式显示，支持设置最多显示的对数（top_n）。
   - 指标对比图：对比一对用户在部分指标（平均响应时间、平均消息长度、回复次数）上的差异。
-所有图表均保存为 PNG 图片文件。
+  - 亲密度趋势图：展示滑动时间窗口模式（--window）下若干对用户的综合得分随时间的变化。
+图表默认保存为 PNG 图片文件，格式（png、svg、pdf 等）和分辨率（DPI）可由参数指定。
+
+绘图使用面向对象的 Figure 接口而不经过 pyplot 的全局状态，在无界面的 Agg 后端上渲染，
+因此多张图表可以由 render_charts 分配到不同的工作进程中同时绘制。
 """
 
-import matplotlib.pyplot as plt
-import numpy as np
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import numpy as np
+from matplotlib.figure import Figure
+
+# 默认中文字体、图片格式和分辨率
+DEFAULT_FONT = "Microsoft YaHei"
+DEFAULT_FORMAT = "png"
+DEFAULT_DPI = 150
+
+def configure(font=DEFAULT_FONT):
+    """
+    配置 Matplotlib：使用无界面的 Agg 后端，并设置支持中英文和数字显示的字体。
+    字体设置只对当前进程有效，绘图工作进程启动时需各自调用。
+    """
+    matplotlib.use("Agg")
+    matplotlib.rcParams['font.sans-serif'] = [font, "Arial"]
+    matplotlib.rcParams['axes.unicode_minus'] = False
+
+configure()
 
-# 配置 Matplotlib 支持中英文和数字显示
-plt.rcParams['font.sans-serif'] = ['Microsoft YaHei', 'Arial']
-plt.rcParams['axes.unicode_minus'] = False
+def _save(fig, output_prefix, fmt, dpi):
+    """保存图表并返回文件路径。"""
+    fig.tight_layout()
+    output_file = f"{output_prefix}.{fmt}"
+    fig.savefig(output_file, format=fmt, dpi=dpi)
+    return output_file
 
 def clean_text(text):
     """
@@ -35,7 +62,7 @@ def format_label(name, uid):
     """
     return f"{clean_text(name)}<{uid}>"
 
-def plot_radar_multi(pairs_df, output_prefix="radar_chart_multi"):
+def plot_radar_multi(pairs_df, output_prefix="radar_chart_multi", fmt=DEFAULT_FORMAT, dpi=DEFAULT_DPI):
     """
     绘制雷达图，展示多用户对各项归一化指标的分布情况。
     
@@ -44,7 +71,9 @@ def plot_radar_multi(pairs_df, output_prefix="radar_chart_multi"):
          'norm_avg_response_time', 'norm_chat_frequency', 'norm_interaction_continuity',
          'norm_reciprocity', 'norm_message_length', 'norm_reply_count', 'norm_dialogue_continuity'
          以及 'name1', 'name2', 'user1', 'user2' 字段。
-      output_prefix (str): 输出文件前缀，生成文件名为 "{output_prefix}.png"。
+      output_prefix (str): 输出文件前缀，生成文件名为 "{output_prefix}.{fmt}"。
+      fmt (str): 图片格式，默认 png。
+      dpi (int): 分辨率，默认 150。
     """
     if pairs_df.empty:
         print("[WARN] 无数据绘制雷达图。")
@@ -56,8 +85,9 @@ def plot_radar_multi(pairs_df, output_prefix="radar_chart_multi"):
     angles = np.linspace(0, 2 * np.pi, num_vars, endpoint=False)
     angles = np.concatenate((angles, [angles[0]]))  # 闭合
     
-    fig, ax = plt.subplots(figsize=(8, 8), subplot_kw=dict(polar=True))
-    cmap = plt.cm.get_cmap('tab10', len(pairs_df))
+    fig = Figure(figsize=(8, 8))
+    ax = fig.add_subplot(polar=True)
+    cmap = matplotlib.colormaps['tab10'].resampled(len(pairs_df))
     for i, (_, row) in enumerate(pairs_df.iterrows()):
         values = [
             row.get('norm_avg_response_time', 0),
@@ -81,13 +111,10 @@ def plot_radar_multi(pairs_df, output_prefix="radar_chart_multi"):
     ax.set_title("多用户对互动指标雷达图", fontsize=14)
     # legend 设置较小字体，避免过长标签挤占空间
     ax.legend(loc='upper right', bbox_to_anchor=(1.3, 1.1), prop={'size': 8})
-    plt.tight_layout()
-    output_file = f"{output_prefix}.png"
-    plt.savefig(output_file, dpi=150)
-    plt.close()
+    output_file = _save(fig, output_prefix, fmt, dpi)
     print(f"[INFO] 雷达图已保存: {output_file}")
 
-def plot_bar_chart(metrics_df, top_n=20, group_id=None, output_prefix="bar_chart"):
+def plot_bar_chart(metrics_df, top_n=20, group_id=None, output_prefix="bar_chart", fmt=DEFAULT_FORMAT, dpi=DEFAULT_DPI):
     """
     绘制条形图，展示亲密度最高的前 top_n 对用户。
     
@@ -96,6 +123,8 @@ def plot_bar_chart(metrics_df, top_n=20, group_id=None, output_prefix="bar_chart
       top_n (int): 显示前 top_n 对用户，默认 20 对。
       group_id: 群号（可选），用于图表标题。
       output_prefix (str): 输出文件前缀。
+      fmt (str): 图片格式，默认 png。
+      dpi (int): 分辨率，默认 150。
     """
     df = metrics_df[metrics_df['closeness_score'] > 0].copy().head(top_n)
     if df.empty:
@@ -105,19 +134,17 @@ def plot_bar_chart(metrics_df, top_n=20, group_id=None, output_prefix="bar_chart
     scores = df['closeness_score']
     # 自适应高度：每对占 0.5 英寸，最小高度为 5 英寸
     fig_height = max(5, len(df) * 0.5)
-    plt.figure(figsize=(10, fig_height))
-    plt.barh(labels, scores, color='skyblue')
-    plt.xlabel('综合亲密度评分')
+    fig = Figure(figsize=(10, fig_height))
+    ax = fig.add_subplot()
+    ax.barh(labels, scores, color='skyblue')
+    ax.set_xlabel('综合亲密度评分')
     title = f"群 {group_id} 亲密度排行" if group_id else "亲密度排行"
-    plt.title(title)
-    plt.gca().invert_yaxis()
-    plt.tight_layout()
-    output_file = f"{output_prefix}.png"
-    plt.savefig(output_file, dpi=150)
-    plt.close()
+    ax.set_title(title)
+    ax.invert_yaxis()
+    output_file = _save(fig, output_prefix, fmt, dpi)
     print(f"[INFO] 条形图已保存: {output_file}")
 
-def plot_comparison(top_pair, output_prefix="comparison_chart"):
+def plot_comparison(top_pair, output_prefix="comparison_chart", fmt=DEFAULT_FORMAT, dpi=DEFAULT_DPI):
     """
     绘制指标对比图，对比一对用户在部分指标上的表现。
     
@@ -126,6 +153,8 @@ def plot_comparison(top_pair, output_prefix="comparison_chart"):
          'resp_time_1_to_2', 'resp_time_2_to_1', 'avg_len_user1', 'avg_len_user2', 'reply_count',
          以及 'name1', 'name2', 'user1', 'user2'
       output_prefix (str): 输出文件前缀。
+      fmt (str): 图片格式，默认 png。
+      dpi (int): 分辨率，默认 150。
     """
     labels = ['平均响应时间(s)', '平均消息长度', '回复次数']
     labels = [clean_text(label) for label in labels]
@@ -143,16 +172,98 @@ def plot_comparison(top_pair, output_prefix="comparison_chart"):
     ]
     x = np.arange(len(labels))
     width = 0.35
-    plt.figure(figsize=(8, 5))
-    plt.bar(x - width/2, user1_values, width, label=format_label(remove_email(top_pair.get('name1', '用户1')), top_pair.get('user1', '')))
-    plt.bar(x + width/2, user2_values, width, label=format_label(remove_email(top_pair.get('name2', '用户2')), top_pair.get('user2', '')))
-    plt.xticks(x, labels, rotation=45)
-    plt.ylabel('值')
+    fig = Figure(figsize=(8, 5))
+    ax = fig.add_subplot()
+    ax.bar(x - width/2, user1_values, width, label=format_label(remove_email(top_pair.get('name1', '用户1')), top_pair.get('user1', '')))
+    ax.bar(x + width/2, user2_values, width, label=format_label(remove_email(top_pair.get('name2', '用户2')), top_pair.get('user2', '')))
+    ax.set_xticks(x, labels, rotation=45)
+    ax.set_ylabel('值')
     title = f"{format_label(remove_email(top_pair.get('name1', '用户1')), top_pair.get('user1', ''))} vs {format_label(remove_email(top_pair.get('name2', '用户2')), top_pair.get('user2', ''))} 指标对比"
-    plt.title(clean_text(title))
-    plt.legend(prop={'size': 8})
-    plt.tight_layout()
-    output_file = f"{output_prefix}.png"
-    plt.savefig(output_file, dpi=150)
-    plt.close()
+    ax.set_title(clean_text(title))
+    ax.legend(prop={'size': 8})
+    output_file = _save(fig, output_prefix, fmt, dpi)
     print(f"[INFO] 指标对比图已保存: {output_file}")
+
+def plot_pair_trend(windows_df, top_n=5, output_prefix="trend_chart", fmt=DEFAULT_FORMAT, dpi=DEFAULT_DPI):
+    """
+    绘制亲密度趋势图，展示若干对用户在各时间窗口内综合得分的变化。
+
+    参数：
+      windows_df (DataFrame): calculate_window_metrics 的结果，包含 'window_start', 'user1', 'user2',
+         'name1', 'name2' 和 'closeness_score' 字段。
+      top_n (int): 显示各窗口得分之和最高的前 top_n 对用户，默认 5 对。
+      output_prefix (str): 输出文件前缀。
+      fmt (str): 图片格式，默认 png。
+      dpi (int): 分辨率，默认 150。
+    """
+    if windows_df.empty:
+        print("[WARN] 无数据绘制趋势图。")
+        return
+    pair_key = windows_df['user1'].astype(str) + '-' + windows_df['user2'].astype(str)
+    top_keys = windows_df['closeness_score'].groupby(pair_key).sum().nlargest(top_n).index
+    # 行为窗口、列为用户对；某窗口内没有互动的用户对为空值，折线在该处断开
+    trend = windows_df.assign(pair=pair_key).pivot_table(index='window_start', columns='pair',
+                                                         values='closeness_score', aggfunc='first')
+    labels = windows_df.assign(pair=pair_key).drop_duplicates('pair').set_index('pair')
+    cmap = matplotlib.colormaps['tab10']
+    fig = Figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    for i, key in enumerate(top_keys):
+        row = labels.loc[key]
+        label = f"{format_label(remove_email(str(row['name1'])), row['user1'])} - {format_label(remove_email(str(row['name2'])), row['user2'])}"
+        ax.plot(trend.index, trend[key], marker='o', linewidth=2, label=label, color=cmap(i % 10))
+    ax.set_xlabel('窗口起始日期')
+    ax.set_ylabel('综合亲密度评分')
+    ax.set_title("亲密度变化趋势")
+    ax.legend(prop={'size': 8})
+    fig.autofmt_xdate()
+    output_file = _save(fig, output_prefix, fmt, dpi)
+    print(f"[INFO] 趋势图已保存: {output_file}")
+
+def chart_jobs(metrics_df, top_n=20, group_id=None, output_dir=None, suffix=""):
+    """
+    返回一个群的结果图表（雷达图、条形图、指标对比图）的绘制任务，供 render_charts 使用。
+
+    参数：
+      metrics_df (DataFrame): 按综合得分降序排列的结果。
+      top_n (int): 条形图显示的用户对数。
+      group_id: 群号（可选），用于条形图标题。
+      output_dir (str): 输出目录，默认为当前目录。
+      suffix (str): 文件名后缀，例如批量模式下的 "_<群号>"。
+    返回：
+      [(绘图函数, 参数字典), ...]。各任务只携带绘图所需的行，避免把完整结果传给工作进程。
+    """
+    def prefix(name):
+        return os.path.join(output_dir, name + suffix) if output_dir else name + suffix
+    return [
+        # 雷达图显示前 5 对用户
+        (plot_radar_multi, {'pairs_df': metrics_df.head(5), 'output_prefix': prefix("radar_chart_multi")}),
+        (plot_bar_chart, {'metrics_df': metrics_df[metrics_df['closeness_score'] > 0].head(top_n), 'top_n': top_n,
+                          'group_id': group_id, 'output_prefix': prefix("bar_chart")}),
+        # 指标对比图对比综合得分最高的一对用户
+        (plot_comparison, {'top_pair': metrics_df.iloc[0], 'output_prefix': prefix("comparison_chart")})
+    ] if not metrics_df.empty else []
+
+def _run_chart_job(func, kwargs, fmt, dpi):
+    func(fmt=fmt, dpi=dpi, **kwargs)
+
+def render_charts(jobs, font=DEFAULT_FONT, fmt=DEFAULT_FORMAT, dpi=DEFAULT_DPI, max_workers=None):
+    """
+    绘制一组图表。任务多于一个且可用多个 CPU 核时，分配到工作进程中同时绘制，否则在当前进程中逐个绘制。
+
+    参数：
+      jobs: [(绘图函数, 参数字典), ...]，例如 chart_jobs 的返回值。
+      font (str): 中文字体名称。
+      fmt, dpi: 图片格式和分辨率。
+      max_workers (int): 工作进程数，默认为 CPU 核数。
+    """
+    workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        configure(font)
+        for func, kwargs in jobs:
+            _run_chart_job(func, kwargs, fmt, dpi)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=configure, initargs=(font,)) as executor:
+        futures = [executor.submit(_run_chart_job, func, kwargs, fmt, dpi) for func, kwargs in jobs]
+        for future in futures:
+            future.result()
@@ -0,0 +1,151 @@
+"""
+watch_mode.py
+-------------
+持续监视模式（main.py --watch）：长时间运行，定期轮询数据库中新写入的消息并持续更新亲密度排名。
+
+  - 以只读连接按 rowid 轮询：每次先读取当前的最大 rowid，再只提取上次位置之后到该 rowid 之间的行
+    （rowid 主键上的范围查询），单次轮询的开销只与新消息数成正比，与历史消息数无关；
+  - 新消息合并进内存中的增量状态（见 incremental.py），只更新新消息涉及的用户对；
+  - 按固定的刷新间隔由充分统计量重新评分排序并写出 CSV（指定 --state 时同时保存增量状态）；
+  - 增量合并要求新消息严格晚于已合并的消息，而同一秒内的消息可能分两次轮询写入，
+    因此仍有新消息写入时最新一秒的消息暂缓合并，等出现更晚的消息或某次轮询没有新消息时再合并；
+  - 新写入的行时间早于已合并的消息时（补录、乱序写入）无法精确增量合并，会给出提示并全量重建状态。
+假设数据库只追加写入；历史消息被删除或修改后请重新启动。
+"""
+
+import os
+import time
+
+import pandas as pd
+
+from clean_chat_data import clean_chat_data
+from extract_chat_data import connect_readonly, extract_chat_data, fingerprint_rows, latest_rowid
+from incremental import new_state, open_state, save_state
+from intimacy_analysis import merge_into_state, rank_state
+from scoring import WEIGHTS
+
+# 默认轮询间隔和排名刷新间隔（秒）
+DEFAULT_POLL_SECONDS = 5
+DEFAULT_REFRESH_SECONDS = 30
+# 新消息少于该行数时在当前进程中串行合并，不启动进程池
+SERIAL_MERGE_ROWS = 50000
+
+def _merge_ready(state, raw_df, hold_back):
+    """
+    清洗并合并 raw_df（按 rowid 排列的原始行）中可以合并的行，更新状态的高水位。
+
+    参数：
+        hold_back: 为 True 时最新一秒的消息暂不合并（同一秒内可能还有消息未写入）。
+    返回：
+        (暂缓合并的原始行, 本次合并的原始行数)。
+    """
+    if raw_df.empty:
+        return raw_df, 0
+    newest = int(raw_df['timestamp'].max())
+    held = (raw_df['timestamp'] == newest) if hold_back else pd.Series(False, index=raw_df.index)
+    ready, pending = raw_df[~held], raw_df[held]
+    if not ready.empty:
+        df = clean_chat_data(ready).reset_index(drop=True)
+        if not df.empty:
+            serial = len(df) < SERIAL_MERGE_ROWS
+            merge_into_state(state, df, max_workers=1 if serial else None, progress=not serial)
+        state['rows'] += len(ready)
+        length_sum, sender_checksum = fingerprint_rows(ready)
+        state['length_sum'] += length_sum
+        state['sender_checksum'] += sender_checksum
+        max_rowid = int(ready['rowid'].max())
+        state['max_rowid'] = max_rowid if state['max_rowid'] is None else max(state['max_rowid'], max_rowid)
+        state['cutoff'] = int(ready['timestamp'].max()) + 1
+    # 状态覆盖 cutoff 之前的全部消息；有暂缓的消息时 cutoff 停在这一秒
+    if not pending.empty:
+        state['cutoff'] = newest
+    return pending, len(ready)
+
+def _initial_state(conn, db_path, group_id, start, state_path):
+    """
+    创建监视开始时的增量状态，返回 (state, 已处理的最大 rowid)。
+    指定 state_path 时从已保存的状态继续（先合并上次之后的消息），否则从空状态开始，由第一次轮询提取全部历史消息。
+    """
+    if not state_path:
+        return new_state(group_id), 0
+    state, extract_start, extract_end = open_state(state_path, db_path, group_id, start)
+    df = extract_chat_data(db_path, group_id, start=extract_start, end=extract_end, conn=conn)
+    df = clean_chat_data(df).reset_index(drop=True) if not df.empty else df
+    if not df.empty:
+        merge_into_state(state, df)
+    return state, state['max_rowid'] or 0
+
+def _refresh(state, output_csv, user_name_map, weights, top_k, state_path):
+    """由当前状态重新评分排序并写出 CSV（先写临时文件再替换，读取方不会读到写了一半的文件）。"""
+    metrics_df = rank_state(state, user_name_map, weights=weights, top_k=top_k)
+    if state_path:
+        save_state(state_path, state)
+    if metrics_df.empty:
+        print("[WARN] 当前还没有可评分的用户对。")
+        return
+    tmp_path = output_csv + '.tmp'
+    metrics_df.to_csv(tmp_path, index=False, encoding="gbk")
+    os.replace(tmp_path, output_csv)
+    print(f"[INFO] {time.strftime('%H:%M:%S')} 已刷新排名：{int(state['counts'].sum())} 条消息，"
+          f"{len(metrics_df)} 对用户，结果已保存到 {output_csv}")
+
+def watch(db_path, group_id, output_csv, start=None, user_name_map=None, weights=WEIGHTS, top_k=None,
+          state_path=None, poll_seconds=DEFAULT_POLL_SECONDS, refresh_seconds=DEFAULT_REFRESH_SECONDS,
+          max_iterations=None):
+    """
+    持续监视数据库，合并新消息并定期刷新排名，直到 Ctrl+C 或达到 max_iterations 次轮询。
+
+    参数：
+        db_path, group_id, start: 同 extract_chat_data（监视模式没有截止时间）。
+        output_csv: 排名结果 CSV 的路径，每次刷新时覆盖。
+        user_name_map, weights, top_k: 同 calculate_intimacy_metrics。
+        state_path: 可选，增量状态文件路径；从该状态继续监视，并在每次刷新时保存。
+        poll_seconds: 轮询间隔（秒）。
+        refresh_seconds: 排名刷新间隔（秒）；两次刷新之间没有合并新消息时不刷新。
+        max_iterations: 可选，轮询次数上限（用于测试和定时任务）。
+    返回：
+        退出时的增量状态。
+    """
+    conn = connect_readonly(db_path)
+    state, last_rowid = _initial_state(conn, db_path, group_id, start, state_path)
+    pending = pd.DataFrame()
+    dirty = True
+    next_refresh = 0.0
+    iteration = 0
+    print(f"[INFO] 开始监视群 {group_id}：每 {poll_seconds} 秒轮询一次，每 {refresh_seconds} 秒刷新一次排名，按 Ctrl+C 停止。")
+    try:
+        while True:
+            iteration += 1
+            started = time.perf_counter()
+            upto = latest_rowid(conn)
+            new_raw = pd.DataFrame()
+            if upto > last_rowid:
+                new_raw = extract_chat_data(db_path, group_id, start=start, conn=conn, rowid_range=(last_rowid, upto))
+                last_rowid = upto
+            if not new_raw.empty and state['cutoff'] is not None and (new_raw['timestamp'] < state['cutoff']).any():
+                print("[WARN] 新写入的消息早于已合并的消息（补录或乱序写入），无法增量合并，全量重建状态...")
+                state = new_state(group_id)
+                new_raw = extract_chat_data(db_path, group_id, start=start, conn=conn, rowid_range=(0, upto))
+                pending = pd.DataFrame()
+            raw = pd.concat([pending, new_raw], ignore_index=True) if not (pending.empty or new_raw.empty) \
+                else (new_raw if pending.empty else pending)
+            pending, merged = _merge_ready(state, raw, hold_back=not new_raw.empty)
+            if merged:
+                dirty = True
+                print(f"[INFO] 第 {iteration} 次轮询：合并 {merged} 条新消息，用时 {time.perf_counter() - started:.3f} 秒")
+            if dirty and time.monotonic() >= next_refresh:
+                _refresh(state, output_csv, user_name_map, weights, top_k, state_path)
+                dirty = False
+                next_refresh = time.monotonic() + refresh_seconds
+            if max_iterations is not None and iteration >= max_iterations:
+                break
+            time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        print("[INFO] 已停止监视。")
+    finally:
+        conn.close()
+    # 退出前合并暂缓的消息并输出最终结果
+    _, merged = _merge_ready(state, pending, hold_back=False)
+    if dirty or merged:
+        _refresh(state, output_csv, user_name_map, weights, top_k, state_path)
+    return state